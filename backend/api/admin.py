@@ -6,6 +6,16 @@ from django import forms
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
+from decimal import Decimal
+from api.busqueda import coincidencias
+from api.saldos import cargos_del_fiado, descontar_fiados, registrar_movimiento
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Coalesce
+from django.forms.models import BaseInlineFormSet
+from django.http import QueryDict
+from django.utils.functional import cached_property
 
 from social_django.models import UserSocialAuth
 # Desregistrar el modelo original de social_django
@@ -140,16 +150,106 @@ class UserAdmin(BaseUserAdmin):
         js = ('admin/js/user_admin.js',)
 
 
+class PaginadorEstimado(Paginator):
+    """
+    Paginador del changelist que no cuenta la tabla completa: sin filtros ni
+    busqueda usa el numero de filas que estima la base de datos (pg_class en
+    PostgreSQL, sqlite_stat1 en SQLite despues de ANALYZE). Con filtros, o si la
+    tabla es chica o no hay estadisticas, hace el COUNT normal
+    """
+    minimo_estimado = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimado = estimar_filas(queryset.model)
+            if estimado is not None and estimado >= self.minimo_estimado:
+                return estimado
+        return super().count
+
+
+def estimar_filas(model):
+    tabla = model._meta.db_table
+    with connection.cursor() as cursor:
+        try:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [tabla])
+                fila = cursor.fetchone()
+                return fila[0] if fila and fila[0] >= 0 else None
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [tabla])
+                fila = cursor.fetchone()
+                return int(fila[0].split()[0]) if fila else None
+        except DatabaseError:
+            # sqlite_stat1 no existe hasta el primer ANALYZE
+            return None
+    return None
+
+
+class FormsetPaginado(BaseInlineFormSet):
+    """
+    Formset de un inline que muestra una sola pagina de filas. numero_pagina y
+    por_pagina los fija InlinePaginado.get_formset en la clase creada para la peticion
+    """
+    numero_pagina = 1
+    por_pagina = 50
+    parametro_pagina = 'pagina'
+    consulta = QueryDict()
+
+    def get_queryset(self):
+        if not hasattr(self, 'pagina'):
+            self.pagina = Paginator(super().get_queryset(), self.por_pagina).get_page(self.numero_pagina)
+            self._queryset = self.pagina.object_list
+        return self._queryset
+
+    def _enlace(self, numero):
+        consulta = self.consulta.copy()
+        consulta[self.parametro_pagina] = numero
+        return '?' + consulta.urlencode()
+
+    def enlace_anterior(self):
+        return self._enlace(self.pagina.previous_page_number()) if self.pagina.has_previous() else None
+
+    def enlace_siguiente(self):
+        return self._enlace(self.pagina.next_page_number()) if self.pagina.has_next() else None
+
+
+class InlinePaginado(admin.TabularInline):
+    """
+    Inline de solo lectura paginado con ?<parametro_pagina>=N en la pagina de edicion
+    """
+    formset = FormsetPaginado
+    template = 'admin/edit_inline/tabular_paginado.html'
+    por_pagina = 50
+    parametro_pagina = 'pagina'
+
+    def get_formset(self, request, obj=None, **kwargs):
+        # inlineformset_factory crea una clase nueva en cada llamada
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.numero_pagina = request.GET.get(self.parametro_pagina, 1)
+        formset.por_pagina = self.por_pagina
+        formset.parametro_pagina = self.parametro_pagina
+        formset.consulta = request.GET
+        return formset
+
+
 class DetalleFiadoInline(admin.TabularInline):
     model = DetalleFiado
     extra = 1
     fields = ('producto', 'cantidad')
     readonly_fields = ('producto', 'cantidad')
-class DeudaPendienteInline(admin.TabularInline):
+class DeudaPendienteInline(InlinePaginado):
     model = DeudaPendiente
     extra = 0
     fields = ('fecha_registro', 'productos', 'cantidad', 'interes', 'monto_total', 'abono')
     readonly_fields = fields
+    parametro_pagina = 'pagina_deudas'
+    ordering = ('fecha_registro', 'id')
+
+    def get_queryset(self, request):
+        # str(producto) muestra tambien su usuario
+        return super().get_queryset(request).select_related('productos__usuario')
     
     def has_add_permission(self, request, obj=None):
         return False
@@ -163,6 +263,9 @@ class FiadoAdmin(admin.ModelAdmin):
     search_fields = ('cliente__cliente_nombre', 'cliente__fiador__username', 'cliente__fiador__email')
     readonly_fields = ('deuda_total_display', 'fecha_registro_display')
     inlines = [DeudaPendienteInline]
+    paginator = PaginadorEstimado
+    # Evita el COUNT(*) de toda la tabla que el changelist hace para "(N en total)"
+    show_full_result_count = False
     
     fieldsets = (
         (None, {
@@ -176,6 +279,7 @@ class FiadoAdmin(admin.ModelAdmin):
     def cliente_info(self, obj):
         return obj.cliente.cliente_nombre
     cliente_info.short_description = 'Cliente'
+    cliente_info.admin_order_field = 'cliente__cliente_nombre'
 
     def fiador_info(self, obj):
         return f"{obj.cliente.fiador.username} ({obj.cliente.fiador.email})"
@@ -184,29 +288,86 @@ class FiadoAdmin(admin.ModelAdmin):
     def fecha_registro_display(self, obj):
         return obj.fecha_registro.strftime('%Y-%m-%d %H:%M')
     fecha_registro_display.short_description = 'Fecha de Registro'
+    fecha_registro_display.admin_order_field = 'fecha_registro'
 
     def monto_total_display(self, obj):
         return f"${obj.monto_total}"
     monto_total_display.short_description = 'Monto Total'
+    monto_total_display.admin_order_field = 'monto_total'
 
     def abono_display(self, obj):
         return f"${obj.abono if obj.abono else '0.00'}"
     abono_display.short_description = 'Abono'
 
     def deuda_total_display(self, obj):
-        deuda_total = float(obj.monto_total) - float(obj.abono if obj.abono else 0)
+        # deuda_total viene calculada en SQL por get_queryset
+        deuda_total = getattr(obj, 'deuda_total', None)
+        if deuda_total is None:
+            if obj.monto_total is None:
+                return '-'
+            deuda_total = obj.monto_total - (obj.abono or Decimal('0.00'))
         return f"${deuda_total:.2f}"
     deuda_total_display.short_description = 'Deuda Total'
+    deuda_total_display.admin_order_field = 'deuda_total'
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        El nombre del cliente se busca con el indice de api/busqueda.py en lugar de
+        icontains sobre el JOIN; usuario y email del fiador siguen con icontains
+        (la tabla de usuarios es mucho menor que la de fiados)
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        fiadores = User.objects.filter(
+            Q(username__icontains=search_term) | Q(email__icontains=search_term)
+        ).values('id')
+        return queryset.filter(
+            Q(cliente__in=coincidencias(Cliente, search_term).values('id')) | Q(cliente__fiador__in=fiadores)
+        ), False
 
     def get_readonly_fields(self, request, obj=None):
         if obj:  # Cuando se edita un objeto existente
             return self.readonly_fields + ('cliente', 'monto_total', 'interes')
         return self.readonly_fields
 
+    # Los cambios hechos en el admin tambien se registran en SaldoCliente/SaldoFiador,
+    # igual que los de la API (api/saldos.py)
+    def save_model(self, request, obj, form, change):
+        # changeform_view ya corre dentro de una transaccion
+        cero = Decimal('0.00')
+        anterior = Fiado.objects.filter(pk=obj.pk).only('monto_total', 'abono').first() if change else None
+        cargos, abonos = (cargos_del_fiado(anterior), anterior.abono or cero) if anterior else (cero, cero)
+        super().save_model(request, obj, form, change)
+        registrar_movimiento(obj.cliente, cargos=cargos_del_fiado(obj) - cargos, abonos=(obj.abono or cero) - abonos)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            descontar_fiados(Fiado.objects.filter(pk=obj.pk))
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            descontar_fiados(queryset)
+            super().delete_queryset(request, queryset)
+
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related(
-            'cliente', 'cliente__fiador'
-        ).prefetch_related('deuda_pendiente')
+        queryset = super().get_queryset(request)
+        # Solo en el listado: en la pagina de edicion save() escribiria solo los
+        # campos cargados y fecha_actualizacion (auto_now, base del ETag) no cambiaria
+        match = request.resolver_match
+        if match is None or match.url_name != f'{self.opts.app_label}_{self.opts.model_name}_changelist':
+            return queryset
+        # Una sola consulta con lo que muestra el listado: cliente y fiador por JOIN
+        # (solo las columnas usadas) y la deuda restada en la base de datos
+        return queryset.select_related('cliente__fiador').only(
+            'id', 'monto_total', 'abono', 'interes', 'fecha_registro', 'cliente_id',
+            'cliente__cliente_nombre', 'cliente__fiador_id',
+            'cliente__fiador__username', 'cliente__fiador__email',
+        ).annotate(deuda_total=ExpressionWrapper(
+            F('monto_total') - Coalesce(F('abono'), Value(Decimal('0.00'))),
+            output_field=DecimalField(max_digits=11, decimal_places=2),
+        ))
 # Registra los modelos
 admin.site.register(Fiado, FiadoAdmin)
 admin.site.register(User, UserAdmin)
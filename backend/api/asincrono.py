@@ -0,0 +1,91 @@
+"""
+Vistas asincronas de DRF para servir con ASGI (fiados/asgi.py).
+
+DRF 3.16 solo despacha vistas sincronas. AsyncDispatchMixin hace que la vista sea
+una corrutina para Django (view_is_async) y ejecuta la autenticacion, los permisos
+y el trabajo bloqueante (ORM, hash de contraseñas, plantillas de correo) en hilos
+con en_hilo(). Asi el event loop queda libre para las demas conexiones mientras
+una peticion espera a la base de datos.
+
+en_hilo() limita cuantas tareas bloqueantes corren a la vez por proceso
+(settings.ASYNC_MAX_BLOQUEANTES), para que una rafaga de peticiones no abra mas
+hilos ni conexiones a la base de datos de las que el servidor soporta.
+"""
+
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import generics
+from rest_framework.views import APIView
+
+# Un semaforo por event loop: en WSGI cada peticion asincrona corre en su propio loop
+_semaforos = weakref.WeakKeyDictionary()
+
+
+def _semaforo():
+    loop = asyncio.get_running_loop()
+    semaforo = _semaforos.get(loop)
+    if semaforo is None:
+        semaforo = asyncio.Semaphore(getattr(settings, 'ASYNC_MAX_BLOQUEANTES', 10))
+        _semaforos[loop] = semaforo
+    return semaforo
+
+
+async def en_hilo(funcion, *args, **kwargs):
+    """
+    Ejecuta una funcion bloqueante fuera del event loop. Usa thread_sensitive para
+    que toda la peticion use la misma conexion a la base de datos
+    """
+    async with _semaforo():
+        return await sync_to_async(funcion, thread_sensitive=True)(*args, **kwargs)
+
+
+class AsyncDispatchMixin:
+    """
+    Version asincrona de APIView.dispatch. Los handlers (post, get, ...) deben ser
+    `async def`
+    """
+    # Django decide con esto si as_view() devuelve una corrutina
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # Autenticacion (busca el usuario del JWT), permisos y throttling
+            await en_hilo(self.initial, request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), None)
+            else:
+                handler = None
+            if handler is None or not asyncio.iscoroutinefunction(handler):
+                handler = self._metodo_no_permitido
+
+            response = await handler(request, *args, **kwargs)
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def _metodo_no_permitido(self, request, *args, **kwargs):
+        return self.http_method_not_allowed(request, *args, **kwargs)
+
+    async def options(self, request, *args, **kwargs):
+        return await en_hilo(super().options, request, *args, **kwargs)
+
+
+class AsyncAPIView(AsyncDispatchMixin, APIView):
+    pass
+
+
+class AsyncGenericAPIView(AsyncDispatchMixin, generics.GenericAPIView):
+    pass
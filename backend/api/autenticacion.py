@@ -0,0 +1,205 @@
+"""
+Autenticacion JWT con una cache corta del usuario para las lecturas.
+
+JWTAuthentication carga el User de la base de datos en cada peticion. En
+GET/HEAD/OPTIONS JWTAutenticacionRapida reutiliza el User cargado por una peticion
+anterior durante JWT_USUARIO_CACHE_SEGUNDOS, en una LRU en memoria del proceso.
+Guardar o borrar el usuario la descarta solo en el proceso que lo hizo (api/
+signals.py); en los demas un cambio, como desactivarlo, tarda hasta ese tiempo
+en verse en las lecturas. Las escrituras siempre cargan el User de la base de
+datos, porque lo asignan a FKs o generan tokens con su contraseña y last_login.
+
+Los refresh tokens rotan en cada uso (rotar_refresh): el jti del token usado se
+guarda en TokenRevocado hasta que vence, con una LRU en memoria delante.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from api.models import TokenRevocado, User
+
+
+class CacheUsuarios:
+    """
+    LRU con vencimiento para los User cargados por JWTAutenticacionRapida.
+    Devuelve copias para que una peticion no modifique el objeto de otra
+    """
+
+    def __init__(self, maximo=1024):
+        self.maximo = maximo
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, user_id):
+        with self._lock:
+            entrada = self._datos.get(user_id)
+            if entrada is None:
+                return None
+            vence, user = entrada
+            if vence < time.monotonic():
+                del self._datos[user_id]
+                return None
+            self._datos.move_to_end(user_id)
+        return copy.copy(user)
+
+    def guardar(self, user, segundos):
+        with self._lock:
+            self._datos[user.pk] = (time.monotonic() + segundos, copy.copy(user))
+            self._datos.move_to_end(user.pk)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def descartar(self, user_id):
+        with self._lock:
+            self._datos.pop(user_id, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+usuarios_cacheados = CacheUsuarios()
+
+
+class JWTAutenticacionRapida(JWTAuthentication):
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+
+        if request.method in SAFE_METHODS:
+            return self.get_user_cacheado(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
+
+    def get_user_cacheado(self, validated_token):
+        segundos = getattr(settings, 'JWT_USUARIO_CACHE_SEGUNDOS', 30)
+        if not segundos:
+            return self.get_user(validated_token)
+        user = usuarios_cacheados.obtener(validated_token.get(api_settings.USER_ID_CLAIM))
+        if user is None:
+            user = self.get_user(validated_token)
+            usuarios_cacheados.guardar(user, segundos)
+        return user
+
+
+class TokenYaUsado(TokenError):
+    pass
+
+
+class RegistroRevocados:
+    """
+    Conjunto de jti revocados. La base de datos es la fuente de verdad (clave
+    primaria, asi revocar es un INSERT atomico entre procesos) y la LRU en memoria
+    responde sin consultar cuando se reintenta un token que este proceso ya vio.
+    Solo se recuerdan revocados: un "no revocado" en memoria podria estar
+    desactualizado si otro proceso lo revoco
+    """
+
+    def __init__(self, maximo=10000):
+        self.maximo = maximo
+        self._jtis = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recordar(self, jti):
+        with self._lock:
+            self._jtis[jti] = None
+            self._jtis.move_to_end(jti)
+            while len(self._jtis) > self.maximo:
+                self._jtis.popitem(last=False)
+
+    def _en_memoria(self, jti):
+        with self._lock:
+            if jti in self._jtis:
+                self._jtis.move_to_end(jti)
+                return True
+        return False
+
+    def revocar(self, jti, expira):
+        """
+        Marca el jti como usado. Devuelve False si ya estaba revocado
+        """
+        if self._en_memoria(jti):
+            return False
+        try:
+            with transaction.atomic():
+                TokenRevocado.objects.create(jti=jti, expira=expira)
+        except IntegrityError:
+            self._recordar(jti)
+            return False
+        self._recordar(jti)
+        return True
+
+    def esta_revocado(self, jti):
+        if self._en_memoria(jti):
+            return True
+        if TokenRevocado.objects.filter(jti=jti).exists():
+            self._recordar(jti)
+            return True
+        return False
+
+    def limpiar(self):
+        with self._lock:
+            self._jtis.clear()
+
+
+revocados = RegistroRevocados(getattr(settings, 'JWT_REVOCADOS_MEMORIA', 10000))
+
+
+def podar_revocados():
+    """
+    Borra los jti cuyos tokens ya vencieron. Devuelve cuantos se borraron
+    """
+    borrados, _ = TokenRevocado.objects.filter(expira__lte=timezone.now()).delete()
+    return borrados
+
+
+def rotar_refresh(raw_token):
+    """
+    Valida un refresh token, lo revoca y devuelve un RefreshToken nuevo para el
+    mismo usuario. Lanza TokenError si es invalido, vencio o ya se habia usado
+    """
+    token = RefreshToken(raw_token)
+
+    # Los tokens emitidos con la vida de 100 años se limitan a REFRESH_TOKEN_LIFETIME
+    # desde su emision, asi ningun jti queda guardado mas de ese tiempo
+    vence = datetime_from_epoch(token['exp'])
+    if 'iat' in token:
+        vence = min(vence, datetime_from_epoch(token['iat']) + api_settings.REFRESH_TOKEN_LIFETIME)
+    if vence <= timezone.now():
+        raise TokenError('El token vencio')
+
+    if not revocados.revocar(token[api_settings.JTI_CLAIM], vence):
+        raise TokenYaUsado('El token ya fue usado')
+
+    user = (
+        User.objects.only('id', 'is_active')
+        .filter(**{api_settings.USER_ID_FIELD: token.get(api_settings.USER_ID_CLAIM)})
+        .first()
+    )
+    if user is None or not user.is_active:
+        raise TokenError('Usuario inactivo o inexistente')
+    return RefreshToken.for_user(user)
+
+class JWTAutenticacionRapidaScheme(SimpleJWTScheme):
+    # Documenta el mismo esquema Bearer de simplejwt en /api/docs/
+    target_class = JWTAutenticacionRapida
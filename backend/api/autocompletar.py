@@ -0,0 +1,142 @@
+"""
+Autocompletado de productos por nombre desde un indice en memoria del proceso.
+
+Cada fiador tiene un IndicePrefijos: un arreglo ordenado de claves normalizadas
+(minusculas, sin acentos), una por cada palabra del nombre desde esa palabra
+hasta el final ("leche entera" -> "leche entera", "entera"). Un prefijo se busca
+con bisect en O(log n) y se recorren solo las claves que empiezan con el.
+
+Los indices se guardan en una LRU con presupuesto de memoria
+(AUTOCOMPLETAR_MEMORIA, en bytes) compartida por todos los fiadores. Cada indice
+recuerda la version de productos del fiador (api/cache_usuario.py) con la que se
+construyo: guardar o borrar un Producto la sube (api/signals.py) y el siguiente
+autocompletado de ese fiador lo reconstruye. La version vive en la cache de
+respuestas, que con varios procesos es compartida (ver fiados/settings.py); aun
+asi un indice no se usa mas de AUTOCOMPLETAR_EDAD_MAXIMA segundos, por si la
+version se pierde o la escritura no paso por las señales.
+"""
+
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+
+from api.cache_usuario import version_productos
+from api.models import Producto
+
+
+def normalizar(texto):
+    texto = texto.lower()
+    if not texto.isascii():
+        texto = unicodedata.normalize('NFKD', texto)
+        texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.split())
+
+
+class IndicePrefijos:
+
+    def __init__(self, productos):
+        """
+        productos: iterable de (id, producto_nombre, precio)
+        """
+        self.filas = []
+        entradas = []
+        for id_, nombre, precio in productos:
+            posicion = len(self.filas)
+            self.filas.append((id_, nombre, str(precio)))
+            palabras = normalizar(nombre).split(' ')
+            for inicio in range(len(palabras)):
+                entradas.append((' '.join(palabras[inicio:]), inicio, posicion))
+        # A igual clave primero el nombre que empieza con ella
+        entradas.sort()
+        self.claves = [clave for clave, _, _ in entradas]
+        self.posiciones = [posicion for _, _, posicion in entradas]
+        self.tamano = (
+            sys.getsizeof(self.claves) + sys.getsizeof(self.posiciones) + sys.getsizeof(self.filas)
+            + sum(sys.getsizeof(clave) for clave in self.claves)
+            + sum(sys.getsizeof(fila) + sys.getsizeof(fila[1]) + sys.getsizeof(fila[2]) for fila in self.filas)
+        )
+
+    def buscar(self, prefijo, limite=10):
+        prefijo = normalizar(prefijo)
+        if not prefijo:
+            return []
+        resultados = []
+        vistos = set()
+        i = bisect_left(self.claves, prefijo)
+        while i < len(self.claves) and len(resultados) < limite and self.claves[i].startswith(prefijo):
+            posicion = self.posiciones[i]
+            if posicion not in vistos:
+                vistos.add(posicion)
+                resultados.append(self.filas[posicion])
+            i += 1
+        return resultados
+
+
+class CacheIndices:
+    """
+    LRU de IndicePrefijos por fiador limitada por la suma de sus tamaños.
+    Siempre conserva el indice mas reciente aunque solo el supere el presupuesto
+    """
+
+    def __init__(self, memoria, edad_maxima=None):
+        self.memoria = memoria
+        self.edad_maxima = edad_maxima
+        self.usada = 0
+        self._indices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, user_id, version):
+        with self._lock:
+            entrada = self._indices.get(user_id)
+            if entrada is None or entrada[0] != version:
+                return None
+            if self.edad_maxima is not None and time.monotonic() - entrada[1] > self.edad_maxima:
+                return None
+            self._indices.move_to_end(user_id)
+            return entrada[2]
+
+    def guardar(self, user_id, version, indice):
+        with self._lock:
+            anterior = self._indices.pop(user_id, None)
+            if anterior is not None:
+                self.usada -= anterior[2].tamano
+            self._indices[user_id] = (version, time.monotonic(), indice)
+            self.usada += indice.tamano
+            while self.usada > self.memoria and len(self._indices) > 1:
+                _, (_, _, desalojado) = self._indices.popitem(last=False)
+                self.usada -= desalojado.tamano
+
+    def limpiar(self):
+        with self._lock:
+            self._indices.clear()
+            self.usada = 0
+
+
+indices_productos = CacheIndices(
+    getattr(settings, 'AUTOCOMPLETAR_MEMORIA', 32 * 1024 * 1024),
+    getattr(settings, 'AUTOCOMPLETAR_EDAD_MAXIMA', 300),
+)
+
+
+def indice_de(user_id):
+    # La version se lee antes de consultar: si cambia mientras se construye, el
+    # indice queda guardado con la version vieja y se reconstruye en la siguiente busqueda
+    version = version_productos(user_id)
+    indice = indices_productos.obtener(user_id, version)
+    if indice is None:
+        productos = Producto.objects.filter(usuario_id=user_id).values_list('id', 'producto_nombre', 'precio')
+        indice = IndicePrefijos(productos.iterator(chunk_size=2000))
+        indices_productos.guardar(user_id, version, indice)
+    return indice
+
+
+def autocompletar(user_id, prefijo, limite=10):
+    return [
+        {'id': id_, 'producto_nombre': nombre, 'precio': precio}
+        for id_, nombre, precio in indice_de(user_id).buscar(prefijo, limite)
+    ]
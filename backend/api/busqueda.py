@@ -0,0 +1,195 @@
+"""
+Busqueda indexada de clientes y productos por nombre.
+
+SQLite: una tabla FTS5 por modelo (api_cliente_busqueda, api_producto_busqueda)
+con el nombre y el fiador como token ("u<id>"), asi el filtro por usuario tambien
+se resuelve en el indice. Se llena con triggers de la migracion 0007, que se
+ejecutan en cualquier INSERT/UPDATE/DELETE, tambien en QuerySet.update(),
+bulk_create() y borrados en cascada, donde las señales de Django no llegan.
+
+PostgreSQL: indice GIN con pg_trgm sobre api_sin_acentos(nombre), el nombre en
+minusculas y sin acentos (migracion 0008). Cada palabra se busca como subcadena
+(LIKE, resuelto con el indice) y se ordena por word_similarity(). El indice se
+mantiene solo.
+
+En otros motores se usa icontains por palabra, sin indice.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework.pagination import PageNumberPagination
+
+from api.models import Cliente, Producto
+
+# Resultados como maximo de una busqueda (los mas relevantes)
+MAX_RESULTADOS = 500
+
+# modelo: (tabla FTS5, campo del nombre, campo del dueño)
+INDICES = {
+    Cliente: ('api_cliente_busqueda', 'cliente_nombre', 'fiador_id'),
+    Producto: ('api_producto_busqueda', 'producto_nombre', 'usuario_id'),
+}
+
+
+def _palabras(texto):
+    return re.findall(r'\w+', texto)
+
+
+def _consulta_fts(palabras, fiador_id=None):
+    # Cada palabra como prefijo entre comillas ("mar"*), asi el texto del usuario
+    # no se interpreta como sintaxis de FTS5
+    terminos = ' AND '.join('nombre:"%s"*' % palabra.replace('"', '""') for palabra in palabras)
+    if fiador_id is not None:
+        return f'fiador:u{int(fiador_id)} AND {terminos}'
+    return terminos
+
+
+def _condicion_trigramas(modelo, palabras):
+    tabla = modelo._meta.db_table
+    campo = modelo._meta.get_field(INDICES[modelo][1]).column
+    # La misma expresion que el indice, si no PostgreSQL no lo usa
+    columna = f'api_sin_acentos({connection.ops.quote_name(tabla)}.{connection.ops.quote_name(campo)})'
+    # Todas las palabras tienen que aparecer, como en FTS5
+    subcadenas = ['%' + re.sub(r'([\\%_])', r'\\\1', palabra) + '%' for palabra in palabras]
+    condicion = RawSQL(
+        '(' + ' AND '.join(f'{columna} LIKE api_sin_acentos(%s)' for _ in subcadenas) + ')',
+        subcadenas, output_field=BooleanField(),
+    )
+    rango = RawSQL(f'word_similarity(api_sin_acentos(%s), {columna})', [' '.join(palabras)])
+    return condicion, rango
+
+
+def coincidencias(modelo, texto, fiador_id=None):
+    """
+    QuerySet con todas las filas de `modelo` cuyo nombre coincide con el texto,
+    sin orden ni limite (para combinarlo en otras consultas, como el admin)
+    """
+    _, nombre, dueno = INDICES[modelo]
+    palabras = _palabras(texto)
+    queryset = modelo.objects.all()
+    if not palabras:
+        return queryset.none()
+
+    if connection.vendor == 'sqlite':
+        tabla = INDICES[modelo][0]
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {tabla} WHERE {tabla} MATCH %s', [_consulta_fts(palabras, fiador_id)]
+        ))
+
+    if fiador_id is not None:
+        queryset = queryset.filter(**{dueno: fiador_id})
+    if connection.vendor == 'postgresql':
+        condicion, _ = _condicion_trigramas(modelo, palabras)
+        return queryset.filter(condicion)
+
+    filtro = Q()
+    for palabra in palabras:
+        filtro &= Q(**{f'{nombre}__icontains': palabra})
+    return queryset.filter(filtro)
+
+
+def buscar(modelo, texto, fiador_id, limite=MAX_RESULTADOS):
+    """
+    Ids de `modelo` del fiador que coinciden con el texto, del mas relevante al menos
+    """
+    palabras = _palabras(texto)
+    if not palabras:
+        return []
+
+    if connection.vendor == 'sqlite':
+        tabla = INDICES[modelo][0]
+        with connection.cursor() as cursor:
+            # bm25 con peso 0 para la columna del fiador: solo cuenta el nombre
+            cursor.execute(
+                f'SELECT rowid FROM {tabla} WHERE {tabla} MATCH %s '
+                f'ORDER BY bm25({tabla}, 0.0, 1.0), rowid DESC LIMIT %s',
+                [_consulta_fts(palabras, fiador_id), limite],
+            )
+            return [fila[0] for fila in cursor.fetchall()]
+
+    queryset = coincidencias(modelo, texto, fiador_id)
+    if connection.vendor == 'postgresql':
+        _, rango = _condicion_trigramas(modelo, palabras)
+        queryset = queryset.annotate(rango=rango).order_by('-rango', '-pk')
+    else:
+        queryset = queryset.order_by('-pk')
+    return list(queryset.values_list('pk', flat=True)[:limite])
+
+
+def ordenar_por_relevancia(queryset, campo, ids, *desempate):
+    """
+    Filtra queryset a las filas cuyo `campo` esta en ids, en el orden de ids
+    """
+    if not ids:
+        return queryset.none()
+    posicion = Case(
+        *(When(**{campo: valor}, then=Value(indice)) for indice, valor in enumerate(ids)),
+        output_field=IntegerField(),
+    )
+    return queryset.filter(**{f'{campo}__in': ids}).order_by(posicion, *desempate)
+
+
+class PaginacionBusqueda(PageNumberPagination):
+    """
+    Los resultados ya vienen ordenados por relevancia, no por un campo unico, asi
+    que se paginan por numero de pagina en lugar de cursor. `truncado` indica que
+    habia mas de MAX_RESULTADOS coincidencias y solo se devuelven las mas relevantes
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.truncado = getattr(view, 'busqueda_truncada', False)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['truncado'] = self.truncado
+        return response
+
+
+class BusquedaMixin:
+    """
+    Mixin para ModelViewSet: ?search=texto en list filtra con el indice de
+    `modelo_busqueda` y ordena por relevancia. `campo_busqueda` es el campo del
+    queryset que apunta a ese modelo y `desempate_busqueda` el orden entre filas
+    con la misma relevancia
+    """
+    parametro_busqueda = 'search'
+    modelo_busqueda = None
+    campo_busqueda = 'pk'
+    desempate_busqueda = ()
+
+    busqueda_truncada = False
+
+    def texto_busqueda(self):
+        if getattr(self, 'action', None) != 'list':
+            return ''
+        return self.request.query_params.get(self.parametro_busqueda, '').strip()
+
+    def ids_busqueda(self, texto):
+        # Una sola busqueda por peticion aunque filter_queryset se llame varias veces
+        # (FiadoViewSet.list lo usa para el ETag y para la pagina)
+        if getattr(self, '_ids_busqueda', None) is None:
+            ids = buscar(self.modelo_busqueda, texto, self.request.user.id, MAX_RESULTADOS + 1)
+            self.busqueda_truncada = len(ids) > MAX_RESULTADOS
+            self._ids_busqueda = ids[:MAX_RESULTADOS]
+        return self._ids_busqueda
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        texto = self.texto_busqueda()
+        if texto:
+            ids = self.ids_busqueda(texto)
+            queryset = ordenar_por_relevancia(queryset, self.campo_busqueda, ids, *self.desempate_busqueda)
+        return queryset
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.texto_busqueda():
+            self._paginator = PaginacionBusqueda()
+        return super().paginator
@@ -0,0 +1,125 @@
+"""
+Cache de respuestas por usuario para los listados y detalles de solo lectura.
+
+Cada fiador tiene un contador de version en la cache. Las respuestas se guardan
+bajo una clave que incluye esa version, asi que cualquier cambio en sus
+productos, clientes o fiados (ver api/signals.py) sube la version y deja
+inaccesibles todas sus respuestas anteriores sin tener que borrarlas una por una.
+
+El ETag se deriva de la misma version, por eso un If-None-Match se puede
+responder con 304 sin consultar la base de datos ni serializar nada.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def _cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _clave_version(user_id, espacio='version'):
+    return f'fiador:{espacio}:{user_id}'
+
+
+def version_usuario(user_id, espacio='version'):
+    cache = _cache()
+    clave = _clave_version(user_id, espacio)
+    version = cache.get(clave)
+    if version is None:
+        # Se parte de un valor basado en el tiempo y no de 1: si la clave se pierde
+        # (reinicio o desalojo de la cache) no se reutiliza una version vieja
+        cache.add(clave, int(time.time() * 1000), timeout=None)
+        version = cache.get(clave)
+    return version
+
+
+def _incrementar(user_id, espacio='version'):
+    cache = _cache()
+    try:
+        cache.incr(_clave_version(user_id, espacio))
+    except ValueError:
+        version_usuario(user_id, espacio)
+
+
+def invalidar_usuario(user_id, espacio='version'):
+    """
+    Sube la version del usuario ahora y otra vez al confirmar la transaccion, para que
+    una lectura que ocurra antes del commit no deje guardados datos viejos con la version nueva
+    """
+    if user_id is None:
+        return
+    _incrementar(user_id, espacio)
+    transaction.on_commit(lambda: _incrementar(user_id, espacio))
+
+
+# Version aparte que solo cambia con los productos: el indice de autocompletado
+# (api/autocompletar.py) no se reconstruye en cada venta
+def version_productos(user_id):
+    return version_usuario(user_id, 'productos')
+
+
+def invalidar_productos(user_id):
+    invalidar_usuario(user_id, 'productos')
+
+
+def calcular_etag(*partes):
+    base = ':'.join(str(parte) for parte in partes)
+    return '"%s"' % hashlib.md5(base.encode()).hexdigest()
+
+
+def coincide_etag(request, etag):
+    """
+    If-None-Match usa la comparacion debil (RFC 9110): W/"x" coincide con "x"
+    y * con cualquier representacion
+    """
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in etags or any(candidato.removeprefix('W/') == etag for candidato in etags)
+
+
+def respuesta_condicional(response, etag):
+    response['ETag'] = etag
+    # La respuesta es del usuario, ningun proxy compartido debe guardarla
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class CacheRespuestaMixin:
+    """
+    Mixin para ModelViewSet que cachea list y retrieve por usuario y agrega ETag/304
+    """
+    cache_timeout = None
+
+    def _respuesta_cacheada(self, vista, request, *args, **kwargs):
+        version = version_usuario(request.user.id)
+        etag = calcular_etag(request.user.id, version, self.__class__.__name__, request.build_absolute_uri())
+
+        if coincide_etag(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            clave = 'fiador:respuesta:' + etag.strip('"')
+            data = _cache().get(clave)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = vista(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                timeout = self.cache_timeout or getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+                _cache().set(clave, response.data, timeout)
+
+        return respuesta_condicional(response, etag)
+
+    def list(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(super().retrieve, request, *args, **kwargs)
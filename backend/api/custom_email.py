@@ -3,6 +3,7 @@ from django.conf import settings
 from django.template.loader import render_to_string
 from django.core.mail import EmailMultiAlternatives
 from djoser.email import BaseEmailMessage
+from api.outbox import encolar_mensaje
 
 
 class CreateUser(email.ActivationEmail):
@@ -41,7 +42,7 @@ class CreateUser(email.ActivationEmail):
             to=[to]  # Aquí sí pasamos una lista
         )
         email_message.attach_alternative(body_html, "text/html")
-        email_message.send()
+        encolar_mensaje(email_message)
 
 
 class CustomActivationConfirmEmail(email.ActivationEmail):
@@ -72,7 +73,7 @@ class CustomActivationConfirmEmail(email.ActivationEmail):
             to=[to]
         )
         email_message.attach_alternative(body_html, "text/html")
-        email_message.send()
+        encolar_mensaje(email_message)
 
 class CustomActivationNewEmail(email.ActivationEmail):
     template_name = 'email/activation/new_email/body.html'
@@ -112,7 +113,7 @@ class CustomActivationNewEmail(email.ActivationEmail):
             to=[to]
         )
         email_message.attach_alternative(body_html, "text/html")
-        email_message.send()
+        encolar_mensaje(email_message)
 
 class CustomUsernameResetEmail(email.UsernameResetEmail):
     template_name = 'email/email_reset/body.html'
@@ -150,7 +151,7 @@ class CustomUsernameResetEmail(email.UsernameResetEmail):
             to=[to]  # Aquí sí pasamos una lista
         )
         email_message.attach_alternative(body_html, "text/html")
-        email_message.send()
+        encolar_mensaje(email_message)
         
 class CustomForgotEmail(email.UsernameResetEmail):
     template_name = "email/forgot_email/body.html"
@@ -188,7 +189,7 @@ class CustomForgotEmail(email.UsernameResetEmail):
             to=[to],
         )
         email_message.attach_alternative(body_html, "text/html")
-        email_message.send()
+        encolar_mensaje(email_message)
 
 
 class CustomEmailReset(email.ActivationEmail):
@@ -234,7 +235,7 @@ class CustomEmailReset(email.ActivationEmail):
             to=[to]  # Aquí sí pasamos una lista
         )
         email_message.attach_alternative(body_html, "text/html")  # Versión HTML
-        email_message.send()
+        encolar_mensaje(email_message)
 
 
 
@@ -276,7 +277,7 @@ class CustomOldEmailNotification(email.ActivationEmail):
             to=[to]
         )
         email_message.attach_alternative(body_html, "text/html")
-        email_message.send()
+        encolar_mensaje(email_message)
 
 class CustomPasswordResetEmail(email.PasswordResetEmail):
     template_name = 'email/password_reset/body.html'
@@ -314,7 +315,7 @@ class CustomPasswordResetEmail(email.PasswordResetEmail):
             to=[to]  # Aquí sí pasamos una lista
         )
         email_message.attach_alternative(body_html, "text/html")
-        email_message.send()
+        encolar_mensaje(email_message)
 
 
 class CustomPasswordConfirmEmail(email.PasswordChangedConfirmationEmail):
@@ -350,4 +351,4 @@ class CustomPasswordConfirmEmail(email.PasswordChangedConfirmationEmail):
             to=[to]
         )
         email_message.attach_alternative(body_html, "text/html")
-        email_message.send()
+        encolar_mensaje(email_message)
@@ -0,0 +1,205 @@
+"""
+Exportacion del historial completo de un fiador (clientes, fiados, detalles y
+deudas) en CSV o JSONL.
+
+Las filas se leen con iterator() en lotes (cursor del lado del servidor en
+PostgreSQL) y se escriben en bloques de ~64 KiB, opcionalmente
+comprimidos con gzip, asi la memoria no depende del tamaño del historial.
+Con DB_POOL=pgbouncer los cursores del servidor estan desactivados y psycopg
+trae el resultado completo de cada tabla antes de recorrerlo.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+
+from api.asincrono import en_hilo
+from api.models import Cliente, DeudaPendiente, DetalleFiado, Fiado
+
+# Filas por lote que se piden a la base de datos
+LOTE = 2000
+# Tamaño aproximado de cada bloque que se entrega al servidor
+TAM_BLOQUE = 64 * 1024
+
+# tabla: (modelo, filtro por fiador, ((columna, campo), ...))
+TABLAS = {
+    'clientes': (Cliente, 'fiador_id', (
+        ('id', 'id'),
+        ('cliente_nombre', 'cliente_nombre'),
+    )),
+    'fiados': (Fiado, 'cliente__fiador_id', (
+        ('id', 'id'),
+        ('cliente_id', 'cliente_id'),
+        ('monto_total', 'monto_total'),
+        ('abono', 'abono'),
+        ('interes', 'interes'),
+        ('fecha_registro', 'fecha_registro'),
+        ('fecha_actualizacion', 'fecha_actualizacion'),
+    )),
+    'detalles': (DetalleFiado, 'fiado__cliente__fiador_id', (
+        ('id', 'id'),
+        ('fiado_id', 'fiado_id'),
+        ('producto_id', 'producto_id'),
+        ('producto_nombre', 'producto__producto_nombre'),
+        ('cantidad', 'cantidad'),
+    )),
+    'deudas': (DeudaPendiente, 'fiado__cliente__fiador_id', (
+        ('id', 'id'),
+        ('fiado_id', 'fiado_id'),
+        ('producto_id', 'productos_id'),
+        ('producto_nombre', 'productos__producto_nombre'),
+        ('cantidad', 'cantidad'),
+        ('interes', 'interes'),
+        ('monto_total', 'monto_total'),
+        ('abono', 'abono'),
+        ('fecha_registro', 'fecha_registro'),
+    )),
+}
+
+
+def _valor(valor):
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+
+class EscritorCSV:
+    content_type = 'text/csv; charset=utf-8'
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.csv = csv.writer(self.buffer)
+
+    def encabezado(self, tabla, columnas):
+        self.csv.writerow(columnas)
+
+    def fila(self, tabla, columnas, valores):
+        self.csv.writerow([_valor(valor) for valor in valores])
+
+
+class EscritorJSONL:
+    content_type = 'application/x-ndjson; charset=utf-8'
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+
+    def encabezado(self, tabla, columnas):
+        pass
+
+    def fila(self, tabla, columnas, valores):
+        registro = {'tabla': tabla}
+        registro.update(zip(columnas, map(_valor, valores)))
+        self.buffer.write(json.dumps(registro, ensure_ascii=False))
+        self.buffer.write('\n')
+
+
+ESCRITORES = {
+    'csv': EscritorCSV,
+    'jsonl': EscritorJSONL,
+}
+
+
+def _consulta(tabla, user_id):
+    modelo, filtro, campos = TABLAS[tabla]
+    columnas = [columna for columna, _ in campos]
+    filas = modelo.objects.filter(**{filtro: user_id}).order_by('pk').values_list(*(campo for _, campo in campos))
+    return columnas, filas
+
+
+def _vaciar(escritor):
+    texto = escritor.buffer.getvalue()
+    escritor.buffer.seek(0)
+    escritor.buffer.truncate()
+    return texto.encode('utf-8')
+
+
+def exportar(user_id, tablas, formato):
+    """
+    Genera el export en bloques de bytes
+    """
+    escritor = ESCRITORES[formato]()
+    for tabla in tablas:
+        columnas, filas = _consulta(tabla, user_id)
+        escritor.encabezado(tabla, columnas)
+        for valores in filas.iterator(chunk_size=LOTE):
+            escritor.fila(tabla, columnas, valores)
+            if escritor.buffer.tell() >= TAM_BLOQUE:
+                yield _vaciar(escritor)
+    resto = _vaciar(escritor)
+    if resto:
+        yield resto
+
+
+async def aexportar(user_id, tablas, formato):
+    """
+    Version asincrona de exportar() para ASGI: StreamingHttpResponse tendria que
+    cargar un iterador sincrono completo en memoria para servirlo
+    """
+    escritor = ESCRITORES[formato]()
+    for tabla in tablas:
+        columnas, filas = _consulta(tabla, user_id)
+        escritor.encabezado(tabla, columnas)
+        # QuerySet.aiterator() abre el cursor de values_list dentro del event loop
+        # (SynchronousOnlyOperation); el mismo iterador se avanza por lotes en hilo
+        cursor = filas.iterator(chunk_size=LOTE)
+        while lote := await en_hilo(lambda: list(islice(cursor, LOTE))):
+            for valores in lote:
+                escritor.fila(tabla, columnas, valores)
+                if escritor.buffer.tell() >= TAM_BLOQUE:
+                    yield _vaciar(escritor)
+    resto = _vaciar(escritor)
+    if resto:
+        yield resto
+
+
+def acepta_gzip(accept_encoding):
+    """
+    Si Accept-Encoding admite gzip: "gzip" o "x-gzip" con q mayor que 0 o, si no
+    aparecen, "*" con q mayor que 0. "gzip;q=0" lo rechaza
+    """
+    comodin = None
+    for parte in accept_encoding.split(','):
+        codificacion, *parametros = [valor.strip() for valor in parte.split(';')]
+        q = 1.0
+        for parametro in parametros:
+            nombre, _, valor = parametro.partition('=')
+            if nombre.strip().lower() == 'q':
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        codificacion = codificacion.lower()
+        if codificacion in ('gzip', 'x-gzip'):
+            return q > 0
+        if codificacion == '*':
+            comodin = q > 0
+    return bool(comodin)
+
+
+def _compresor():
+    # wbits=31: formato gzip (cabecera y CRC) en lugar de zlib crudo
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def comprimir(bloques):
+    compresor = _compresor()
+    for bloque in bloques:
+        datos = compresor.compress(bloque)
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+
+async def acomprimir(bloques):
+    compresor = _compresor()
+    async for bloque in bloques:
+        datos = compresor.compress(bloque)
+        if datos:
+            yield datos
+    yield compresor.flush()
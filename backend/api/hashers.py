@@ -0,0 +1,34 @@
+"""
+Hashers de contraseñas con parametros configurables desde settings.
+
+Mantienen el mismo `algorithm` que los de Django, asi los hashes son compatibles y
+must_update() detecta cuando los parametros guardados en el hash no coinciden con
+los de settings: check_password() vuelve a generar el hash en el siguiente login.
+
+Los parametros se eligen midiendo con `python manage.py bench_login`.
+"""
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+
+
+class Argon2Ajustado(Argon2PasswordHasher):
+    """
+    Argon2id con settings.PASSWORD_ARGON2 (time_cost, memory_cost en KiB, parallelism)
+    """
+
+    def __init__(self):
+        for nombre, valor in getattr(settings, 'PASSWORD_ARGON2', {}).items():
+            setattr(self, nombre, valor)
+
+
+class ScryptAjustado(ScryptPasswordHasher):
+    """
+    scrypt con settings.PASSWORD_SCRYPT (work_factor, block_size, parallelism)
+    """
+
+    def __init__(self):
+        for nombre, valor in getattr(settings, 'PASSWORD_SCRYPT', {}).items():
+            setattr(self, nombre, valor)
+        # hashlib limita la memoria a 32 MiB por defecto: 128 * work_factor * block_size
+        self.maxmem = 2 * 128 * self.work_factor * self.block_size
@@ -0,0 +1,162 @@
+"""
+Importacion masiva del catalogo de productos desde CSV o JSON Lines.
+
+El archivo se lee linea por linea (del cuerpo de la peticion o del archivo subido,
+que Django guarda en disco si es grande) y las filas validas se guardan en lotes
+con un solo INSERT ... ON CONFLICT (usuario, producto_nombre) DO UPDATE por lote.
+Si un nombre ya existe para el usuario se actualiza su precio.
+
+Cada lote se confirma en su propia transaccion, asi el bloqueo de escritura
+(toda la base en SQLite) se toma solo mientras se guarda un lote y no mientras se
+lee y valida el archivo completo. Si el archivo resulta ilegible a mitad de
+camino, los lotes anteriores ya quedaron guardados y el error lo informa.
+
+creados/actualizados salen de la lectura de los nombres existentes que se hace
+antes del INSERT de cada lote: si otro proceso crea el mismo nombre entre esa
+lectura y el INSERT, la fila se cuenta como creada aunque se haya actualizado.
+
+bulk_create no envia señales: al terminar se invalidan a mano la cache de
+respuestas y el indice de autocompletado del usuario. El indice de busqueda se
+actualiza solo (triggers, ver api/busqueda.py).
+"""
+
+import codecs
+import csv
+import json
+from decimal import Decimal
+
+from django.db import transaction
+from rest_framework import serializers
+
+from api.cache_usuario import invalidar_productos, invalidar_usuario
+from api.models import Producto
+
+LOTE = 1000
+# Errores que se devuelven como maximo; el total se informa aparte
+MAX_ERRORES = 1000
+
+# Content-Type del cuerpo -> formato, cuando no se indica ?formato=
+FORMATOS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+}
+
+_campo_nombre = serializers.CharField(max_length=Producto._meta.get_field('producto_nombre').max_length)
+_campo_precio = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.00'))
+
+
+class ArchivoInvalido(Exception):
+
+    def __init__(self, mensaje, resultado=None):
+        super().__init__(mensaje)
+        self.resultado = resultado
+
+
+def _filas_csv(lineas):
+    lector = csv.DictReader(lineas)
+    faltantes = {'producto_nombre', 'precio'} - set(lector.fieldnames or ())
+    if faltantes:
+        raise ArchivoInvalido('Faltan columnas: ' + ', '.join(sorted(faltantes)))
+    for numero, fila in enumerate(lector, start=2):
+        yield numero, fila
+
+
+def _filas_jsonl(lineas):
+    for numero, linea in enumerate(lineas, start=1):
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except ValueError:
+            yield numero, None
+            continue
+        yield numero, fila if isinstance(fila, dict) else None
+
+
+def _validar(fila):
+    """
+    Devuelve (nombre, precio, None) o (None, None, errores)
+    """
+    if fila is None:
+        return None, None, {'fila': ['No es un objeto JSON valido']}
+    errores = {}
+    valores = {}
+    for campo, validador in (('producto_nombre', _campo_nombre), ('precio', _campo_precio)):
+        try:
+            valores[campo] = validador.run_validation(fila.get(campo, serializers.empty))
+        except serializers.ValidationError as e:
+            errores[campo] = [str(detalle) for detalle in e.detail]
+    if errores:
+        return None, None, errores
+    return valores['producto_nombre'], valores['precio'], None
+
+
+class Resultado:
+
+    def __init__(self):
+        self.filas = self.creados = self.actualizados = self.total_errores = 0
+        self.errores = []
+
+    def error(self, numero, errores):
+        self.total_errores += 1
+        if len(self.errores) < MAX_ERRORES:
+            self.errores.append({'fila': numero, 'errores': errores})
+
+    def como_dict(self):
+        return {
+            'filas': self.filas,
+            'creados': self.creados,
+            'actualizados': self.actualizados,
+            'total_errores': self.total_errores,
+            'errores': self.errores,
+        }
+
+
+def _guardar_lote(user_id, lote, resultado):
+    # lote: {nombre: precio}; si un nombre se repite en el archivo gana la ultima fila
+    with transaction.atomic():
+        existentes = set(
+            Producto.objects.filter(usuario_id=user_id, producto_nombre__in=list(lote))
+            .values_list('producto_nombre', flat=True)
+        )
+        Producto.objects.bulk_create(
+            [Producto(usuario_id=user_id, producto_nombre=nombre, precio=precio) for nombre, precio in lote.items()],
+            update_conflicts=True,
+            unique_fields=['usuario', 'producto_nombre'],
+            update_fields=['precio'],
+        )
+    resultado.actualizados += len(existentes)
+    resultado.creados += len(lote) - len(existentes)
+
+
+def importar_productos(user_id, archivo, formato):
+    """
+    archivo: iterable de lineas en bytes (HttpRequest o UploadedFile).
+    Las filas con errores se omiten y se reportan; si el archivo no se puede leer
+    lanza ArchivoInvalido con lo guardado hasta ese punto
+    """
+    lineas = codecs.iterdecode(archivo, 'utf-8-sig')
+    filas = _filas_csv(lineas) if formato == 'csv' else _filas_jsonl(lineas)
+    resultado = Resultado()
+    lote = {}
+    try:
+        for numero, fila in filas:
+            resultado.filas += 1
+            nombre, precio, errores = _validar(fila)
+            if errores:
+                resultado.error(numero, errores)
+                continue
+            lote[nombre] = precio
+            if len(lote) >= LOTE:
+                _guardar_lote(user_id, lote, resultado)
+                lote = {}
+        if lote:
+            _guardar_lote(user_id, lote, resultado)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ArchivoInvalido(f'No se pudo leer el archivo en la fila {resultado.filas + 1}: {e}', resultado)
+    finally:
+        if resultado.creados or resultado.actualizados:
+            invalidar_usuario(user_id)
+            invalidar_productos(user_id)
+    return resultado
@@ -0,0 +1,83 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from api.hashers import Argon2Ajustado, ScryptAjustado
+from api.models import User
+from api.serializers import LoginSerializer
+
+PERFILES = {
+    'argon2': Argon2Ajustado,
+    'scrypt': ScryptAjustado,
+    'pbkdf2': PBKDF2PasswordHasher,
+}
+
+CLAVE = 'clave-segura-123'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark de logins por segundo en un nucleo para cada perfil de hasher '
+        '(parametros de settings.PASSWORD_ARGON2 y PASSWORD_SCRYPT)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=3, help='Tiempo de medicion por perfil')
+        parser.add_argument('--perfil', choices=PERFILES, action='append', help='Perfiles a medir (todos por defecto)')
+
+    def medir(self, funcion, segundos):
+        funcion()  # calentamiento
+        n = 0
+        inicio = time.perf_counter()
+        while time.perf_counter() - inicio < segundos:
+            funcion()
+            n += 1
+        return n / (time.perf_counter() - inicio)
+
+    def medir_perfil(self, perfil, segundos):
+        hasher = PERFILES[perfil]()
+        codificado = hasher.encode(CLAVE, hasher.salt())
+        hashes = self.medir(lambda: hasher.verify(CLAVE, codificado), segundos)
+
+        # Login completo (consulta del usuario + verificacion) con el perfil como preferido
+        ruta = f'{PERFILES[perfil].__module__}.{PERFILES[perfil].__name__}'
+        with override_settings(PASSWORD_HASHERS=[ruta]):
+            try:
+                with transaction.atomic():
+                    User.objects.create_user(
+                        username='bench', email='bench-login@example.com', password=CLAVE
+                    )
+                    datos = {'email': 'bench-login@example.com', 'password': CLAVE}
+                    logins = self.medir(
+                        lambda: LoginSerializer(data=datos).is_valid(raise_exception=True), segundos
+                    )
+                    raise Rollback
+            except Rollback:
+                pass
+        parametros = {
+            clave: valor for clave, valor in hasher.decode(codificado).items()
+            if clave not in ('algorithm', 'hash', 'salt', 'params')
+        }
+        return hashes, logins, parametros
+
+    def handle(self, *args, **options):
+        perfiles = options['perfil'] or list(PERFILES)
+        self.stdout.write(f'Perfil activo: {settings.PASSWORD_HASHER}')
+        self.stdout.write(f'{"perfil":<8} {"hash/s":>8} {"login/s":>8}  parametros')
+        for perfil in perfiles:
+            try:
+                hashes, logins, parametros = self.medir_perfil(perfil, options['segundos'])
+            except ValueError as e:
+                # Argon2 sin argon2-cffi instalado
+                self.stdout.write(self.style.WARNING(f'{perfil:<8} no disponible: {e}'))
+                continue
+            parametros = ', '.join(f'{clave}={valor}' for clave, valor in sorted(parametros.items()))
+            self.stdout.write(f'{perfil:<8} {hashes:>8.1f} {logins:>8.1f}  {parametros}')
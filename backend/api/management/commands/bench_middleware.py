@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.utils.module_loading import import_string
+
+
+def vista_vacia(request):
+    return HttpResponse('ok')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark de peticiones por segundo a traves de la cadena de settings.MIDDLEWARE '
+        '(con una vista vacia, sin URLs ni base de datos)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peticiones', type=int, default=20000)
+        parser.add_argument(
+            '--solo-propios', action='store_true',
+            help='Mide solo los middlewares de fiados/middleware.py'
+        )
+
+    def construir_cadena(self, solo_propios):
+        rutas = [m for m in settings.MIDDLEWARE if not solo_propios or m.startswith('fiados.')]
+        handler = vista_vacia
+        for ruta in reversed(rutas):
+            handler = import_string(ruta)(handler)
+        return handler, rutas
+
+    def handle(self, *args, **options):
+        handler, rutas = self.construir_cadena(options['solo_propios'])
+        # 'localhost' es valido con ALLOWED_HOSTS vacio y DEBUG=True
+        factory = RequestFactory(SERVER_NAME='localhost')
+        header = 'HTTP_' + settings.SECURE_API_HEADER.upper().replace('-', '_')
+        user_agent = 'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 Chrome/126.0 Mobile Safari/537.36'
+
+        casos = {
+            'api con header': factory.get('/api/producto/', **{header: settings.SECURE_API_VALUE}, HTTP_USER_AGENT=user_agent),
+            'api sin header': factory.get('/api/producto/', HTTP_USER_AGENT=user_agent),
+            'ruta exenta': factory.get('/api/oauth-error/', HTTP_USER_AGENT=user_agent),
+            'postman': factory.get('/api/producto/', HTTP_USER_AGENT='PostmanRuntime/7.39.0'),
+        }
+
+        self.stdout.write(f'Middlewares: {len(rutas)}')
+        n = options['peticiones']
+        for nombre, request in casos.items():
+            inicio = time.perf_counter()
+            for _ in range(n):
+                handler(request)
+            segundos = time.perf_counter() - inicio
+            self.stdout.write(f'{nombre:<16} {n / segundos:>12,.0f} peticiones/s')
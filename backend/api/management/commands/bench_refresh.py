@@ -0,0 +1,77 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.autenticacion import revocados
+from api.models import TokenRevocado, User
+from api.views import TokenRefreshView
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark de peticiones por segundo a TokenRefreshView: rotaciones validas y '
+        'reintentos de tokens ya usados (con la LRU en memoria y contra la base de datos)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peticiones', type=int, default=500)
+        parser.add_argument(
+            '--revocados', type=int, default=100000,
+            help='jti revocados de relleno en la tabla para medir con una tabla grande'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.medir(options['peticiones'], options['revocados'])
+                raise Rollback
+        except Rollback:
+            pass
+        revocados.limpiar()
+
+    def medir(self, n, relleno):
+        user = User.objects.create_user(username='bench', email='bench-refresh@example.com', password='x')
+        vence = RefreshToken.for_user(user).access_token.current_time
+        TokenRevocado.objects.bulk_create(
+            [TokenRevocado(jti=f'relleno-{i}', expira=vence) for i in range(relleno)], batch_size=5000
+        )
+
+        factory = APIRequestFactory()
+        vista = TokenRefreshView.as_view()
+
+        def refrescar(refresh):
+            return vista(factory.post('/api/token/refresh/', {'refresh': refresh}, format='json'))
+
+        refresh = str(RefreshToken.for_user(user))
+        usados = []
+        inicio = time.perf_counter()
+        for _ in range(n):
+            usados.append(refresh)
+            response = refrescar(refresh)
+            assert response.status_code == 200, response.data
+            refresh = response.data['refresh']
+        self.reportar('rotacion valida', n, inicio)
+
+        inicio = time.perf_counter()
+        for token in usados:
+            assert refrescar(token).status_code == 400
+        self.reportar('reuso (memoria)', n, inicio)
+
+        revocados.limpiar()
+        inicio = time.perf_counter()
+        for token in usados:
+            assert refrescar(token).status_code == 400
+        self.reportar('reuso (base)', n, inicio)
+
+        self.stdout.write(f'Filas en TokenRevocado: {TokenRevocado.objects.count()}')
+
+    def reportar(self, nombre, n, inicio):
+        segundos = time.perf_counter() - inicio
+        self.stdout.write(f'{nombre:<18} {n / segundos:>10,.0f} peticiones/s')
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Prueba de carga HTTP contra un servidor ya levantado (gunicorn con fiados.wsgi o '
+        'uvicorn con fiados.asgi). Mantiene conexiones inactivas abiertas mientras los '
+        'clientes activos hacen peticiones con keep-alive'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--metodo', default='POST')
+        parser.add_argument('--ruta', default='/api/login/')
+        parser.add_argument(
+            '--cuerpo', default='{"email": "nadie@example.com", "password": "x"}',
+            help='Cuerpo JSON de cada peticion'
+        )
+        parser.add_argument('--token', help='Access token JWT para rutas autenticadas')
+        parser.add_argument('--concurrencia', type=int, default=50, help='Clientes haciendo peticiones')
+        parser.add_argument('--inactivas', type=int, default=0, help='Conexiones abiertas sin peticiones')
+        parser.add_argument('--segundos', type=float, default=10)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.peticion = self.armar_peticion(options)
+
+        resultado = asyncio.run(self.ejecutar(options))
+        latencias, estados, errores, inactivas_vivas = resultado
+        if not latencias:
+            raise CommandError(f'No se completo ninguna peticion ({errores} errores de conexion)')
+
+        latencias.sort()
+        total = len(latencias)
+        self.stdout.write(f'{options["metodo"]} {options["ruta"]}')
+        self.stdout.write(f'Peticiones:        {total} ({total / options["segundos"]:,.0f}/s)')
+        self.stdout.write(f'Estados:           {dict(estados)}')
+        self.stdout.write(
+            'Latencia (ms):     p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+                statistics.median(latencias) * 1000,
+                latencias[int(total * 0.95) - 1] * 1000,
+                latencias[int(total * 0.99) - 1] * 1000,
+                latencias[-1] * 1000,
+            )
+        )
+        self.stdout.write(f'Errores de conexion: {errores}')
+        if options['inactivas']:
+            self.stdout.write(f'Conexiones inactivas vivas al final: {inactivas_vivas}/{options["inactivas"]}')
+
+    def armar_peticion(self, options):
+        cuerpo = options['cuerpo'].encode() if options['cuerpo'] else b''
+        if cuerpo:
+            json.loads(cuerpo)  # falla temprano si el JSON no es valido
+        headers = [
+            f'{options["metodo"]} {options["ruta"]} HTTP/1.1',
+            f'Host: {self.host}',
+            f'{settings.SECURE_API_HEADER}: {settings.SECURE_API_VALUE}',
+            'User-Agent: bench-servidor',
+            'Connection: keep-alive',
+            f'Content-Length: {len(cuerpo)}',
+        ]
+        if cuerpo:
+            headers.append('Content-Type: application/json')
+        if options['token']:
+            headers.append(f'Authorization: Bearer {options["token"]}')
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode() + cuerpo
+
+    async def leer_respuesta(self, reader):
+        estado = int((await reader.readline()).split()[1])
+        largo = 0
+        chunked = False
+        while True:
+            linea = await reader.readline()
+            if linea in (b'\r\n', b''):
+                break
+            nombre, _, valor = linea.decode('latin-1').partition(':')
+            nombre = nombre.strip().lower()
+            if nombre == 'content-length':
+                largo = int(valor)
+            elif nombre == 'transfer-encoding' and 'chunked' in valor.lower():
+                chunked = True
+
+        if chunked:
+            while True:
+                tamano = int((await reader.readline()).strip(), 16)
+                await reader.readexactly(tamano + 2)
+                if tamano == 0:
+                    break
+        elif largo:
+            await reader.readexactly(largo)
+        return estado
+
+    async def cliente(self, fin, latencias, estados, errores):
+        reader = writer = None
+        while time.perf_counter() < fin:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+                inicio = time.perf_counter()
+                writer.write(self.peticion)
+                await writer.drain()
+                estado = await self.leer_respuesta(reader)
+                latencias.append(time.perf_counter() - inicio)
+                estados[estado] += 1
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                errores[0] += 1
+                if writer is not None:
+                    writer.close()
+                reader = writer = None
+                await asyncio.sleep(0.05)
+        if writer is not None:
+            writer.close()
+
+    async def conexion_inactiva(self, fin):
+        # Como un celular con la app abierta: la conexion se abre y se queda esperando
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            return False
+        await asyncio.sleep(max(fin - time.perf_counter(), 0))
+        viva = not reader.at_eof()
+        writer.close()
+        return viva
+
+    async def ejecutar(self, options):
+        fin = time.perf_counter() + options['segundos']
+        latencias, estados, errores = [], Counter(), [0]
+
+        inactivas = [
+            asyncio.create_task(self.conexion_inactiva(fin)) for _ in range(options['inactivas'])
+        ]
+        await asyncio.gather(*[
+            self.cliente(fin, latencias, estados, errores) for _ in range(options['concurrencia'])
+        ])
+        vivas = sum(await asyncio.gather(*inactivas))
+        return latencias, estados, errores[0], vivas
@@ -0,0 +1,63 @@
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+
+from api.models import Cliente, Fiado, Producto, User
+from api.serializers import ClienteSerializer, CuentaSerializer, FiadoSerializer, ProductoSerializer
+
+
+def validacion_anterior(model, initial_data, adicionales=(), campos_patch=None, method='POST'):
+    """
+    Referencia: lo que hacia cada validate() antes de CamposEstrictosMixin,
+    reconstruyendo los conjuntos de campos en cada peticion
+    """
+    model_fields = {field.name for field in model._meta.get_fields()}.union(adicionales)
+    extra_fields = set(initial_data.keys()) - model_fields
+    if extra_fields:
+        raise serializers.ValidationError('extra')
+    if campos_patch is not None and method == 'PATCH':
+        allowed_fields = set(campos_patch)
+        if set(initial_data.keys()) - allowed_fields:
+            raise serializers.ValidationError('patch')
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark de la validacion de campos permitidos (antes/despues de CamposEstrictosMixin)'
+
+    casos = [
+        (CuentaSerializer, User, {'username': 'a', 'email': 'a@example.com', 'password': 'x'}),
+        (ProductoSerializer, Producto, {'producto_nombre': 'pan', 'precio': '1.00'}),
+        (ClienteSerializer, Cliente, {'cliente_nombre': 'ana'}),
+        (FiadoSerializer, Fiado, {'monto_total': '1.00', 'abono': '0.00', 'fecha_registro': '2025-01-01T00:00:00Z'}),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        n = options['iteraciones']
+        request = SimpleNamespace(method='PATCH', user=None)
+
+        self.stdout.write(f"{'serializer':<20} {'antes (val/s)':>15} {'despues (val/s)':>16}")
+        for serializer_class, model, data in self.casos:
+            serializer = serializer_class(data=data, context={'request': request})
+            adicionales = serializer_class.campos_adicionales
+            campos_patch = serializer_class.campos_patch
+            validate = serializer.validate
+            if serializer_class is FiadoSerializer:
+                # Se mide solo la parte del mixin, sin las reglas propias de Fiado
+                validate = super(FiadoSerializer, serializer).validate
+
+            inicio = time.perf_counter()
+            for _ in range(n):
+                validacion_anterior(model, data, adicionales, campos_patch, request.method)
+            antes = n / (time.perf_counter() - inicio)
+
+            inicio = time.perf_counter()
+            for _ in range(n):
+                validate(data)
+            despues = n / (time.perf_counter() - inicio)
+
+            self.stdout.write(f'{serializer_class.__name__:<20} {antes:>15,.0f} {despues:>16,.0f}')
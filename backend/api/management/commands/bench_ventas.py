@@ -0,0 +1,68 @@
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.models import Cliente, Producto, User
+from api.serializers import FiadoSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark de FiadoSerializer.create para ventas de 1, 10 y 100 lineas. '
+        'Todo se hace dentro de una transaccion que se revierte al final'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lineas', type=int, nargs='+', default=[1, 10, 100])
+        parser.add_argument('--repeticiones', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.medir(options['lineas'], options['repeticiones'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def medir(self, tamanos, repeticiones):
+        user = User.objects.create_user(username='bench', email='bench-ventas@example.com', password='x')
+        productos = Producto.objects.bulk_create([
+            Producto(usuario=user, producto_nombre=f'producto-{i}', precio=Decimal('1.50'))
+            for i in range(max(tamanos))
+        ])
+        request = SimpleNamespace(user=user, method='POST')
+
+        self.stdout.write(f"{'lineas':>8} {'consultas':>10} {'ms/venta':>10}")
+        for lineas in tamanos:
+            tiempos = []
+            consultas = 0
+            for n in range(repeticiones):
+                cliente = Cliente.objects.create(fiador=user, cliente_nombre=f'cliente-{lineas}-{n}')
+                data = {
+                    'cliente': cliente.id,
+                    'productos': [{'producto_id': p.id, 'cantidad': 2} for p in productos[:lineas]],
+                    'interes': '0.00',
+                    'abono': '0.00',
+                    'monto_total': '10.00',
+                    'fecha_registro': timezone.now().isoformat(),
+                }
+                serializer = FiadoSerializer(data=data, context={'request': request})
+                serializer.is_valid(raise_exception=True)
+
+                with CaptureQueriesContext(connection) as ctx:
+                    inicio = time.perf_counter()
+                    serializer.save()
+                    tiempos.append(time.perf_counter() - inicio)
+                consultas = len(ctx.captured_queries)
+
+            promedio = sum(tiempos) / len(tiempos) * 1000
+            self.stdout.write(f'{lineas:>8} {consultas:>10} {promedio:>10.2f}')
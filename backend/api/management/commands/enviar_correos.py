@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.outbox import enviar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Worker que envia por lotes los correos encolados en CorreoPendiente'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=None, help='Cantidad de correos por lote')
+        parser.add_argument('--intervalo', type=float, default=5, help='Segundos de espera cuando no hay correos')
+        parser.add_argument('--una-vez', action='store_true', help='Procesa lo pendiente y termina')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                enviados, fallidos = enviar_pendientes(tamano_lote=options['lote'])
+            except Exception as e:
+                # Servidor SMTP caido: los correos apartados se reintentan al vencer su plazo
+                self.stderr.write(f'No se pudo conectar al servidor de correo: {e}')
+                enviados = fallidos = 0
+                if options['una_vez']:
+                    return
+
+            if enviados or fallidos:
+                self.stdout.write(f'Correos enviados: {enviados}, fallidos: {fallidos}')
+                # Puede haber mas correos pendientes, se sigue sin esperar
+                continue
+
+            if options['una_vez']:
+                return
+            time.sleep(options['intervalo'])
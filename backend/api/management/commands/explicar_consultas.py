@@ -0,0 +1,78 @@
+import re
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.models import DeudaPendiente, User
+from api.views import ClienteViewSet, FiadoViewSet, ProductoViewSet
+
+# Lineas del plan que indican que se recorre la tabla completa
+# SQLite: "SCAN api_fiado" (sin USING INDEX), PostgreSQL: "Seq Scan on api_fiado"
+ESCANEO_COMPLETO = re.compile(
+    r'\bSCAN (?!.*\bUSING\b.*\bINDEX\b)(?P<sqlite>\w+)|Seq Scan on (?P<postgres>\w+)'
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta EXPLAIN sobre las consultas de listado de cada viewset y marca '
+        'los escaneos completos de tabla'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', type=int, help='ID del fiador con el que se arman las consultas')
+        parser.add_argument('--fallar', action='store_true', help='Termina con error si hay escaneos completos')
+
+    def consultas(self, user):
+        request = SimpleNamespace(user=user, method='GET', query_params={})
+        for viewset_class in (FiadoViewSet, ClienteViewSet, ProductoViewSet):
+            view = viewset_class(request=request, action='list', format_kwarg=None, kwargs={})
+            paginacion = viewset_class.pagination_class
+            queryset = view.get_queryset().order_by(paginacion.ordering)[:paginacion.page_size]
+            yield viewset_class.__name__, queryset
+
+        # El prefetch de get_deuda_pendiente se hace aparte con fiado_id IN (...)
+        yield 'FiadoViewSet (deuda_pendiente)', (
+            DeudaPendiente.objects.filter(fiado_id__in=[1, 2, 3])
+            .select_related('productos').order_by('fecha_registro')
+        )
+
+    def explicar(self, queryset):
+        if connection.vendor != 'postgresql':
+            return queryset.explain()
+        # Con tablas chicas PostgreSQL prefiere recorrerlas aunque haya indice; sin
+        # enable_seqscan solo queda un Seq Scan si ningun indice sirve para la consulta
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def handle(self, *args, **options):
+        if options['usuario']:
+            user = User.objects.filter(pk=options['usuario']).first()
+        else:
+            user = User.objects.first()
+        if user is None:
+            raise CommandError('No hay usuarios para armar las consultas')
+
+        escaneos = []
+        for nombre, queryset in self.consultas(user):
+            plan = self.explicar(queryset)
+            self.stdout.write(self.style.MIGRATE_HEADING(nombre))
+            self.stdout.write(plan)
+
+            tablas = [
+                m.group('sqlite') or m.group('postgres')
+                for m in map(ESCANEO_COMPLETO.search, plan.splitlines()) if m
+            ]
+            for tabla in tablas:
+                escaneos.append((nombre, tabla))
+                self.stdout.write(self.style.WARNING(f'  Escaneo completo de {tabla}'))
+
+        if not escaneos:
+            self.stdout.write(self.style.SUCCESS(f'Sin escaneos completos ({connection.vendor})'))
+        elif options['fallar']:
+            raise CommandError(
+                'Escaneos completos: ' + ', '.join(f'{nombre} -> {tabla}' for nombre, tabla in escaneos)
+            )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.autenticacion import podar_revocados
+
+
+class Command(BaseCommand):
+    help = 'Borra los refresh tokens revocados que ya vencieron (conviene correrlo a diario en un cron)'
+
+    def handle(self, *args, **options):
+        borrados = podar_revocados()
+        self.stdout.write(self.style.SUCCESS(f'Tokens revocados borrados: {borrados}'))
@@ -0,0 +1,100 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.cache_usuario import invalidar_usuario
+from api.models import DeudaPendiente, Fiado
+from api.saldos import recalcular_cargos
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara Fiado.monto_total con la suma de sus DeudaPendiente y reporta (o corrige '
+        'con --corregir) las diferencias. Recorre los fiados por lotes sin cargarlos todos. '
+        'Los que con el historial quedarian saldados (monto_total <= abono) solo se reportan: '
+        'la API los elimina al saldarse y eso se deja a revision manual'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corregir', action='store_true', help='Actualiza los montos que no coinciden')
+        parser.add_argument('--lote', type=int, default=1000, help='Filas por lote de lectura y de UPDATE')
+        parser.add_argument('--fiador', type=int, help='Solo los fiados de este usuario')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        fiados = Fiado.objects.all()
+        if options['fiador']:
+            fiados = fiados.filter(cliente__fiador_id=options['fiador'])
+        total = fiados.count()
+
+        # Una sola consulta agrupada: fiado LEFT JOIN deudapendiente GROUP BY fiado
+        filas = (
+            fiados.order_by('id')
+            .annotate(esperado=Sum('deudapendiente__monto_total'))
+            .values_list('id', 'monto_total', 'abono', 'esperado', 'cliente_id', 'cliente__fiador_id')
+            .iterator(chunk_size=lote)
+        )
+
+        self.procesados = self.diferencias = self.corregidos = self.sin_historial = self.saldados = 0
+        self.desfase = Decimal('0.00')
+        pendientes = []
+        for fiado_id, monto_total, abono, esperado, cliente_id, fiador_id in filas:
+            self.procesados += 1
+            if esperado is None:
+                self.sin_historial += 1
+            elif monto_total != esperado:
+                self.diferencias += 1
+                self.desfase += monto_total - esperado
+                saldado = esperado <= (abono or 0)
+                if options['verbosity'] > 1 or saldado:
+                    nota = f' (quedaria saldado con abono {abono}, no se corrige)' if saldado else ''
+                    self.stdout.write(f'  Fiado {fiado_id}: monto_total {monto_total}, historial {esperado}{nota}')
+                if saldado:
+                    self.saldados += 1
+                elif options['corregir']:
+                    pendientes.append((fiado_id, cliente_id, fiador_id))
+                    if len(pendientes) >= lote:
+                        self.corregir(pendientes)
+                        pendientes = []
+
+            if self.procesados % lote == 0:
+                self.stdout.write(f'Procesados {self.procesados}/{total}, diferencias {self.diferencias}')
+
+        if pendientes:
+            self.corregir(pendientes)
+
+        self.stdout.write(
+            f'Fiados: {self.procesados}, diferencias: {self.diferencias} '
+            f'(desfase total {self.desfase}), sin historial: {self.sin_historial}, '
+            f'saldados por el historial: {self.saldados}'
+        )
+        if options['corregir']:
+            self.stdout.write(self.style.SUCCESS(f'Corregidos: {self.corregidos}'))
+
+    def corregir(self, pendientes):
+        """
+        Corrige un lote con un solo UPDATE. El total se vuelve a sumar dentro del mismo
+        UPDATE, asi una venta confirmada despues de la lectura no se pisa con un valor viejo;
+        por lo mismo ahi se vuelve a excluir el fiado que quedaria saldado
+        """
+        historial = (
+            DeudaPendiente.objects.filter(fiado=OuterRef('pk'))
+            .order_by().values('fiado').annotate(total=Sum('monto_total')).values('total')
+        )
+        with transaction.atomic():
+            fiados = Fiado.objects.filter(pk__in=[fiado_id for fiado_id, _, _ in pendientes]).filter(
+                Q(abono__isnull=True) | Q(abono__lt=Coalesce(Subquery(historial), F('monto_total')))
+            )
+            # QuerySet.update no aplica auto_now: se fija a mano para que cambie el ETag
+            self.corregidos += fiados.update(
+                monto_total=Coalesce(Subquery(historial), F('monto_total')), fecha_actualizacion=timezone.now()
+            )
+            # Los cargos del saldo salen de monto_total (api/saldos.py)
+            recalcular_cargos({cliente_id for _, cliente_id, _ in pendientes})
+            # update() no envia señales, se invalida la cache de cada fiador afectado
+            for fiador_id in {fiador_id for _, _, fiador_id in pendientes}:
+                invalidar_usuario(fiador_id)
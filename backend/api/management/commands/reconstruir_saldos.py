@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.saldos import reconstruir_saldos
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye los saldos por cliente y por fiador desde el monto_total y los abonos de los fiados'
+
+    def handle(self, *args, **options):
+        clientes, fiadores = reconstruir_saldos()
+        self.stdout.write(self.style.SUCCESS(
+            f'Saldos reconstruidos: {clientes} clientes, {fiadores} fiadores'
+        ))
@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 10:55
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoCliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cargos', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('abonos', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('cliente', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='saldo', to='api.cliente')),
+            ],
+            options={
+                'verbose_name': 'Saldo de Cliente',
+                'verbose_name_plural': 'Saldos de Clientes',
+            },
+        ),
+        migrations.CreateModel(
+            name='SaldoFiador',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cargos', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('abonos', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('fiador', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='saldo', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Saldo de Fiador',
+                'verbose_name_plural': 'Saldos de Fiadores',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_correopendiente'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['fiador', '-id'], name='cliente_fiador_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deudapendiente',
+            index=models.Index(fields=['fiado', 'fecha_registro'], name='deuda_fiado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fiado',
+            index=models.Index(fields=['cliente', 'fecha_registro'], name='fiado_cliente_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['usuario', '-id'], name='producto_usuario_id_idx'),
+        ),
+    ]
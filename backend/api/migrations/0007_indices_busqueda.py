@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# tabla, tabla FTS5, columna del nombre, columna del dueño
+INDICES = [
+    ('api_cliente', 'api_cliente_busqueda', 'cliente_nombre', 'fiador_id'),
+    ('api_producto', 'api_producto_busqueda', 'producto_nombre', 'usuario_id'),
+]
+
+
+def crear_indices(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for tabla, fts, nombre, dueno in INDICES:
+        if vendor == 'sqlite':
+            # FTS5 con el dueño como token ("u<id>"), sincronizado por triggers
+            schema_editor.execute(
+                f'CREATE VIRTUAL TABLE {fts} USING fts5(fiador, nombre, tokenize="unicode61 remove_diacritics 2")'
+            )
+            schema_editor.execute(
+                f"INSERT INTO {fts}(rowid, fiador, nombre) SELECT id, 'u' || {dueno}, {nombre} FROM {tabla}"
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER {fts}_ai AFTER INSERT ON {tabla} BEGIN '
+                f"INSERT INTO {fts}(rowid, fiador, nombre) VALUES (new.id, 'u' || new.{dueno}, new.{nombre}); END"
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER {fts}_au AFTER UPDATE OF {nombre}, {dueno} ON {tabla} BEGIN '
+                f"UPDATE {fts} SET fiador = 'u' || new.{dueno}, nombre = new.{nombre} WHERE rowid = old.id; END"
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER {fts}_ad AFTER DELETE ON {tabla} BEGIN '
+                f'DELETE FROM {fts} WHERE rowid = old.id; END'
+            )
+        elif vendor == 'postgresql':
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            schema_editor.execute(f'CREATE INDEX {tabla}_nombre_trgm ON {tabla} USING gin ({nombre} gin_trgm_ops)')
+
+
+def borrar_indices(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for tabla, fts, nombre, dueno in INDICES:
+        if vendor == 'sqlite':
+            for sufijo in ('ai', 'au', 'ad'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts}_{sufijo}')
+            schema_editor.execute(f'DROP TABLE IF EXISTS {fts}')
+        elif vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS {tabla}_nombre_trgm')
+
+
+class Migration(migrations.Migration):
+    """
+    Indices de busqueda por nombre de clientes y productos (ver api/busqueda.py).
+    No hay operaciones de modelos: son tablas virtuales y triggers en SQLite o un
+    indice GIN de trigramas en PostgreSQL
+    """
+
+    dependencies = [
+        ('api', '0006_tokenrevocado'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, borrar_indices),
+    ]
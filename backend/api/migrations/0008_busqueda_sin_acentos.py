@@ -0,0 +1,51 @@
+from django.db import migrations
+
+# tabla, columna del nombre
+INDICES = [
+    ('api_cliente', 'cliente_nombre'),
+    ('api_producto', 'producto_nombre'),
+]
+
+# unaccent() no es IMMUTABLE porque depende del diccionario que se busque en el
+# search_path; fijando el diccionario se puede usar en un indice de expresion
+CREAR_FUNCION = """
+CREATE OR REPLACE FUNCTION api_sin_acentos(text) RETURNS text
+AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, $1)) $$
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+"""
+
+
+def crear_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS unaccent WITH SCHEMA public')
+    schema_editor.execute(CREAR_FUNCION)
+    for tabla, nombre in INDICES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {tabla}_nombre_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX {tabla}_nombre_trgm ON {tabla} USING gin (api_sin_acentos({nombre}) gin_trgm_ops)'
+        )
+
+
+def borrar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for tabla, nombre in INDICES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {tabla}_nombre_trgm')
+        schema_editor.execute(f'CREATE INDEX {tabla}_nombre_trgm ON {tabla} USING gin ({nombre} gin_trgm_ops)')
+    schema_editor.execute('DROP FUNCTION IF EXISTS api_sin_acentos(text)')
+
+
+class Migration(migrations.Migration):
+    """
+    En PostgreSQL el indice de trigramas pasa a cubrir el nombre en minusculas y
+    sin acentos, como el tokenizador de FTS5 en SQLite (ver api/busqueda.py)
+    """
+
+    dependencies = [
+        ('api', '0007_indices_busqueda'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, borrar_indices),
+    ]
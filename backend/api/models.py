@@ -3,6 +3,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
 from django.db.models import Q, F
+from decimal import Decimal
+from django.utils import timezone
 
 class User(AbstractUser):
     #Biometric es el campo que va a necesitar los usuarios para almacenar la huella
@@ -49,6 +51,10 @@ class Producto(models.Model):
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
         ordering = ['-id']  # Ordenar por ID descendente
+        indexes = [
+            # ProductoViewSet: WHERE usuario_id = ? ORDER BY id DESC (paginacion por cursor)
+            models.Index(fields=['usuario', '-id'], name='producto_usuario_id_idx'),
+        ]
 
     def __str__(self):
         return (f"Producto {self.producto_nombre}, "
@@ -72,6 +78,10 @@ class Cliente(models.Model):
         verbose_name = 'Cliente'
         verbose_name_plural = 'Clientes'
         ordering = ['-id']  # Ordenar por ID descendente
+        indexes = [
+            # ClienteViewSet: WHERE fiador_id = ? ORDER BY id DESC (paginacion por cursor)
+            models.Index(fields=['fiador', '-id'], name='cliente_fiador_id_idx'),
+        ]
 
 
 class Fiado(models.Model):
@@ -96,6 +106,8 @@ class Fiado(models.Model):
 )
     interes = models.DecimalField(max_digits=10, decimal_places=2) 
     fecha_registro = models.DateTimeField() 
+    # Se actualiza en cada save(); sirve de validador (ETag) para las peticiones condicionales
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return (f"Fiado del Cliente {self.cliente.cliente_nombre}, "
@@ -106,6 +118,10 @@ class Fiado(models.Model):
         ordering = ['cliente']
         verbose_name = 'Fiado'
         verbose_name_plural = 'Fiados'
+        indexes = [
+            # FiadoViewSet: fiados de los clientes del fiador ordenados por -fecha_registro
+            models.Index(fields=['cliente', 'fecha_registro'], name='fiado_cliente_fecha_idx'),
+        ]
 
     def clean(self):
         if self.monto_total <= 0:
@@ -142,7 +158,103 @@ class DeudaPendiente(models.Model):
     )
     fecha_registro = models.DateTimeField()  
 
+    class Meta:
+        indexes = [
+            # get_deuda_pendiente: deudas de cada fiado ordenadas por fecha_registro
+            models.Index(fields=['fiado', 'fecha_registro'], name='deuda_fiado_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"{self.productos.producto_nombre} (x{self.cantidad}) - {self.fecha_registro}"
 
 
+
+
+# Saldos materializados: se actualizan en la misma transaccion que crea o modifica
+# el fiado, asi el total adeudado a un fiador se obtiene con una sola consulta por indice
+class SaldoCliente(models.Model):
+    cliente = models.OneToOneField(Cliente, on_delete=models.CASCADE, related_name='saldo')
+    cargos = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    abonos = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Saldo de Cliente'
+        verbose_name_plural = 'Saldos de Clientes'
+
+    @property
+    def deuda_total(self):
+        return self.cargos - self.abonos
+
+    def __str__(self):
+        return f"Saldo del Cliente {self.cliente.cliente_nombre}: ${self.deuda_total}"
+
+
+class SaldoFiador(models.Model):
+    fiador = models.OneToOneField(User, on_delete=models.CASCADE, related_name='saldo')
+    cargos = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    abonos = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Saldo de Fiador'
+        verbose_name_plural = 'Saldos de Fiadores'
+
+    @property
+    def deuda_total(self):
+        return self.cargos - self.abonos
+
+    def __str__(self):
+        return f"Saldo de la Cuenta {self.fiador.email}: ${self.deuda_total}"
+
+
+# Bandeja de salida de correos: las vistas solo encolan y el comando enviar_correos
+# los despacha por lotes reutilizando una sola conexion SMTP
+class CorreoPendiente(models.Model):
+    PENDIENTE = 'pendiente'
+    ENVIADO = 'enviado'
+    FALLIDO = 'fallido'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (ENVIADO, 'Enviado'),
+        (FALLIDO, 'Fallido'),
+    ]
+
+    asunto = models.CharField(max_length=255)
+    remitente = models.CharField(max_length=255)
+    destinatarios = models.JSONField(default=list)
+    cuerpo_texto = models.TextField(blank=True)
+    cuerpo_html = models.TextField(blank=True)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    intentos = models.PositiveIntegerField(default=0)
+    ultimo_error = models.TextField(blank=True)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    fecha_registro = models.DateTimeField(auto_now_add=True)
+    fecha_envio = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Correo Pendiente'
+        verbose_name_plural = 'Correos Pendientes'
+        ordering = ['proximo_intento']
+        indexes = [
+            # El worker siempre busca: estado = pendiente AND proximo_intento <= ahora
+            models.Index(fields=['estado', 'proximo_intento'], name='correo_estado_intento_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.asunto} -> {', '.join(self.destinatarios)} ({self.estado})"
+
+
+class TokenRevocado(models.Model):
+    """
+    jti de los refresh tokens que ya se usaron (rotacion en TokenRefreshView).
+    Solo se guarda mientras el token podria seguir siendo valido; despues
+    `python manage.py podar_tokens` lo borra
+    """
+    jti = models.CharField(max_length=64, primary_key=True)
+    expira = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = 'Token Revocado'
+        verbose_name_plural = 'Tokens Revocados'
+
+    def __str__(self):
+        return self.jti
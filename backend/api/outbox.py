@@ -0,0 +1,148 @@
+"""
+Bandeja de salida persistente para los correos de api/custom_email.py.
+
+Las vistas solo llaman a encolar_mensaje() (un INSERT) y el comando
+`python manage.py enviar_correos` despacha los pendientes por lotes, abriendo
+una sola conexion SMTP por lote. Si un envio falla se reintenta con espera
+exponencial hasta EMAIL_OUTBOX_MAX_INTENTOS y luego queda como fallido.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import CorreoPendiente
+
+logger = logging.getLogger(__name__)
+
+
+def _config(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+def encolar_mensaje(email_message):
+    """
+    Guarda un EmailMultiAlternatives en la bandeja de salida en lugar de enviarlo
+    """
+    cuerpo_html = ''
+    for contenido, mimetype in getattr(email_message, 'alternatives', []):
+        if mimetype == 'text/html':
+            cuerpo_html = contenido
+            break
+
+    return CorreoPendiente.objects.create(
+        asunto=email_message.subject,
+        remitente=email_message.from_email,
+        destinatarios=list(email_message.to),
+        cuerpo_texto=email_message.body or '',
+        cuerpo_html=cuerpo_html,
+    )
+
+
+def _construir_mensaje(correo, connection):
+    mensaje = EmailMultiAlternatives(
+        subject=correo.asunto,
+        body=correo.cuerpo_texto,
+        from_email=correo.remitente,
+        to=correo.destinatarios,
+        connection=connection,
+    )
+    if correo.cuerpo_html:
+        mensaje.attach_alternative(correo.cuerpo_html, 'text/html')
+    return mensaje
+
+
+def _espera_reintento(intentos):
+    base = _config('EMAIL_OUTBOX_BACKOFF_SEGUNDOS', 30)
+    maximo = _config('EMAIL_OUTBOX_BACKOFF_MAXIMO_SEGUNDOS', 3600)
+    return timedelta(seconds=min(base * (2 ** (intentos - 1)), maximo))
+
+
+def _reclamar_lote(tamano):
+    """
+    Toma un lote de correos vencidos y los aparta por un tiempo (proximo_intento en
+    el futuro) para que otro worker no los envie al mismo tiempo. Si el worker muere
+    a mitad de lote, los correos vuelven a estar disponibles al vencer ese plazo
+    """
+    ahora = timezone.now()
+    plazo = timedelta(seconds=_config('EMAIL_OUTBOX_PLAZO_SEGUNDOS', 300))
+
+    with transaction.atomic():
+        correos = list(
+            CorreoPendiente.objects
+            .select_for_update(skip_locked=True)
+            .filter(estado=CorreoPendiente.PENDIENTE, proximo_intento__lte=ahora)
+            .order_by('proximo_intento')[:tamano]
+        )
+        if correos:
+            CorreoPendiente.objects.filter(pk__in=[c.pk for c in correos]).update(
+                proximo_intento=ahora + plazo
+            )
+    return correos
+
+
+def _cerrar(connection):
+    try:
+        connection.close()
+    except Exception as e:
+        logger.warning('Error cerrando la conexion SMTP: %s', e)
+
+
+def enviar_pendientes(tamano_lote=None, connection=None):
+    """
+    Envia un lote de correos pendientes usando una sola conexion.
+    Devuelve una tupla (enviados, fallidos)
+    """
+    tamano_lote = tamano_lote or _config('EMAIL_OUTBOX_LOTE', 50)
+    max_intentos = _config('EMAIL_OUTBOX_MAX_INTENTOS', 5)
+
+    correos = _reclamar_lote(tamano_lote)
+    if not correos:
+        return 0, 0
+
+    enviados = fallidos = 0
+    connection = connection or get_connection(fail_silently=False)
+    abierta = False
+    error_conexion = None
+    try:
+        for correo in correos:
+            correo.intentos += 1
+            error = error_conexion
+            if error is None and not abierta:
+                try:
+                    connection.open()
+                    abierta = True
+                except Exception as e:
+                    # Sin conexion no se intenta el resto del lote: todos cuentan el intento fallido
+                    error = error_conexion = e
+            if error is None:
+                try:
+                    connection.send_messages([_construir_mensaje(correo, connection)])
+                except Exception as e:
+                    error = e
+                    # Si la conexion se cayo, se vuelve a abrir para el siguiente correo
+                    _cerrar(connection)
+                    abierta = False
+
+            if error is None:
+                enviados += 1
+                correo.estado = CorreoPendiente.ENVIADO
+                correo.fecha_envio = timezone.now()
+                correo.ultimo_error = ''
+            else:
+                logger.warning('Error enviando correo %s (intento %s): %s', correo.pk, correo.intentos, error)
+                fallidos += 1
+                correo.ultimo_error = str(error)
+                if correo.intentos >= max_intentos:
+                    correo.estado = CorreoPendiente.FALLIDO
+                else:
+                    correo.proximo_intento = timezone.now() + _espera_reintento(correo.intentos)
+            correo.save(update_fields=['estado', 'intentos', 'ultimo_error', 'proximo_intento', 'fecha_envio'])
+    finally:
+        _cerrar(connection)
+
+    return enviados, fallidos
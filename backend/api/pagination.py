@@ -0,0 +1,27 @@
+"""
+Paginacion por cursor (keyset) para los listados de la API. A diferencia de
+la paginacion por pagina/offset, el cursor filtra por el ultimo valor visto
+(WHERE fecha_registro < ...), asi las paginas profundas cuestan lo mismo que
+la primera y el tiempo de respuesta no crece con el historial del usuario
+"""
+
+from rest_framework.pagination import CursorPagination
+
+
+class BaseCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class FiadoPagination(BaseCursorPagination):
+    # Mismo orden que FiadoViewSet.queryset (mas nuevo primero)
+    ordering = '-fecha_registro'
+
+
+class ClientePagination(BaseCursorPagination):
+    ordering = '-id'
+
+
+class ProductoPagination(BaseCursorPagination):
+    ordering = '-id'
@@ -26,7 +26,8 @@ class MiProducto(BasePermission):
             return True
             
         # Permite al dueño del producto cualquier acción
-        return obj.usuario == request.user
+        # (se compara el id de la FK para no cargar el usuario desde la base de datos)
+        return obj.usuario_id == request.user.id
 
 class MiCliente(BasePermission):
 
@@ -36,7 +37,7 @@ class MiCliente(BasePermission):
             return True
             
         # Permite al dueño solamente poder manejar sus propiso clientes cualquier acción
-        return obj.fiador == request.user
+        return obj.fiador_id == request.user.id
 
 
 class MiFiado(BasePermission):
@@ -45,8 +46,11 @@ class MiFiado(BasePermission):
     Permite acceso AL FIADO si:
     - El fiado que voy a registrar se lo voy asignar a uno de mis clientes
     - Cualquier usuario superstaff puede hacer modificaciones 
+
+    El queryset de FiadoViewSet hace select_related('cliente'), asi que comparar
+    cliente.fiador_id no genera consultas adicionales
     """
     def has_object_permission(self, request, view, obj):
         return (request.user.is_superuser or 
                 request.user.is_staff or 
-                obj.cliente.fiador == request.user)
+                obj.cliente.fiador_id == request.user.id)
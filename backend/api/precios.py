@@ -0,0 +1,87 @@
+"""
+Ajuste masivo de precios del catalogo de un fiador.
+
+El ajuste (porcentaje o monto fijo) se aplica con un solo
+UPDATE ... SET precio = ROUND(precio * factor, 2) sobre los productos elegidos,
+sin cargarlos en Python. ROUND de SQLite y de PostgreSQL redondea la mitad
+alejandose de cero (ROUND_HALF_UP), igual que quantize(Decimal('0.01'),
+ROUND_HALF_UP); el resultado siempre cabe en DecimalField(decimal_places=2).
+
+Antes de actualizar se comprueba con la misma expresion que ningun precio quede
+negativo o supere max_digits; si alguno lo hace no se cambia nada.
+
+QuerySet.update() no envia señales: se invalidan a mano la cache de respuestas
+y el indice de autocompletado del fiador.
+"""
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+from api.busqueda import coincidencias
+from api.cache_usuario import invalidar_productos, invalidar_usuario
+from api.models import Producto
+
+PORCENTAJE = 'porcentaje'
+MONTO = 'monto'
+
+_campo_precio = Producto._meta.get_field('precio')
+PRECIO_MAXIMO = Decimal(10) ** (_campo_precio.max_digits - _campo_precio.decimal_places) - Decimal('0.01')
+
+
+class AjusteInvalido(Exception):
+    pass
+
+
+def _precio_nuevo(tipo, valor):
+    calculo = DecimalField(max_digits=20, decimal_places=6)
+    if tipo == PORCENTAJE:
+        nuevo = F('precio') * Value(1 + valor / 100, output_field=calculo)
+    else:
+        nuevo = F('precio') + Value(valor, output_field=calculo)
+    return Round(ExpressionWrapper(nuevo, output_field=calculo), 2, output_field=_campo_precio)
+
+
+def productos_a_ajustar(user_id, nombre=None, ids=None):
+    productos = Producto.objects.filter(usuario_id=user_id)
+    if nombre:
+        # Mismo criterio que ?search= en /api/producto/ (api/busqueda.py)
+        productos = productos.filter(pk__in=coincidencias(Producto, nombre, user_id).values('pk'))
+    if ids:
+        productos = productos.filter(pk__in=ids)
+    return productos
+
+
+def ajustar_precios(user_id, tipo, valor, nombre=None, ids=None, simular=False):
+    """
+    Devuelve el resumen del ajuste. Con simular=True solo lo calcula
+    """
+    productos = productos_a_ajustar(user_id, nombre, ids)
+    nuevo = _precio_nuevo(tipo, valor)
+    total = DecimalField(max_digits=14, decimal_places=2)
+    cero = Value(Decimal('0.00'), output_field=total)
+
+    with transaction.atomic():
+        # Una sola consulta: totales antes y despues y cuantos quedarian fuera de rango
+        resumen = productos.annotate(nuevo=nuevo).aggregate(
+            productos=Count('id'),
+            total_antes=Coalesce(Sum('precio', output_field=total), cero),
+            total_despues=Coalesce(Sum('nuevo', output_field=total), cero),
+            fuera_de_rango=Count('id', filter=Q(nuevo__lt=0) | Q(nuevo__gt=PRECIO_MAXIMO)),
+        )
+        if resumen.pop('fuera_de_rango'):
+            raise AjusteInvalido(
+                f'El ajuste dejaria precios menores que 0 o mayores que {PRECIO_MAXIMO}; no se aplico'
+            )
+        if not simular and resumen['productos']:
+            productos.update(precio=nuevo)
+            invalidar_usuario(user_id)
+            invalidar_productos(user_id)
+
+    resumen['simulado'] = simular
+    # En SQLite la suma llega como float convertido, con mas decimales
+    for clave in ('total_antes', 'total_despues'):
+        resumen[clave] = str(Decimal(resumen[clave]).quantize(Decimal('0.01'), ROUND_HALF_UP))
+    return resumen
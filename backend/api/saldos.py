@@ -0,0 +1,149 @@
+"""
+Libro de saldos por Cliente y por fiador (User).
+
+- cargos: suma del monto_total de los fiados
+- abonos: suma de los abonos de los fiados
+
+Asi la deuda del saldo (cargos - abonos) es la suma de la deuda de cada fiado tal
+como la muestran la API y el admin (monto_total - abono). Si monto_total se aparta
+del historial de DeudaPendiente lo corrige `python manage.py reconciliar_fiados`.
+
+Los movimientos se aplican con UPDATE ... SET cargos = cargos + x para que dos
+ventas simultaneas no se pisen entre si. Siempre deben llamarse dentro de la
+transaccion que modifica el fiado
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from api.models import Cliente, Fiado, SaldoCliente, SaldoFiador
+
+CERO = Decimal('0.00')
+
+
+def registrar_movimiento(cliente, cargos=CERO, abonos=CERO):
+    """
+    Suma (o resta, si son negativos) cargos y abonos al saldo del cliente y de su fiador
+    """
+    if not cargos and not abonos:
+        return
+
+    with transaction.atomic():
+        SaldoCliente.objects.get_or_create(cliente_id=cliente.pk)
+        SaldoFiador.objects.get_or_create(fiador_id=cliente.fiador_id)
+
+        SaldoCliente.objects.filter(cliente_id=cliente.pk).update(
+            cargos=F('cargos') + cargos,
+            abonos=F('abonos') + abonos,
+        )
+        SaldoFiador.objects.filter(fiador_id=cliente.fiador_id).update(
+            cargos=F('cargos') + cargos,
+            abonos=F('abonos') + abonos,
+        )
+
+
+def cargos_del_fiado(fiado):
+    """
+    Lo que el fiado aporta a los cargos del saldo
+    """
+    return fiado.monto_total or CERO
+
+
+def descontar_fiados(fiados):
+    """
+    Quita del saldo todo lo que aportan los fiados del queryset, con una consulta
+    agrupada por cliente. Se llama antes de borrarlos, en la misma transaccion
+    """
+    decimal = DecimalField(max_digits=14, decimal_places=2)
+    totales = list(
+        fiados.order_by().values('cliente_id')
+        .annotate(
+            cargos=Coalesce(Sum('monto_total'), Value(CERO), output_field=decimal),
+            abonos=Coalesce(Sum('abono'), Value(CERO), output_field=decimal),
+        )
+        .values_list('cliente_id', 'cargos', 'abonos')
+    )
+    clientes = Cliente.objects.only('id', 'fiador_id').in_bulk([cliente_id for cliente_id, _, _ in totales])
+    for cliente_id, cargos, abonos in totales:
+        registrar_movimiento(clientes[cliente_id], cargos=-cargos, abonos=-abonos)
+
+
+def recalcular_cargos(cliente_ids):
+    """
+    Vuelve a sumar los cargos de esos clientes desde sus fiados, y los de sus
+    fiadores desde los saldos de sus clientes, con un UPDATE por tabla. Es para los
+    cambios de monto_total hechos con QuerySet.update() (reconciliar_fiados)
+    """
+    cliente_ids = list(cliente_ids)
+    if not cliente_ids:
+        return
+    decimal = DecimalField(max_digits=14, decimal_places=2)
+    fiadores = set(Cliente.objects.filter(pk__in=cliente_ids).values_list('fiador_id', flat=True))
+
+    with transaction.atomic():
+        SaldoCliente.objects.bulk_create(
+            [SaldoCliente(cliente_id=cliente_id) for cliente_id in cliente_ids], ignore_conflicts=True
+        )
+        SaldoFiador.objects.bulk_create(
+            [SaldoFiador(fiador_id=fiador_id) for fiador_id in fiadores], ignore_conflicts=True
+        )
+        cargos_cliente = (
+            Fiado.objects.filter(cliente_id=OuterRef('cliente_id'))
+            .order_by().values('cliente_id').annotate(total=Sum('monto_total')).values('total')
+        )
+        SaldoCliente.objects.filter(cliente_id__in=cliente_ids).update(
+            cargos=Coalesce(Subquery(cargos_cliente), Value(CERO), output_field=decimal)
+        )
+        cargos_fiador = (
+            SaldoCliente.objects.filter(cliente__fiador_id=OuterRef('fiador_id'))
+            .order_by().values('cliente__fiador_id').annotate(total=Sum('cargos')).values('total')
+        )
+        SaldoFiador.objects.filter(fiador_id__in=fiadores).update(
+            cargos=Coalesce(Subquery(cargos_fiador), Value(CERO), output_field=decimal)
+        )
+
+
+def reconstruir_saldos():
+    """
+    Vuelve a calcular todos los saldos desde el monto_total y los abonos de los
+    fiados. Devuelve la cantidad de saldos de clientes y de fiadores escritos
+    """
+    decimal = DecimalField(max_digits=14, decimal_places=2)
+
+    cargos_por_cliente = dict(
+        Fiado.objects.values('cliente_id')
+        .annotate(total=Sum('monto_total'))
+        .values_list('cliente_id', 'total')
+    )
+    abonos_por_cliente = dict(
+        Fiado.objects.values('cliente_id')
+        .annotate(total=Coalesce(Sum('abono'), Value(CERO), output_field=decimal))
+        .values_list('cliente_id', 'total')
+    )
+
+    saldos_clientes = []
+    totales_fiador = {}
+    for cliente_id, fiador_id in Cliente.objects.values_list('id', 'fiador_id').iterator():
+        cargos = cargos_por_cliente.get(cliente_id) or CERO
+        abonos = abonos_por_cliente.get(cliente_id) or CERO
+        saldos_clientes.append(SaldoCliente(cliente_id=cliente_id, cargos=cargos, abonos=abonos))
+
+        acumulado = totales_fiador.setdefault(fiador_id, [CERO, CERO])
+        acumulado[0] += cargos
+        acumulado[1] += abonos
+
+    saldos_fiadores = [
+        SaldoFiador(fiador_id=fiador_id, cargos=cargos, abonos=abonos)
+        for fiador_id, (cargos, abonos) in totales_fiador.items()
+    ]
+
+    with transaction.atomic():
+        SaldoCliente.objects.all().delete()
+        SaldoFiador.objects.all().delete()
+        SaldoCliente.objects.bulk_create(saldos_clientes, batch_size=1000)
+        SaldoFiador.objects.bulk_create(saldos_fiadores, batch_size=1000)
+
+    return len(saldos_clientes), len(saldos_fiadores)
@@ -6,6 +6,9 @@ from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
 from rest_framework.fields import SerializerMethodField
 from decimal import Decimal
+from django.db import transaction
+
+from api.saldos import registrar_movimiento, cargos_del_fiado
 
 from rest_framework.response import Response
 from rest_framework.exceptions import APIException
@@ -115,61 +118,79 @@ class UserCreateSerializer(serializers.ModelSerializer):
         return user
 
 
+##################Validacion de campos
+
+class CamposEstrictosMixin:
+    """
+    Rechaza campos que no existen en el modelo (POST/PATCH desde herramientas como Postman)
+    y, en PATCH, los que no esten en campos_patch.
+
+    Los conjuntos de campos validos se calculan una sola vez por clase de serializer
+    (la primera vez que se usan, cuando ya estan cargados todos los modelos y sus
+    relaciones inversas) y se comparan con una diferencia de frozenset
+    """
+    # Campos que se aceptan en la peticion aunque no sean del modelo
+    campos_adicionales = frozenset()
+    # Campos permitidos en PATCH; None significa sin restriccion adicional
+    campos_patch = None
+
+    @classmethod
+    def campos_validos(cls):
+        # Se busca en el __dict__ de la propia clase para no heredar la cache de otra
+        campos = cls.__dict__.get('_campos_validos')
+        if campos is None:
+            campos = frozenset(
+                field.name for field in cls.Meta.model._meta.get_fields()
+            ) | frozenset(cls.campos_adicionales)
+            cls._campos_validos = campos
+        return campos
+
+    def validate(self, data):
+        campos_validos = self.campos_validos()
+        provided_fields = self.initial_data.keys()
+
+        extra_fields = provided_fields - campos_validos
+        if extra_fields:
+            raise serializers.ValidationError(
+                f"Campos no permitidos: {', '.join(sorted(extra_fields))}. "
+                f"Campos válidos: {', '.join(sorted(campos_validos))}"
+            )
+
+        request = self.context.get('request')
+        if self.campos_patch is not None and request and request.method == 'PATCH':
+            invalid_fields = provided_fields - self.campos_patch
+            if invalid_fields:
+                raise serializers.ValidationError(
+                    f"Para actualizaciones PATCH solo se permiten: {', '.join(sorted(self.campos_patch))}. "
+                    f"Campos no permitidos: {', '.join(sorted(invalid_fields))}"
+                )
+
+        return super().validate(data)
+
+
 ##################Users 
 
-class CuentaSerializer(serializers.ModelSerializer):
+class CuentaSerializer(CamposEstrictosMixin, serializers.ModelSerializer):
     class Meta:
         model = User
     # estos son los campos que quiero que se conviertan a json
         #fields = ['id', 'username', 'email', 'password']
         fields = ['id', 'username', 'email',  'recovery_email', 'password', 'biometric']
     #Validacion para no colocar campos adicionales en peticion POST/PATCH en herramientas como Postman
-    def validate(self, data):
-        model_fields = {field.name for field in User._meta.get_fields()}
-        extra_fields = set(self.initial_data.keys()) - model_fields
-        
-        if extra_fields:
-            raise serializers.ValidationError(
-                f"Campos no permitidos: {', '.join(extra_fields)}. "
-                f"Campos válidos: {', '.join(model_fields)}"
-            )
-        return data
+    #se hace en CamposEstrictosMixin
+
+
+class ProductoSerializer(CamposEstrictosMixin, serializers.ModelSerializer):
+    # Validación para PATCH - solo permite precio y producto_nombre
+    campos_patch = frozenset({'precio', 'producto_nombre'})
 
-class ProductoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Producto
     # estos son los campos que quiero que se conviertan a json
         fields = ['id', 'usuario', 'producto_nombre', 'precio']
 
     #Validacion para no colocar campos adicionales en peticion POST/PATCH en herramientas como Postman
-    def validate(self, data):
-
-
-        model_fields = {field.name for field in Producto._meta.get_fields()}
-        extra_fields = set(self.initial_data.keys()) - model_fields
-        
-        if extra_fields:
-            raise serializers.ValidationError(
-                f"Campos no permitidos: {', '.join(extra_fields)}. "
-                f"Campos válidos: {', '.join(model_fields)}"
-            )
-        
-        # Validación para PATCH - solo permite precio y producto_nombre
-        if self.context['request'].method == 'PATCH':
-            allowed_fields = {'precio', 'producto_nombre'}
-            provided_fields = set(self.initial_data.keys())
-            
-            # Verificar campos no permitidos
-            invalid_fields = provided_fields - allowed_fields
-            if invalid_fields:
-                raise serializers.ValidationError(
-                    f"Para actualizaciones PATCH solo se permiten: {', '.join(allowed_fields)}. "
-                    f"Campos no permitidos: {', '.join(invalid_fields)}"
-                )
-        
-        return data
-
-    
+    #se hace en CamposEstrictosMixin
 
     def create(self, validated_data):
         # Asigna automáticamente el usuario actual al crear
@@ -177,45 +198,109 @@ class ProductoSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
     
 
-class ClienteSerializer(serializers.ModelSerializer):
+class AjustePreciosSerializer(serializers.Serializer):
+    """
+    Ajuste masivo de precios (api/precios.py). Sin nombre ni ids se ajustan todos
+    los productos del usuario
+    """
+    tipo = serializers.ChoiceField(choices=['porcentaje', 'monto'])
+    valor = serializers.DecimalField(max_digits=12, decimal_places=4)
+    nombre = serializers.CharField(required=False, max_length=50)
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False, max_length=10000
+    )
+    simular = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if data['tipo'] == 'porcentaje' and data['valor'] <= -100:
+            raise serializers.ValidationError({'valor': 'El porcentaje debe ser mayor que -100'})
+        return data
+
+
+class ClienteSerializer(CamposEstrictosMixin, serializers.ModelSerializer):
+    # Validación para PATCH - solo permite cliente_nombre
+    campos_patch = frozenset({'cliente_nombre'})
+
     class Meta:
         model = Cliente
     # estos son los campos que quiero que se conviertan a json
         fields = ['id', 'fiador', 'cliente_nombre']
 
     #Validacion para no colocar campos adicionales en peticion POST/PATCH en herramientas como Postman
-    def validate(self, data):
-        model_fields = {field.name for field in Cliente._meta.get_fields()}
-        extra_fields = set(self.initial_data.keys()) - model_fields
-        
-        if extra_fields:
-            raise serializers.ValidationError(
-                f"Campos no permitidos: {', '.join(extra_fields)}. "
-                f"Campos válidos: {', '.join(model_fields)}"
-            )
-    
-        # Validación para PATCH - solo permite precio y producto_nombre
-        if self.context['request'].method == 'PATCH':
-            allowed_fields = {'cliente_nombre'}
-            provided_fields = set(self.initial_data.keys())
-            
-            # Verificar campos no permitidos
-            invalid_fields = provided_fields - allowed_fields
-            if invalid_fields:
-                raise serializers.ValidationError(
-                    f"Para actualizaciones PATCH solo se permiten: {', '.join(allowed_fields)}. "
-                    f"Campos no permitidos: {', '.join(invalid_fields)}"
-                )
-        
-        return data
+    #se hace en CamposEstrictosMixin
     
 
+_campo_id = serializers.IntegerField()
+
+
+def _id_producto(valor):
+    """
+    El id como lo acepta IntegerField de DRF (7, "7", 7.0); None si no es un entero
+    (True, 1.9, "abc")
+    """
+    try:
+        return _campo_id.to_internal_value(valor)
+    except serializers.ValidationError:
+        return None
+
+
+class ProductoIdField(serializers.PrimaryKeyRelatedField):
+    """
+    Igual que PrimaryKeyRelatedField, pero si la lista padre ya cargo los productos
+    de la venta en lote, los toma de ahi en lugar de hacer una consulta por item
+    """
+    def to_internal_value(self, data):
+        lista = getattr(self.parent, 'parent', None)
+        productos = getattr(lista, '_productos', None)
+        if productos is None:
+            return super().to_internal_value(data)
+        id_producto = _id_producto(data)
+        if id_producto is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return productos[id_producto]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+class DetalleFiadoListSerializer(serializers.ListSerializer):
+    """
+    Resuelve todos los producto_id de la venta con una sola consulta id__in y
+    reporta juntos los que no existen y los que no le pertenecen al usuario
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            ids = set()
+            for item in data:
+                # Los ids que no son enteros los reporta el campo de cada item
+                id_producto = _id_producto(item.get('producto_id')) if isinstance(item, dict) else None
+                if id_producto is not None:
+                    ids.add(id_producto)
+
+            request_user = self.context['request'].user
+            productos = Producto.objects.filter(id__in=ids).in_bulk()
+            inexistentes = sorted(ids - productos.keys())
+            ajenos = sorted(
+                id_producto for id_producto, producto in productos.items()
+                if not request_user.is_staff and producto.usuario_id != request_user.id
+            )
+            errores = []
+            if inexistentes:
+                errores.append(f"Los productos no existen: {', '.join(map(str, inexistentes))}")
+            if ajenos:
+                errores.append(f"No puedes agregar productos que no te pertenecen: {', '.join(map(str, ajenos))}")
+            if errores:
+                raise serializers.ValidationError(errores)
+            self._productos = productos
+        return super().to_internal_value(data)
+
+
 # Nuevo serializador para el detalle del fiado (producto y cantidad)
 class DetalleFiadoSerializer(serializers.ModelSerializer):
     # Puedes usar un SerializerMethodField para mostrar el nombre del producto
     producto_nombre = serializers.CharField(source='producto.producto_nombre', read_only=True)
     precio = serializers.DecimalField(source='producto.precio', max_digits=10, decimal_places=2, read_only=True)
-    producto_id = serializers.PrimaryKeyRelatedField(
+    producto_id = ProductoIdField(
         queryset=Producto.objects.all(),
         source='producto', # Esto es importante para el mapeo correcto
         write_only=True    # El id del producto es solo para escritura
@@ -224,13 +309,17 @@ class DetalleFiadoSerializer(serializers.ModelSerializer):
     class Meta:
         model = DetalleFiado
         fields = ['producto_id', 'producto_nombre', 'precio', 'cantidad']
+        # La propiedad de los productos se valida en lote en DetalleFiadoListSerializer
+        list_serializer_class = DetalleFiadoListSerializer
         # El campo 'id' no se necesita en la creación de detalle
         # extra_kwargs = {'id': {'read_only': True}} # Opcional: si quieres el id del detalle en la lectura
 
     def validate_producto_id(self, value):
-        # Asegúrate de que el producto pertenezca al usuario que está registrando el fiado
+        # Si el detalle se usa fuera de la lista, se valida la propiedad item por item
+        if getattr(self.parent, '_productos', None) is not None:
+            return value
         request_user = self.context['request'].user
-        if not request_user.is_staff and value.usuario != request_user:
+        if not request_user.is_staff and value.usuario_id != request_user.id:
             raise serializers.ValidationError("No puedes agregar productos que no te pertenecen.")
         return value
     
@@ -239,7 +328,11 @@ class FiadoEliminado(APIException):
     default_detail = 'El fiado fue eliminado correctamente porque la deuda fue saldada.'
     default_code = 'fiado_eliminado'
 
-class FiadoSerializer(serializers.ModelSerializer):
+class FiadoSerializer(CamposEstrictosMixin, serializers.ModelSerializer):
+    # Agregamos 'productos' a los campos válidos para la validación
+    campos_adicionales = frozenset({'productos', 'cliente_nombre'})
+    campos_patch = frozenset({'monto_total', 'interes', 'fecha_registro', 'productos', 'abono'})
+
     cliente_nombre = serializers.CharField(source='cliente.cliente_nombre', read_only=True)
     # Aquí anidamos el serializador DetalleFiadoSerializer
     # Esto nos permite recibir y mostrar una lista de productos con sus cantidades
@@ -267,29 +360,11 @@ class FiadoSerializer(serializers.ModelSerializer):
 
     # La validación 'validate' general debe ser más cuidadosa ahora que manejamos 'productos'
     def validate(self, data):
-        # Validar campos no permitidos (revisado para incluir productos)
-        model_fields = {field.name for field in Fiado._meta.get_fields()}
-        # Agregamos 'productos' a los campos válidos para la validación
-        valid_initial_data_fields = model_fields.union({'productos', 'cliente_nombre'})
-
-        extra_fields = set(self.initial_data.keys()) - valid_initial_data_fields
-        if extra_fields:
-            raise serializers.ValidationError(
-                f"Campos no permitidos: {', '.join(extra_fields)}. "
-                f"Campos válidos: {', '.join(valid_initial_data_fields)}"
-            )
+        # Campos no permitidos (incluye productos) y restriccion de PATCH en CamposEstrictosMixin
+        data = super().validate(data)
 
         request = self.context.get('request')
         if request and request.method == 'PATCH':
-            allowed_fields = {'monto_total', 'interes', 'fecha_registro', 'productos', 'abono'}
-            provided_fields = set(self.initial_data.keys())
-            invalid_fields = provided_fields - allowed_fields
-            if invalid_fields:
-                raise serializers.ValidationError(
-                    f"Para actualizaciones PATCH solo se permiten: {', '.join(allowed_fields)}. "
-                    f"Campos no permitidos: {', '.join(invalid_fields)}"
-                )
-
             if 'cliente' in self.initial_data:
                 raise serializers.ValidationError({'cliente': 'No puedes modificar el cliente en PATCH.'})
             
@@ -305,7 +380,7 @@ class FiadoSerializer(serializers.ModelSerializer):
 
     def validate_cliente(self, value):
         # Validar que el cliente pertenezca al usuario actual
-        if value.fiador != self.context['request'].user:
+        if value.fiador_id != self.context['request'].user.id:
             raise serializers.ValidationError(
                 "No puedes registrar fiados para clientes que no son tuyos"
             )
@@ -327,50 +402,74 @@ class FiadoSerializer(serializers.ModelSerializer):
 
 
     
-        # Obtener o crear el fiado activo para este cliente
-        fiado, _ = Fiado.objects.get_or_create(
-            cliente=cliente,
-            defaults=validated_data
-        )
+        # Toda la venta se escribe en una sola transaccion con inserts/updates en lote
+        with transaction.atomic():
+            # Bloquear la fila del cliente serializa las ventas simultaneas al mismo cliente,
+            # asi dos peticiones no crean dos fiados ni se pisan el monto_total +=
+            Cliente.objects.select_for_update().only('pk').get(pk=cliente.pk)
+
+            # Obtener o crear el fiado activo para este cliente
+            fiado, creado = Fiado.objects.select_for_update().get_or_create(
+                cliente=cliente,
+                defaults=validated_data
+            )
     
-        # Si el fiado ya existía, no actualizar campos como interes, abono, etc.
-        if not _:
-            # O puedes actualizar solo si deseas
-            fiado.interes = validated_data.get('interes', fiado.interes)
-            fiado.monto_total += validated_data.get('monto_total', 0)
-            fiado.save()
+            # Si el fiado ya existía, no actualizar campos como interes, abono, etc.
+            if not creado:
+                # O puedes actualizar solo si deseas
+                fiado.interes = validated_data.get('interes', fiado.interes)
+                fiado.monto_total += validated_data.get('monto_total', 0)
+                fiado.save(update_fields=['interes', 'monto_total', 'fecha_actualizacion'])
     
-        # Obtener productos existentes en el fiado
-        productos_existentes = {
-            d.producto.id: d for d in fiado.detallefiado_set.all()
-        }
+            # Obtener productos existentes en el fiado (producto_id evita cargar cada Producto)
+            productos_existentes = {
+                d.producto_id: d for d in fiado.detallefiado_set.all()
+            }
+            detalles_actualizados = {}
+            detalles_nuevos = {}
+            deudas = []
     
-        for detalle_data in productos_data:
-            producto = detalle_data['producto']
-            cantidad = detalle_data['cantidad']
+            for detalle_data in productos_data:
+                producto = detalle_data['producto']
+                cantidad = detalle_data['cantidad']
     
-            if producto.id in productos_existentes:
-                # Si el producto ya existe, actualiza la cantidad
-                detalle = productos_existentes[producto.id]
-                detalle.cantidad += cantidad
-                detalle.save()
-            else:
-                # Si es un producto nuevo, créalo
-                DetalleFiado.objects.create(
-                    fiado=fiado,
-                    producto=producto,
-                    cantidad=cantidad
-                )
+                if producto.id in productos_existentes:
+                    # Si el producto ya existe, actualiza la cantidad
+                    detalle = productos_existentes[producto.id]
+                    detalle.cantidad += cantidad
+                    detalles_actualizados[producto.id] = detalle
+                elif producto.id in detalles_nuevos:
+                    # El mismo producto repetido en la venta suma en un solo detalle
+                    detalles_nuevos[producto.id].cantidad += cantidad
+                else:
+                    # Si es un producto nuevo, créalo
+                    detalles_nuevos[producto.id] = DetalleFiado(
+                        fiado=fiado,
+                        producto=producto,
+                        cantidad=cantidad
+                    )
     
-            # Crear nueva deuda pendiente solo para este producto (no duplicar las viejas)
-            DeudaPendiente.objects.create(
-                fiado=fiado,
-                productos=producto,
-                cantidad=cantidad,
-                interes=fiado.interes,
-                monto_total=(producto.precio * cantidad) + fiado.interes,
-                abono=Decimal("0.00"),
-                fecha_registro=fecha_registro
+                # Crear nueva deuda pendiente solo para este producto (no duplicar las viejas)
+                deudas.append(DeudaPendiente(
+                    fiado=fiado,
+                    productos=producto,
+                    cantidad=cantidad,
+                    interes=fiado.interes,
+                    monto_total=(producto.precio * cantidad) + fiado.interes,
+                    abono=Decimal("0.00"),
+                    fecha_registro=fecha_registro
+                ))
+
+            if detalles_actualizados:
+                DetalleFiado.objects.bulk_update(detalles_actualizados.values(), ['cantidad'])
+            DetalleFiado.objects.bulk_create(detalles_nuevos.values())
+            DeudaPendiente.objects.bulk_create(deudas)
+
+            # El saldo del cliente y del fiador se actualiza en la misma transaccion
+            registrar_movimiento(
+                cliente,
+                cargos=validated_data.get('monto_total', Decimal("0.00")),
+                abonos=(fiado.abono or Decimal("0.00")) if creado else Decimal("0.00"),
             )
     
         return fiado
@@ -378,8 +477,14 @@ class FiadoSerializer(serializers.ModelSerializer):
 
     def get_deuda_pendiente(self, obj):
         agrupadas = defaultdict(list)
+
+        # Si el viewset ya hizo el prefetch (ordenado y con select_related de productos)
+        # se usa la cache, asi no se hace una consulta por cada fiado ni por cada linea
+        deudas = obj.deudapendiente_set.all()
+        if 'deudapendiente_set' not in getattr(obj, '_prefetched_objects_cache', {}):
+            deudas = deudas.select_related('productos').order_by('fecha_registro')
     
-        for deuda in obj.deudapendiente_set.all().order_by('fecha_registro'):
+        for deuda in deudas:
             agrupadas[deuda.fecha_registro.isoformat()].append({
                 "producto_nombre": deuda.productos.producto_nombre,
                 "precio": str(deuda.productos.precio),
@@ -406,40 +511,59 @@ class FiadoSerializer(serializers.ModelSerializer):
         # Lógica para actualizar el fiado y sus detalles de productos
         productos_data = validated_data.pop('detallefiado_set', None)
 
-        # Actualizar campos del fiado
-        instance.monto_total = validated_data.get('monto_total', instance.monto_total)
-        instance.interes = validated_data.get('interes', instance.interes)
-        instance.fecha_registro = validated_data.get('fecha_registro', instance.fecha_registro)
-        instance.abono = validated_data.get('abono', instance.abono)
-        instance.save()
-
-        if productos_data is not None:
-            # Eliminar detalles de productos existentes que no están en la nueva lista
-            # Esto asume que si se envía una lista vacía, se eliminan todos los detalles
-            # Si quieres un comportamiento diferente (solo añadir, no eliminar implícitamente), ajusta aquí
-            current_product_ids = {d.producto.id for d in instance.detallefiado_set.all()}
-            incoming_product_ids = {d['producto'].id for d in productos_data}
-
-            for detalle_data in productos_data:
-                producto = detalle_data['producto']
-                cantidad = detalle_data['cantidad']
-                # Si el producto ya existe en el fiado, actualiza la cantidad
-                detalle_obj, created = DetalleFiado.objects.update_or_create(
-                    fiado=instance, producto=producto,
-                    defaults={'cantidad': cantidad}
+        with transaction.atomic():
+            abono_anterior = instance.abono or Decimal("0.00")
+            cargos_anterior = cargos_del_fiado(instance)
+
+            # Actualizar campos del fiado
+            instance.monto_total = validated_data.get('monto_total', instance.monto_total)
+            instance.interes = validated_data.get('interes', instance.interes)
+            instance.fecha_registro = validated_data.get('fecha_registro', instance.fecha_registro)
+            instance.abono = validated_data.get('abono', instance.abono)
+            instance.save()
+
+            if productos_data is not None:
+                # Eliminar detalles de productos existentes que no están en la nueva lista
+                # Esto asume que si se envía una lista vacía, se eliminan todos los detalles
+                # Si quieres un comportamiento diferente (solo añadir, no eliminar implícitamente), ajusta aquí
+                current_product_ids = {d.producto.id for d in instance.detallefiado_set.all()}
+                incoming_product_ids = {d['producto'].id for d in productos_data}
+
+                for detalle_data in productos_data:
+                    producto = detalle_data['producto']
+                    cantidad = detalle_data['cantidad']
+                    # Si el producto ya existe en el fiado, actualiza la cantidad
+                    detalle_obj, created = DetalleFiado.objects.update_or_create(
+                        fiado=instance, producto=producto,
+                        defaults={'cantidad': cantidad}
+                    )
+
+                # Eliminar detalles de productos que fueron removidos en la solicitud PATCH
+                # Es decir, aquellos que estaban en el fiado pero no en la lista de la solicitud
+                products_to_remove = current_product_ids - incoming_product_ids
+                DetalleFiado.objects.filter(fiado=instance, producto__id__in=products_to_remove).delete()
+
+            # Verificar si la deuda total es 0 y eliminar el fiado si aplica
+            eliminado = instance.monto_total - instance.abono <= 0
+            if eliminado:
+                # El fiado sale del saldo con todo su historial y sus abonos
+                registrar_movimiento(
+                    instance.cliente,
+                    cargos=-cargos_anterior,
+                    abonos=-abono_anterior,
+                )
+                instance.delete()
+            else:
+                registrar_movimiento(
+                    instance.cliente,
+                    cargos=cargos_del_fiado(instance) - cargos_anterior,
+                    abonos=(instance.abono or Decimal("0.00")) - abono_anterior,
                 )
 
-            # Eliminar detalles de productos que fueron removidos en la solicitud PATCH
-            # Es decir, aquellos que estaban en el fiado pero no en la lista de la solicitud
-            products_to_remove = current_product_ids - incoming_product_ids
-            DetalleFiado.objects.filter(fiado=instance, producto__id__in=products_to_remove).delete()
-
-        # Verificar si la deuda total es 0 y eliminar el fiado si aplica
-        if instance.monto_total - instance.abono <= 0:
-            instance.delete()
+        # La excepcion se lanza fuera de la transaccion para no deshacer la eliminacion
+        if eliminado:
             raise FiadoEliminado()
 
-
         return instance
 
 class LoginSerializer(serializers.Serializer):
@@ -450,7 +574,9 @@ class LoginSerializer(serializers.Serializer):
         password = attrs.get('password')
         User = get_user_model()  # Obtiene el modelo de usuario actual
         try:
-            user = User.objects.get(email=email)  # Busca el usuario por email
+            # Solo las columnas que usan el login y el token; check_password guarda el
+            # hash nuevo con save(update_fields=['password']) si cambio el hasher
+            user = User.objects.only('id', 'password', 'is_active').get(email=email)
         except User.DoesNotExist:
             raise serializers.ValidationError(_('Invalid email or password.'))
         if not user.check_password(password):  # Verifica la contraseña
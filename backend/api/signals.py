@@ -1,9 +1,63 @@
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.management import create_permissions
 
+from api.autenticacion import usuarios_cacheados
+from api.cache_usuario import invalidar_productos, invalidar_usuario
+from api.models import Cliente, DetalleFiado, DeudaPendiente, Fiado, Producto, User
+
+
 def block_default_permissions(sender, **kwargs):
     # Anula la función que crea permisos
     pass
 
 # Desconectar la señal global
 post_migrate.disconnect(receiver=create_permissions, dispatch_uid="django.contrib.auth.management.create_permissions")
+
+
+# Cualquier cambio en los datos de un fiador sube su version de cache
+# (ver api/cache_usuario.py) para que no se sirvan respuestas viejas
+
+def _borrado_en_cascada(instance, kwargs):
+    # Si el borrado lo inicio otro objeto (por ejemplo el Fiado al borrar sus deudas),
+    # la señal de ese objeto ya invalida la cache del fiador
+    origen = kwargs.get('origin')
+    return origen is not None and origen is not instance and hasattr(origen, '_meta')
+
+
+@receiver([post_save, post_delete], sender=Producto)
+def invalidar_producto(sender, instance, **kwargs):
+    invalidar_usuario(instance.usuario_id)
+    # Indice de autocompletado (api/autocompletar.py)
+    invalidar_productos(instance.usuario_id)
+
+
+@receiver([post_save, post_delete], sender=Cliente)
+def invalidar_cliente(sender, instance, **kwargs):
+    invalidar_usuario(instance.fiador_id)
+
+
+@receiver([post_save, post_delete], sender=Fiado)
+def invalidar_fiado(sender, instance, **kwargs):
+    if _borrado_en_cascada(instance, kwargs):
+        return
+    if Fiado.cliente.is_cached(instance):
+        fiador_id = instance.cliente.fiador_id
+    else:
+        fiador_id = Cliente.objects.filter(pk=instance.cliente_id).values_list('fiador_id', flat=True).first()
+    invalidar_usuario(fiador_id)
+
+
+@receiver([post_save, post_delete], sender=DetalleFiado)
+@receiver([post_save, post_delete], sender=DeudaPendiente)
+def invalidar_detalle_fiado(sender, instance, **kwargs):
+    if _borrado_en_cascada(instance, kwargs):
+        return
+    fiador_id = Fiado.objects.filter(pk=instance.fiado_id).values_list('cliente__fiador_id', flat=True).first()
+    invalidar_usuario(fiador_id)
+
+
+# Los otros procesos ven el cambio cuando vence su cache (JWT_USUARIO_CACHE_SEGUNDOS)
+@receiver([post_save, post_delete], sender=User)
+def descartar_usuario_cacheado(sender, instance, **kwargs):
+    usuarios_cacheados.descartar(instance.pk)
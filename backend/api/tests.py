@@ -1,3 +1,1431 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import socket
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.tokens import default_token_generator
+from django.contrib.admin.models import ADDITION, LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Model
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.admin import PaginadorEstimado
+from api.autocompletar import CacheIndices, IndicePrefijos, indices_productos
+from api.autenticacion import JWTAutenticacionRapida, podar_revocados, revocados, usuarios_cacheados
+from api.cache_usuario import version_usuario
+from api.exportar import acepta_gzip
+from api.models import *
+from api.outbox import encolar_mensaje, enviar_pendientes
+from api.permissions import MiFiado
+from api.serializers import ClienteSerializer, FiadoSerializer, ProductoSerializer
+from api.views import (
+    ChangeEmailView, ClienteViewSet, ConfirmarEmail, FiadoViewSet, ForgotEmailView, LoginView, ProductoViewSet,
+)
+from fiados.middleware import ApiAccessMiddleware
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:  # el stand-in SMTP es opcional
+    Controller = None
+
+
+class BaseApiTestCase(TestCase):
+    """
+    Cliente de pruebas con el header secreto que exige ApiAccessMiddleware
+    y un usuario autenticado (fiador)
+    """
+
+    def setUp(self):
+        # La cache es compartida entre pruebas y los ids se reutilizan al revertir cada prueba
+        cache.clear()
+        usuarios_cacheados.limpiar()
+        revocados.limpiar()
+        indices_productos.limpiar()
+        self.user = User.objects.create_user(
+            username='fiador', email='fiador@example.com', password='clave-segura-123'
+        )
+        self.client = self.crear_cliente_api()
+        self.client.force_authenticate(user=self.user)
+
+    def crear_cliente_api(self):
+        client = APIClient()
+        client.credentials(**{
+            'HTTP_' + settings.SECURE_API_HEADER.upper().replace('-', '_'): settings.SECURE_API_VALUE
+        })
+        return client
+
+    def crear_fiado(self, nombre, lineas=3):
+        cliente = Cliente.objects.create(fiador=self.user, cliente_nombre=nombre)
+        fiado = Fiado.objects.create(
+            cliente=cliente,
+            monto_total=Decimal('10.00'),
+            abono=Decimal('0.00'),
+            interes=Decimal('0.00'),
+            fecha_registro=timezone.now(),
+        )
+        for i in range(lineas):
+            producto = Producto.objects.create(
+                usuario=self.user, producto_nombre=f'{nombre}-producto-{i}', precio=Decimal('2.50')
+            )
+            DeudaPendiente.objects.create(
+                fiado=fiado,
+                productos=producto,
+                cantidad=1,
+                interes=Decimal('0.00'),
+                monto_total=Decimal('2.50'),
+                abono=Decimal('0.00'),
+                fecha_registro=timezone.now(),
+            )
+        return fiado
+
+
+class FiadoListQueriesTest(BaseApiTestCase):
+
+    def contar_consultas_listado(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/fiado/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_consultas_constantes_al_crecer_los_fiados(self):
+        self.crear_fiado('ana', lineas=1)
+        consultas_iniciales, _ = self.contar_consultas_listado()
+
+        for i in range(5):
+            self.crear_fiado(f'cliente-{i}', lineas=4)
+        consultas_finales, response = self.contar_consultas_listado()
+
+        self.assertEqual(consultas_iniciales, consultas_finales)
+        self.assertEqual(len(response.json()['results']), 6)
+
+    def test_deuda_pendiente_agrupada_y_ordenada(self):
+        fiado = self.crear_fiado('ana', lineas=2)
+        response = self.client.get(f'/api/fiado/{fiado.id}/')
+        self.assertEqual(response.status_code, 200)
+        items = [item for grupo in response.json()['deuda_pendiente'] for item in grupo['items']]
+        self.assertEqual([i['producto_nombre'] for i in items], ['ana-producto-0', 'ana-producto-1'])
+
+
+class CursorPaginationTest(BaseApiTestCase):
+
+    def test_recorre_productos_por_cursor_sin_repetir(self):
+        for i in range(5):
+            Producto.objects.create(usuario=self.user, producto_nombre=f'producto-{i}', precio=Decimal('1.00'))
+
+        vistos = []
+        url = '/api/producto/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertLessEqual(len(data['results']), 2)
+            vistos.extend(p['id'] for p in data['results'])
+            url = data['next']
+
+        esperados = list(Producto.objects.filter(usuario=self.user).order_by('-id').values_list('id', flat=True))
+        self.assertEqual(vistos, esperados)
+
+    def test_fiados_paginados_por_fecha_registro(self):
+        self.crear_fiado('ana', lineas=1)
+        self.crear_fiado('beto', lineas=1)
+        response = self.client.get('/api/fiado/?page_size=1')
+        data = response.json()
+        self.assertEqual([f['cliente_nombre'] for f in data['results']], ['beto'])
+        self.assertIsNone(data['previous'])
+        self.assertIsNotNone(data['next'])
+
+
+class SaldoTest(BaseApiTestCase):
+
+    def registrar_venta(self, cliente, producto, cantidad=2, monto_total='10.00', abono='0.00'):
+        return self.client.post('/api/fiado/', {
+            'cliente': cliente.id,
+            'productos': [{'producto_id': producto.id, 'cantidad': cantidad}],
+            'interes': '1.00',
+            'abono': abono,
+            'monto_total': monto_total,
+            'fecha_registro': timezone.now().isoformat(),
+        }, format='json')
+
+    def test_saldo_se_actualiza_con_ventas_y_abonos(self):
+        cliente = Cliente.objects.create(fiador=self.user, cliente_nombre='ana')
+        producto = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('3.00'))
+
+        self.assertEqual(self.registrar_venta(cliente, producto, cantidad=2, monto_total='7.00').status_code, 201)
+        self.assertEqual(self.registrar_venta(cliente, producto, cantidad=1, monto_total='4.00').status_code, 201)
+
+        saldo = self.client.get('/api/saldo/').json()
+        self.assertEqual(saldo['cargos'], '11.00')
+        self.assertEqual(saldo['deuda_total'], '11.00')
+
+        fiado = Fiado.objects.get(cliente=cliente)
+        response = self.client.patch(f'/api/fiado/{fiado.id}/', {
+            'abono': '4.00',
+            'fecha_registro': timezone.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        saldo = self.client.get('/api/saldo/').json()
+        self.assertEqual(saldo['abonos'], '4.00')
+        self.assertEqual(saldo['deuda_total'], '7.00')
+        self.assertEqual(SaldoCliente.objects.get(cliente=cliente).deuda_total, Decimal('7.00'))
+
+    def test_reconstruir_saldos_coincide_con_el_incremental(self):
+        cliente = Cliente.objects.create(fiador=self.user, cliente_nombre='ana')
+        producto = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('3.00'))
+        self.registrar_venta(cliente, producto, cantidad=3, abono='2.00')
+        esperado = SaldoFiador.objects.values_list('cargos', 'abonos').get(fiador=self.user)
+
+        SaldoFiador.objects.all().delete()
+        SaldoCliente.objects.all().delete()
+        call_command('reconstruir_saldos', stdout=StringIO())
+
+        self.assertEqual(SaldoFiador.objects.values_list('cargos', 'abonos').get(fiador=self.user), esperado)
+
+    def test_eliminar_fiado_descuenta_el_saldo(self):
+        cliente = Cliente.objects.create(fiador=self.user, cliente_nombre='ana')
+        producto = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('3.00'))
+        self.registrar_venta(cliente, producto)
+        fiado = Fiado.objects.get(cliente=cliente)
+
+        self.assertEqual(self.client.delete(f'/api/fiado/{fiado.id}/').status_code, 204)
+        self.assertEqual(self.client.get('/api/saldo/').json()['deuda_total'], '0.00')
+
+    def test_deuda_del_saldo_igual_a_la_del_fiado(self):
+        # El monto_total enviado no coincide con las lineas (3 * 2 + 1): manda monto_total
+        cliente = Cliente.objects.create(fiador=self.user, cliente_nombre='ana')
+        producto = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('3.00'))
+        self.registrar_venta(cliente, producto, cantidad=2, monto_total='10.00', abono='1.50')
+        fiado = Fiado.objects.get(cliente=cliente)
+
+        deuda_fiado = self.client.get(f'/api/fiado/{fiado.id}/').json()['deuda_total']
+        self.assertEqual(Decimal(str(deuda_fiado)), Decimal('8.50'))
+        self.assertEqual(self.client.get('/api/saldo/').json()['deuda_total'], '8.50')
+
+        response = self.client.patch(f'/api/fiado/{fiado.id}/', {
+            'monto_total': '12.00', 'fecha_registro': timezone.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SaldoCliente.objects.get(cliente=cliente).deuda_total, Decimal('10.50'))
+
+    def test_cambios_en_el_admin_actualizan_el_saldo(self):
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='x')
+        navegador = Client()
+        navegador.force_login(admin_user)
+        cliente = Cliente.objects.create(fiador=self.user, cliente_nombre='ana')
+        producto = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('3.00'))
+        self.registrar_venta(cliente, producto, monto_total='10.00')
+        fiado = Fiado.objects.get(cliente=cliente)
+
+        response = navegador.post(f'/admin/api/fiado/{fiado.pk}/change/', {
+            'abono': '4.00',
+            'deudapendiente_set-TOTAL_FORMS': '0',
+            'deudapendiente_set-INITIAL_FORMS': '0',
+        })
+        self.assertEqual(response.status_code, 302)
+        saldo = SaldoFiador.objects.get(fiador=self.user)
+        self.assertEqual((saldo.cargos, saldo.abonos), (Decimal('10.00'), Decimal('4.00')))
+
+        response = navegador.post('/admin/api/fiado/', {
+            'action': 'delete_selected', '_selected_action': [fiado.pk], 'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Fiado.objects.exists())
+        saldo.refresh_from_db()
+        self.assertEqual((saldo.cargos, saldo.abonos), (Decimal('0.00'), Decimal('0.00')))
+
+
+class VentaEnLoteTest(BaseApiTestCase):
+
+    def registrar_venta(self, cliente, productos):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/fiado/', {
+                'cliente': cliente.id,
+                'productos': [{'producto_id': p.id, 'cantidad': 1} for p in productos],
+                'interes': '0.00',
+                'abono': '0.00',
+                'monto_total': '10.00',
+                'fecha_registro': timezone.now().isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return len([q for q in ctx.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))])
+
+    def test_escrituras_no_crecen_con_las_lineas(self):
+        productos = Producto.objects.bulk_create([
+            Producto(usuario=self.user, producto_nombre=f'producto-{i}', precio=Decimal('1.00'))
+            for i in range(20)
+        ])
+        cliente_a = Cliente.objects.create(fiador=self.user, cliente_nombre='ana')
+        cliente_b = Cliente.objects.create(fiador=self.user, cliente_nombre='beto')
+        # La primera venta del fiador tambien crea su SaldoFiador
+        self.registrar_venta(Cliente.objects.create(fiador=self.user, cliente_nombre='carla'), productos[:1])
+
+        escrituras_una_linea = self.registrar_venta(cliente_a, productos[:1])
+        escrituras_veinte_lineas = self.registrar_venta(cliente_b, productos)
+        self.assertEqual(escrituras_una_linea, escrituras_veinte_lineas)
+
+    def test_productos_repetidos_y_existentes_suman_cantidad(self):
+        pan = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('1.00'))
+        cliente = Cliente.objects.create(fiador=self.user, cliente_nombre='ana')
+
+        self.registrar_venta(cliente, [pan, pan])
+        self.registrar_venta(cliente, [pan])
+
+        fiado = Fiado.objects.get(cliente=cliente)
+        self.assertEqual(fiado.monto_total, Decimal('20.00'))
+        self.assertEqual(list(fiado.detallefiado_set.values_list('cantidad', flat=True)), [3])
+        self.assertEqual(fiado.deudapendiente_set.count(), 3)
+
+
+class ValidacionProductosTest(BaseApiTestCase):
+
+    def validar(self, productos):
+        request = SimpleNamespace(user=self.user, method='POST')
+        cliente = Cliente.objects.get_or_create(fiador=self.user, cliente_nombre='ana')[0]
+        serializer = FiadoSerializer(data={
+            'cliente': cliente.id,
+            'productos': [{'producto_id': p.id, 'cantidad': 1} for p in productos],
+            'interes': '0.00',
+            'monto_total': '10.00',
+            'fecha_registro': timezone.now().isoformat(),
+        }, context={'request': request})
+        with CaptureQueriesContext(connection) as ctx:
+            valido = serializer.is_valid()
+        return valido, serializer, len(ctx.captured_queries)
+
+    def test_una_consulta_para_todos_los_productos(self):
+        productos = Producto.objects.bulk_create([
+            Producto(usuario=self.user, producto_nombre=f'producto-{i}', precio=Decimal('1.00'))
+            for i in range(20)
+        ])
+        _, _, consultas_una = self.validar(productos[:1])
+        valido, _, consultas_veinte = self.validar(productos)
+        self.assertTrue(valido)
+        self.assertEqual(consultas_una, consultas_veinte)
+
+    def test_reporta_juntos_los_productos_ajenos(self):
+        otro = User.objects.create_user(username='otro', email='otro@example.com', password='x')
+        propio = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('1.00'))
+        ajenos = [
+            Producto.objects.create(usuario=otro, producto_nombre=f'ajeno-{i}', precio=Decimal('1.00'))
+            for i in range(2)
+        ]
+        valido, serializer, _ = self.validar([propio] + ajenos)
+        self.assertFalse(valido)
+        mensaje = str(serializer.errors['productos'][0])
+        self.assertIn(f'{ajenos[0].id}, {ajenos[1].id}', mensaje)
+
+    def test_separa_inexistentes_de_ajenos(self):
+        otro = User.objects.create_user(username='otro', email='otro@example.com', password='x')
+        ajeno = Producto.objects.create(usuario=otro, producto_nombre='ajeno', precio=Decimal('1.00'))
+        inexistente = SimpleNamespace(id=ajeno.id + 100)
+        valido, serializer, _ = self.validar([ajeno, inexistente])
+        self.assertFalse(valido)
+        errores = [str(error) for error in serializer.errors['productos']]
+        self.assertEqual(errores, [
+            f'Los productos no existen: {inexistente.id}',
+            f'No puedes agregar productos que no te pertenecen: {ajeno.id}',
+        ])
+
+    def test_rechaza_ids_que_no_son_enteros(self):
+        pan = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('1.00'))
+        for valor in (pan.id + 0.9, True, 'abc'):
+            valido, serializer, _ = self.validar([SimpleNamespace(id=valor)])
+            self.assertFalse(valido, valor)
+            self.assertEqual(serializer.errors['productos'][0]['producto_id'][0].code, 'incorrect_type')
+        valido, _, _ = self.validar([SimpleNamespace(id=str(pan.id))])
+        self.assertTrue(valido)
+
+
+class CamposEstrictosTest(BaseApiTestCase):
+
+    def test_rechaza_campos_que_no_son_del_modelo(self):
+        response = self.client.post('/api/cliente/', {'fiador': self.user.id, 'cliente_nombre': 'ana', 'hackeo': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Campos no permitidos: hackeo', response.json()['non_field_errors'][0])
+
+    def test_patch_solo_acepta_los_campos_permitidos(self):
+        producto = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('1.00'))
+        response = self.client.patch(f'/api/producto/{producto.id}/', {'usuario': self.user.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Para actualizaciones PATCH solo se permiten: precio, producto_nombre', str(response.json()))
+
+        response = self.client.patch(f'/api/producto/{producto.id}/', {'precio': '2.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_campos_validos_se_calculan_una_vez_por_clase(self):
+        self.assertIs(ProductoSerializer.campos_validos(), ProductoSerializer.campos_validos())
+        self.assertIn('productos', FiadoSerializer.campos_validos())
+        self.assertNotIn('productos', ClienteSerializer.campos_validos())
+
+
+class ExplicarConsultasTest(BaseApiTestCase):
+
+    def test_listados_sin_escaneos_completos(self):
+        self.crear_fiado('ana', lineas=2)
+        salida = StringIO()
+        call_command('explicar_consultas', '--fallar', usuario=self.user.id, stdout=salida)
+        self.assertIn('Sin escaneos completos', salida.getvalue())
+
+    def test_detecta_escaneos_completos(self):
+        from api.management.commands.explicar_consultas import ESCANEO_COMPLETO
+        self.assertTrue(ESCANEO_COMPLETO.search('4 0 0 SCAN api_fiado'))
+        self.assertTrue(ESCANEO_COMPLETO.search('Seq Scan on api_fiado  (cost=0.00..1.01 rows=1)'))
+        self.assertFalse(ESCANEO_COMPLETO.search('SCAN api_cliente USING COVERING INDEX cliente_fiador_id_idx'))
+        self.assertFalse(ESCANEO_COMPLETO.search('SEARCH api_fiado USING INDEX fiado_cliente_fecha_idx'))
+
+
+class CacheRespuestasTest(BaseApiTestCase):
+
+    def test_segunda_lectura_sale_de_la_cache(self):
+        Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('1.00'))
+        self.client.get('/api/producto/')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/producto/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(response.json()['results'][0]['producto_nombre'], 'pan')
+
+    def test_etag_responde_304_sin_consultas(self):
+        Cliente.objects.create(fiador=self.user, cliente_nombre='ana')
+        etag = self.client.get('/api/cliente/')['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/cliente/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_if_none_match_compara_cada_etag(self):
+        etag = self.client.get('/api/cliente/')['ETag']
+        for header in (f'"otro", W/{etag}', '*'):
+            self.assertEqual(self.client.get('/api/cliente/', HTTP_IF_NONE_MATCH=header).status_code, 304, header)
+        # Un valor que solo contiene el ETag no coincide
+        for header in (f'"{etag}"', f'"v{etag}v"'):
+            self.assertEqual(self.client.get('/api/cliente/', HTTP_IF_NONE_MATCH=header).status_code, 200, header)
+
+    def test_escritura_invalida_la_cache_del_usuario(self):
+        producto = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('1.00'))
+        etag = self.client.get(f'/api/producto/{producto.id}/')['ETag']
+
+        self.client.patch(f'/api/producto/{producto.id}/', {'precio': '2.00'}, format='json')
+
+        response = self.client.get(f'/api/producto/{producto.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['precio'], '2.00')
+
+    def test_cache_separada_por_usuario(self):
+        Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('1.00'))
+        self.client.get('/api/producto/')
+
+        otro = User.objects.create_user(username='otro', email='otro@example.com', password='x')
+        client = self.crear_cliente_api()
+        client.force_authenticate(user=otro)
+        self.assertEqual(client.get('/api/producto/').json()['results'], [])
+
+
+class FiadoCondicionalTest(BaseApiTestCase):
+
+    def test_detalle_sin_cambios_responde_304(self):
+        fiado = self.crear_fiado('ana', lineas=3)
+        etag = self.client.get(f'/api/fiado/{fiado.id}/')['ETag']
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/fiado/{fiado.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        self.client.patch(f'/api/fiado/{fiado.id}/', {
+            'abono': '1.00', 'fecha_registro': timezone.now().isoformat(),
+        }, format='json')
+        response = self.client.get(f'/api/fiado/{fiado.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['abono'], '1.00')
+
+    def test_listado_cambia_al_agregar_o_eliminar_fiados(self):
+        fiado = self.crear_fiado('ana', lineas=1)
+        etag = self.client.get('/api/fiado/')['ETag']
+        self.assertEqual(self.client.get('/api/fiado/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.crear_fiado('beto', lineas=1)
+        self.assertEqual(self.client.get('/api/fiado/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get('/api/fiado/')['ETag']
+        Fiado.objects.filter(pk=fiado.pk).delete()
+        self.assertEqual(self.client.get('/api/fiado/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class PermisosSinConsultasTest(BaseApiTestCase):
+
+    def verificar_permisos(self, viewset_class, obj_pk, method):
+        request = SimpleNamespace(user=self.user, method=method)
+        for action in ('retrieve', 'partial_update', 'destroy'):
+            view = viewset_class(request=request, action=action, format_kwarg=None, kwargs={})
+            obj = view.get_queryset().get(pk=obj_pk)
+            with self.assertNumQueries(0):
+                permitido = all(p.has_object_permission(request, view, obj) for p in view.get_permissions())
+            self.assertTrue(permitido)
+
+    def test_fiado(self):
+        fiado = self.crear_fiado('ana', lineas=1)
+        self.verificar_permisos(FiadoViewSet, fiado.pk, 'GET')
+
+    def test_producto_y_cliente(self):
+        producto = Producto.objects.create(usuario=self.user, producto_nombre='pan', precio=Decimal('1.00'))
+        cliente = Cliente.objects.create(fiador=self.user, cliente_nombre='ana')
+        self.verificar_permisos(ProductoViewSet, producto.pk, 'PATCH')
+        self.verificar_permisos(ClienteViewSet, cliente.pk, 'PATCH')
+
+    def test_fiado_ajeno_es_rechazado_sin_consultas(self):
+        otro = User.objects.create_user(username='otro', email='otro@example.com', password='x')
+        fiado = self.crear_fiado('ana', lineas=1)
+        fiado = Fiado.objects.select_related('cliente').get(pk=fiado.pk)
+        request = SimpleNamespace(user=otro, method='GET')
+        with self.assertNumQueries(0):
+            self.assertFalse(MiFiado().has_object_permission(request, None, fiado))
+
+    def test_endpoints_no_consultan_usuarios_para_autorizar(self):
+        fiado = self.crear_fiado('ana', lineas=1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(f'/api/fiado/{fiado.id}/').status_code, 200)
+            self.client.patch(f'/api/fiado/{fiado.id}/', {
+                'abono': '1.00', 'fecha_registro': timezone.now().isoformat(),
+            }, format='json')
+            self.assertEqual(self.client.delete(f'/api/fiado/{fiado.id}/').status_code, 204)
+        consultas_usuario = [q['sql'] for q in ctx.captured_queries if 'FROM "api_user"' in q['sql']]
+        self.assertEqual(consultas_usuario, [])
+
+
+class ApiAccessMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.header = {'HTTP_' + settings.SECURE_API_HEADER.upper().replace('-', '_'): settings.SECURE_API_VALUE}
+        self.middleware = ApiAccessMiddleware(lambda request: HttpResponse('ok'))
+
+    def test_exige_header_salvo_en_rutas_exentas(self):
+        self.assertEqual(self.middleware(self.factory.get('/api/producto/')).status_code, 403)
+        self.assertEqual(self.middleware(self.factory.get('/api/producto/', **self.header)).status_code, 200)
+        self.assertEqual(self.middleware(self.factory.get('/api/auth/o/login/google-oauth2/')).status_code, 200)
+        self.assertEqual(self.middleware(self.factory.get('/static/logo.png')).status_code, 200)
+        self.assertEqual(self.middleware(self.factory.get('/api/oauth-errores/')).status_code, 403)
+
+    def test_bloquea_postman_incluso_en_rutas_exentas(self):
+        request = self.factory.get('/admin/', HTTP_USER_AGENT='PostmanRuntime/7.39.0')
+        self.assertEqual(self.middleware(request).status_code, 403)
+
+    def test_modo_asincrono(self):
+        async def get_response(request):
+            return HttpResponse('ok')
+
+        middleware = ApiAccessMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(self.factory.get('/api/producto/', **self.header))
+        self.assertEqual(response.status_code, 200)
+        response = async_to_sync(middleware)(self.factory.get('/api/producto/'))
+        self.assertEqual(response.status_code, 403)
+
+
+class AdminSinHistorialTest(TransactionTestCase):
+    """
+    Peticiones del admin en paralelo con codigo que si escribe en LogEntry:
+    el admin no debe dejar historial y los demas registros no deben perderse
+    """
+    hilos = 8
+    rondas = 5
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='clave-segura-123'
+        )
+        # Se crea antes de los hilos para que no compitan por insertarlo
+        ContentType.objects.get_for_model(Producto)
+
+    def peticiones_admin(self, indice, barrera, errores):
+        client = Client()
+        client.force_login(self.admin)
+        barrera.wait(timeout=30)
+        for ronda in range(self.rondas):
+            response = client.post('/admin/api/producto/add/', {
+                'usuario': self.admin.pk,
+                'precio': '1.50',
+                'producto_nombre': f'admin-{indice}-{ronda}',
+            })
+            if response.status_code != 302:
+                errores.append(response.status_code)
+        connections.close_all()
+
+    def registros_propios(self, indice, barrera):
+        barrera.wait(timeout=30)
+        for ronda in range(self.rondas):
+            LogEntry.objects.log_actions(
+                user_id=self.admin.pk,
+                queryset=[Producto(pk=indice * 100 + ronda, usuario=self.admin, producto_nombre='manual')],
+                action_flag=ADDITION,
+                change_message='manual',
+            )
+        connections.close_all()
+
+    def test_admin_concurrente_no_registra_ni_afecta_otros_registros(self):
+        barrera = threading.Barrier(self.hilos * 2)
+        errores = []
+        hilos = [
+            threading.Thread(target=self.peticiones_admin, args=(i, barrera, errores))
+            for i in range(self.hilos)
+        ] + [
+            threading.Thread(target=self.registros_propios, args=(i, barrera))
+            for i in range(self.hilos)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        self.assertEqual(Producto.objects.count(), self.hilos * self.rondas)
+        self.assertEqual(LogEntry.objects.count(), self.hilos * self.rondas)
+        self.assertFalse(LogEntry.objects.exclude(change_message='manual').exists())
+        self.assertEqual(LogEntry.save, Model.save)
+
+
+class VistasAsincronasTest(BaseApiTestCase):
+    """
+    Login y endpoints de correo como vistas asincronas, tanto por WSGI (cliente
+    de DRF) como por ASGI (AsyncClient)
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user.recovery_email = 'recuperar@example.com'
+        self.user.save(update_fields=['recovery_email'])
+        self.anonimo = self.crear_cliente_api()
+
+    def test_vistas_son_corrutinas(self):
+        for vista in (LoginView, ChangeEmailView, ForgotEmailView, ConfirmarEmail):
+            self.assertTrue(iscoroutinefunction(vista.as_view()), vista.__name__)
+
+    def test_login(self):
+        response = self.anonimo.post(
+            '/api/login/', {'email': 'fiador@example.com', 'password': 'clave-segura-123'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+
+        response = self.anonimo.post(
+            '/api/login/', {'email': 'fiador@example.com', 'password': 'incorrecta'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_correos_se_encolan(self):
+        response = self.client.post('/api/auth/change/email/')
+        self.assertEqual(response.status_code, 200)
+        response = self.anonimo.post(
+            '/api/auth/reset/email/', {'recovery_email': 'recuperar@example.com'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(CorreoPendiente.objects.values_list('destinatarios', flat=True)),
+            [['fiador@example.com'], ['recuperar@example.com']],
+        )
+
+    def test_errores_de_autenticacion_y_metodo(self):
+        self.assertEqual(self.anonimo.post('/api/auth/change/email/').status_code, 401)
+        self.assertEqual(self.client.get('/api/auth/change/email/').status_code, 405)
+        response = self.anonimo.post('/api/auth/reset/email/', {'recovery_email': 'nadie@example.com'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_confirmar_email(self):
+        datos = {
+            'uid': urlsafe_base64_encode(force_bytes(self.user.pk)),
+            'token': default_token_generator.make_token(self.user),
+            'new_email': 'nuevo@example.com',
+        }
+        response = self.anonimo.post('/api/auth/email/confirm/', datos, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.pending_email, 'nuevo@example.com')
+
+    async def test_login_por_asgi(self):
+        header = {settings.SECURE_API_HEADER: settings.SECURE_API_VALUE}
+        response = await self.async_client.post(
+            '/api/login/',
+            {'email': 'fiador@example.com', 'password': 'clave-segura-123'},
+            content_type='application/json',
+            headers=header,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+
+class LoginHasherTest(BaseApiTestCase):
+
+    def login(self):
+        return self.crear_cliente_api().post(
+            '/api/login/', {'email': 'fiador@example.com', 'password': 'clave-segura-123'}, format='json'
+        )
+
+    def test_contraseña_nueva_usa_el_hasher_configurado(self):
+        self.assertTrue(self.user.password.startswith('argon2$argon2id$v=19$m=19456,t=2,p=1$'))
+
+    def test_rehash_al_iniciar_sesion(self):
+        self.user.password = make_password('clave-segura-123', hasher='pbkdf2_sha256')
+        self.user.save(update_fields=['password'])
+
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('argon2$'))
+        self.assertTrue(self.user.check_password('clave-segura-123'))
+
+    def test_login_solo_carga_las_columnas_necesarias(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.login().status_code, 200)
+        consulta_usuario = next(q['sql'] for q in consultas.captured_queries if 'FROM "api_user"' in q['sql'])
+        self.assertIn('"password"', consulta_usuario)
+        self.assertNotIn('"biometric"', consulta_usuario)
+        # Sin rehash no hay UPDATE
+        self.assertEqual(len(consultas), 1)
+
+
+class AutenticacionCacheUsuarioTest(BaseApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.producto = Producto.objects.create(usuario=self.user, producto_nombre='Harina', precio=Decimal('1.00'))
+        self.token = RefreshToken.for_user(self.user)
+
+    def cliente_con_token(self, token):
+        client = self.crear_cliente_api()
+        client.credentials(**{
+            'HTTP_' + settings.SECURE_API_HEADER.upper().replace('-', '_'): settings.SECURE_API_VALUE,
+            'HTTP_AUTHORIZATION': f'Bearer {token.access_token}',
+        })
+        return client
+
+    def consultas_usuario(self, client, metodo, ruta, **kwargs):
+        with CaptureQueriesContext(connection) as consultas:
+            response = getattr(client, metodo)(ruta, **kwargs)
+        self.assertLess(response.status_code, 300, response.content)
+        return [q['sql'] for q in consultas.captured_queries if 'FROM "api_user"' in q['sql']]
+
+    def test_lectura_usa_el_usuario_en_cache(self):
+        client = self.cliente_con_token(self.token)
+        self.assertEqual(len(self.consultas_usuario(client, 'get', '/api/producto/')), 1)
+        self.assertEqual(self.consultas_usuario(client, 'get', '/api/producto/'), [])
+
+    def test_usuario_desactivado_no_lee_con_su_token(self):
+        client = self.cliente_con_token(self.token)
+        self.assertEqual(client.get('/api/producto/').status_code, 200)
+
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(client.get('/api/producto/').status_code, 401)
+
+    def test_escritura_carga_el_usuario_de_la_base_de_datos(self):
+        client = self.cliente_con_token(self.token)
+        self.consultas_usuario(client, 'get', '/api/producto/')
+        # Un cambio hecho por otro proceso no descarta la cache de este
+        User.objects.filter(pk=self.user.pk).update(last_login=timezone.now())
+
+        request = Request(RequestFactory().post(
+            '/api/auth/change/email/', HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}'
+        ))
+        user, _ = JWTAutenticacionRapida().authenticate(request)
+        self.assertIsNotNone(user.last_login)
+
+        # Cada escritura consulta el usuario, aunque este en la cache
+        ruta = f'/api/producto/{self.producto.pk}/'
+        primera = len(self.consultas_usuario(client, 'patch', ruta, data={'precio': '2.00'}, format='json'))
+        segunda = len(self.consultas_usuario(client, 'patch', ruta, data={'precio': '3.00'}, format='json'))
+        self.assertGreaterEqual(primera, 1)
+        self.assertEqual(segunda, primera)
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.precio, Decimal('3.00'))
+
+    def test_sin_cache_si_se_desactiva(self):
+        client = self.cliente_con_token(self.token)
+        with self.settings(JWT_USUARIO_CACHE_SEGUNDOS=0):
+            self.assertEqual(len(self.consultas_usuario(client, 'get', '/api/producto/')), 1)
+            self.assertEqual(len(self.consultas_usuario(client, 'get', '/api/producto/')), 1)
+
+
+class RotacionRefreshTest(BaseApiTestCase):
+
+    def refrescar(self, refresh):
+        return self.crear_cliente_api().post('/api/token/refresh/', {'refresh': str(refresh)}, format='json')
+
+    def test_rota_y_revoca_el_token_usado(self):
+        refresh = RefreshToken.for_user(self.user)
+        response = self.refrescar(refresh)
+        self.assertEqual(response.status_code, 200)
+        nuevo = response.data['refresh']
+        self.assertNotEqual(nuevo, str(refresh))
+        self.assertTrue(TokenRevocado.objects.filter(jti=refresh['jti']).exists())
+
+        # El token usado ya no sirve, ni desde la memoria ni desde la base de datos
+        self.assertEqual(self.refrescar(refresh).data, {'error': 'Token revocado'})
+        revocados.limpiar()
+        self.assertEqual(self.refrescar(refresh).data, {'error': 'Token revocado'})
+
+        self.assertEqual(self.refrescar(nuevo).status_code, 200)
+
+    def test_tokens_de_larga_vida_se_limitan(self):
+        refresh = RefreshToken.for_user(self.user)
+        refresh.set_exp(lifetime=timedelta(days=365 * 100))
+        response = self.refrescar(refresh)
+        self.assertEqual(response.status_code, 200)
+        # El jti se guarda solo hasta iat + REFRESH_TOKEN_LIFETIME
+        expira = TokenRevocado.objects.get(jti=refresh['jti']).expira
+        self.assertLessEqual(expira, timezone.now() + settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'])
+
+        viejo = RefreshToken.for_user(self.user)
+        viejo.set_iat(at_time=timezone.now() - timedelta(days=365))
+        viejo.set_exp(lifetime=timedelta(days=365 * 100))
+        self.assertEqual(self.refrescar(viejo).data, {'error': 'Token inválido'})
+
+    def test_usuario_inactivo(self):
+        refresh = RefreshToken.for_user(self.user)
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.refrescar(refresh).data, {'error': 'Token inválido'})
+
+    def test_podar_solo_borra_los_vencidos(self):
+        TokenRevocado.objects.create(jti='vencido', expira=timezone.now() - timedelta(minutes=1))
+        TokenRevocado.objects.create(jti='vigente', expira=timezone.now() + timedelta(days=1))
+        self.assertEqual(podar_revocados(), 1)
+        self.assertEqual(list(TokenRevocado.objects.values_list('jti', flat=True)), ['vigente'])
+
+
+class ReconciliarFiadosTest(BaseApiTestCase):
+
+    def test_reporta_sin_modificar(self):
+        fiado = self.crear_fiado('Ana')
+        salida = StringIO()
+        call_command('reconciliar_fiados', stdout=salida)
+        self.assertIn('diferencias: 1 (desfase total 2.50)', salida.getvalue())
+        fiado.refresh_from_db()
+        self.assertEqual(fiado.monto_total, Decimal('10.00'))
+
+    def test_corrige_desde_el_historial(self):
+        fiado = self.crear_fiado('Ana')
+        correcto = self.crear_fiado('Beto')
+        Fiado.objects.filter(pk=correcto.pk).update(monto_total=Decimal('7.50'))
+        sin_historial = self.crear_fiado('Carla', lineas=0)
+        call_command('reconstruir_saldos', stdout=StringIO())
+        antes = Fiado.objects.get(pk=fiado.pk).fecha_actualizacion
+        version = version_usuario(self.user.id)
+
+        salida = StringIO()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('reconciliar_fiados', '--corregir', '--lote', '1', stdout=salida)
+        self.assertIn('Corregidos: 1', salida.getvalue())
+        self.assertIn('sin historial: 1', salida.getvalue())
+        # Una sola lectura agrupada para todos los fiados, sin importar el tamaño del lote
+        # (en PostgreSQL iterator() lee con un cursor del servidor: DECLARE ... FOR SELECT)
+        lecturas = [q['sql'] for q in ctx.captured_queries if q['sql'].upper().startswith(('SELECT', 'DECLARE'))]
+        self.assertEqual(sum('SUM(' in sql.upper() for sql in lecturas), 1)
+
+        fiado.refresh_from_db()
+        self.assertEqual(fiado.monto_total, Decimal('7.50'))
+        self.assertGreater(fiado.fecha_actualizacion, antes)
+        self.assertEqual(Fiado.objects.get(pk=sin_historial.pk).monto_total, Decimal('10.00'))
+        self.assertNotEqual(version_usuario(self.user.id), version)
+        # Los cargos del saldo siguen al monto_total corregido
+        self.assertEqual(SaldoCliente.objects.get(cliente=fiado.cliente).cargos, Decimal('7.50'))
+        self.assertEqual(SaldoFiador.objects.get(fiador=self.user).cargos, Decimal('25.00'))
+
+        salida = StringIO()
+        call_command('reconciliar_fiados', stdout=salida)
+        self.assertIn('diferencias: 0', salida.getvalue())
+
+    def test_no_corrige_los_que_quedarian_saldados(self):
+        fiado = self.crear_fiado('Ana')
+        Fiado.objects.filter(pk=fiado.pk).update(abono=Decimal('8.00'))
+
+        salida = StringIO()
+        call_command('reconciliar_fiados', '--corregir', stdout=salida)
+        self.assertIn(f'Fiado {fiado.pk}: monto_total 10.00', salida.getvalue())
+        self.assertIn('(quedaria saldado con abono 8.00, no se corrige)', salida.getvalue())
+        self.assertIn('saldados por el historial: 1', salida.getvalue())
+        self.assertIn('Corregidos: 0', salida.getvalue())
+        fiado.refresh_from_db()
+        self.assertEqual(fiado.monto_total, Decimal('10.00'))
+
+    def test_filtra_por_fiador(self):
+        self.crear_fiado('Ana')
+        otro = User.objects.create_user(username='otro', email='otro@example.com', password='x')
+        salida = StringIO()
+        call_command('reconciliar_fiados', fiador=otro.id, stdout=salida)
+        self.assertIn('Fiados: 0', salida.getvalue())
+
+
+class ExportarTest(BaseApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fiado = self.crear_fiado('Ana')
+        otro = User.objects.create_user(username='otro', email='otro@example.com', password='x')
+        cliente = Cliente.objects.create(fiador=otro, cliente_nombre='Ajeno')
+        Fiado.objects.create(
+            cliente=cliente, monto_total=Decimal('5.00'), interes=Decimal('0.00'), fecha_registro=timezone.now()
+        )
+
+    def leer(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_jsonl_con_todas_las_tablas_del_usuario(self):
+        response = self.client.get('/api/exportar/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        registros = [json.loads(linea) for linea in self.leer(response).decode().splitlines()]
+
+        por_tabla = {}
+        for registro in registros:
+            por_tabla.setdefault(registro['tabla'], []).append(registro)
+        self.assertEqual([r['cliente_nombre'] for r in por_tabla['clientes']], ['Ana'])
+        self.assertEqual([r['id'] for r in por_tabla['fiados']], [self.fiado.id])
+        self.assertEqual(por_tabla['fiados'][0]['monto_total'], '10.00')
+        self.assertEqual(len(por_tabla['deudas']), 3)
+        self.assertEqual(por_tabla['deudas'][0]['producto_nombre'], 'Ana-producto-0')
+        self.assertNotIn('detalles', por_tabla)
+
+    def test_csv_por_tabla(self):
+        response = self.client.get('/api/exportar/', {'formato': 'csv', 'tabla': 'deudas'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('fiador-deudas.csv', response['Content-Disposition'])
+        filas = list(csv.reader(self.leer(response).decode().splitlines()))
+        self.assertEqual(filas[0][:4], ['id', 'fiado_id', 'producto_id', 'producto_nombre'])
+        self.assertEqual(len(filas), 4)
+
+        self.assertEqual(self.client.get('/api/exportar/', {'formato': 'csv'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/exportar/', {'formato': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/exportar/', {'tabla': 'usuarios'}).status_code, 400)
+
+    def test_gzip_si_el_cliente_lo_acepta(self):
+        plano = self.leer(self.client.get('/api/exportar/'))
+        response = self.client.get('/api/exportar/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(self.leer(response)), plano)
+
+        response = self.client.get('/api/exportar/', HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.leer(response), plano)
+
+    def test_q_de_accept_encoding(self):
+        for cabecera, esperado in (
+            ('gzip', True),
+            ('deflate, GZIP;q=0.5', True),
+            ('x-gzip', True),
+            ('gzip;q=0', False),
+            ('gzip; q=0.0, *;q=1', False),
+            ('*', True),
+            ('*;q=0', False),
+            ('gzipx, br', False),
+            ('', False),
+        ):
+            self.assertEqual(acepta_gzip(cabecera), esperado, cabecera)
+
+    def test_requiere_autenticacion(self):
+        response = self.crear_cliente_api().get('/api/exportar/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_asgi_usa_contenido_asincrono(self):
+        plano = self.leer(self.client.get('/api/exportar/'))
+        with override_settings(SERVIDOR_ASGI=True):
+            response = self.client.get('/api/exportar/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.is_async)
+
+        async def leer():
+            return b''.join([bloque async for bloque in response.streaming_content])
+
+        self.assertEqual(gzip.decompress(async_to_sync(leer)()), plano)
+
+
+class FiadoAdminTest(BaseApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='clave-segura-123'
+        )
+        self.navegador = Client()
+        self.navegador.force_login(self.admin)
+
+    def consultas_changelist(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.navegador.get('/admin/api/fiado/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx), response
+
+    def test_changelist_con_consultas_fijas(self):
+        fiado = self.crear_fiado('Ana', lineas=1)
+        Fiado.objects.filter(pk=fiado.pk).update(abono=Decimal('2.50'))
+        pocas, response = self.consultas_changelist()
+        self.assertContains(response, '$7.50')
+
+        for i in range(10):
+            self.crear_fiado(f'Cliente {i}', lineas=1)
+        muchas, _ = self.consultas_changelist()
+        self.assertEqual(muchas, pocas)
+
+        # Ordenar por la deuda total, calculada en SQL
+        response = self.navegador.get('/admin/api/fiado/', {'o': '5'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_inline_de_deudas_paginado(self):
+        fiado = self.crear_fiado('Ana', lineas=60)
+        url = f'/admin/api/fiado/{fiado.pk}/change/'
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.navegador.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.count(b'Ana-producto-'), 50)
+        self.assertContains(response, 'Página 1 de 2')
+        self.assertLess(len(ctx), 20)
+
+        response = self.navegador.get(url, {'pagina_deudas': 2})
+        self.assertEqual(response.content.count(b'Ana-producto-'), 10)
+        self.assertContains(response, 'Ana-producto-59')
+
+    def test_editar_en_el_admin_cambia_el_etag(self):
+        fiado = self.crear_fiado('Ana', lineas=0)
+        antes = fiado.fecha_actualizacion
+        etag = self.client.get(f'/api/fiado/{fiado.pk}/')['ETag']
+
+        response = self.navegador.post(f'/admin/api/fiado/{fiado.pk}/change/', {
+            'abono': '4.00',
+            'deudapendiente_set-TOTAL_FORMS': '0',
+            'deudapendiente_set-INITIAL_FORMS': '0',
+        })
+        self.assertEqual(response.status_code, 302)
+        fiado.refresh_from_db()
+        self.assertEqual(fiado.abono, Decimal('4.00'))
+        self.assertGreater(fiado.fecha_actualizacion, antes)
+
+        response = self.client.get(f'/api/fiado/{fiado.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['abono'], '4.00')
+
+    def test_paginador_estimado(self):
+        for i in range(3):
+            self.crear_fiado(f'Cliente {i}', lineas=0)
+        self.assertEqual(PaginadorEstimado(Fiado.objects.all(), 100).count, 3)
+
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute("UPDATE sqlite_stat1 SET stat = '2000000 1' WHERE tbl = 'api_fiado'")
+        self.assertEqual(PaginadorEstimado(Fiado.objects.all(), 100).count, 2000000)
+        # Con filtros cuenta de verdad
+        filtrados = Fiado.objects.filter(cliente__fiador=self.user)
+        self.assertEqual(PaginadorEstimado(filtrados, 100).count, 3)
+
+
+class BusquedaTest(BaseApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for nombre in ('José Pérez', 'Josefina', 'Mario'):
+            Cliente.objects.create(fiador=self.user, cliente_nombre=nombre)
+        otro = User.objects.create_user(username='otro', email='otro@example.com', password='x')
+        Cliente.objects.create(fiador=otro, cliente_nombre='José ajeno')
+
+    def nombres(self, url, campo='cliente_nombre'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [fila[campo] for fila in response.json()['results']]
+
+    def test_clientes_por_prefijo_sin_acentos(self):
+        self.assertCountEqual(self.nombres('/api/cliente/?search=jose'), ['José Pérez', 'Josefina'])
+        self.assertEqual(self.nombres('/api/cliente/?search=JOSE per'), ['José Pérez'])
+        self.assertEqual(self.nombres('/api/cliente/?search=pedro'), [])
+        # Los caracteres de la sintaxis de FTS5 no rompen la consulta
+        self.assertEqual(self.nombres('/api/cliente/?search="jose* OR'), [])
+
+    def test_ordenado_por_relevancia_y_paginado(self):
+        for i in range(3):
+            Producto.objects.create(usuario=self.user, producto_nombre=f'pan {i}', precio=Decimal('1.00'))
+        Producto.objects.create(usuario=self.user, producto_nombre='pan pan pan', precio=Decimal('1.00'))
+        Producto.objects.create(usuario=self.user, producto_nombre='leche', precio=Decimal('1.00'))
+
+        response = self.client.get('/api/producto/?search=pan&page_size=2')
+        data = response.json()
+        self.assertEqual(data['count'], 4)
+        self.assertEqual(data['results'][0]['producto_nombre'], 'pan pan pan')
+        self.assertEqual(len(data['results']), 2)
+        siguiente = self.client.get(data['next']).json()
+        self.assertEqual(len(siguiente['results']), 2)
+
+    def test_el_indice_sigue_los_cambios(self):
+        cliente = Cliente.objects.get(cliente_nombre='Mario')
+        self.client.patch(f'/api/cliente/{cliente.id}/', {'cliente_nombre': 'Marta'}, format='json')
+        self.assertEqual(self.nombres('/api/cliente/?search=marta'), ['Marta'])
+        # Tambien con QuerySet.update, que no envia señales
+        Cliente.objects.filter(pk=cliente.pk).update(cliente_nombre='Rosa')
+        cache.clear()
+        self.assertEqual(self.nombres('/api/cliente/?search=marta'), [])
+        self.assertEqual(self.nombres('/api/cliente/?search=rosa'), ['Rosa'])
+        cliente.delete()
+        self.assertEqual(self.nombres('/api/cliente/?search=rosa'), [])
+
+    def test_fiados_por_nombre_del_cliente(self):
+        self.crear_fiado('Josefa Ruiz', lineas=1)
+        self.crear_fiado('Pedro', lineas=1)
+        with CaptureQueriesContext(connection) as ctx:
+            nombres = self.nombres('/api/fiado/?search=josefa')
+        self.assertEqual(nombres, ['Josefa Ruiz'])
+        self.assertLess(len(ctx), 8)
+        # El ETag y la pagina usan las mismas coincidencias: el indice se consulta una vez
+        if connection.vendor == 'sqlite':
+            self.assertEqual(sum('MATCH' in q['sql'] for q in ctx.captured_queries), 1)
+
+    def test_indica_si_se_truncaron_los_resultados(self):
+        data = self.client.get('/api/cliente/?search=jose').json()
+        self.assertFalse(data['truncado'])
+        with mock.patch('api.busqueda.MAX_RESULTADOS', 1):
+            cache.clear()
+            data = self.client.get('/api/cliente/?search=jose').json()
+        self.assertTrue(data['truncado'])
+        self.assertEqual(data['count'], 1)
+
+    def test_admin_busca_con_el_indice(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='x')
+        self.crear_fiado('Josefa Ruiz', lineas=0)
+        self.crear_fiado('Pedro', lineas=0)
+        navegador = Client()
+        navegador.force_login(admin)
+        response = navegador.get('/admin/api/fiado/', {'q': 'josefa'})
+        self.assertContains(response, 'Josefa Ruiz')
+        self.assertNotContains(response, 'Pedro')
+        response = navegador.get('/admin/api/fiado/', {'q': 'fiador@example'})
+        self.assertContains(response, 'Pedro')
+
+
+class AutocompletarTest(BaseApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for nombre in ('Leche entera', 'Leche descremada', 'Pan dulce', 'Café molido'):
+            Producto.objects.create(usuario=self.user, producto_nombre=nombre, precio=Decimal('1.50'))
+        otro = User.objects.create_user(username='otro', email='otro@example.com', password='x')
+        Producto.objects.create(usuario=otro, producto_nombre='Leche de otro', precio=Decimal('1.00'))
+
+    def nombres(self, q, **params):
+        response = self.client.get('/api/producto/autocompletar/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [producto['producto_nombre'] for producto in response.json()]
+
+    def test_prefijo_del_nombre_y_de_cada_palabra(self):
+        self.assertEqual(self.nombres('lec'), ['Leche descremada', 'Leche entera'])
+        self.assertEqual(self.nombres('leche e'), ['Leche entera'])
+        self.assertEqual(self.nombres('ENT'), ['Leche entera'])
+        self.assertEqual(self.nombres('cafe'), ['Café molido'])
+        self.assertEqual(self.nombres('lec', limite=1), ['Leche descremada'])
+        self.assertEqual(self.nombres(''), [])
+        response = self.client.get('/api/producto/autocompletar/', {'q': 'pan'})
+        self.assertEqual(response.json(), [{
+            'id': Producto.objects.get(producto_nombre='Pan dulce').id,
+            'producto_nombre': 'Pan dulce',
+            'precio': '1.50',
+        }])
+
+    def test_sin_consultas_con_el_indice_cargado(self):
+        self.nombres('lec')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.nombres('pan'), ['Pan dulce'])
+
+    def test_se_invalida_al_guardar_o_borrar_productos(self):
+        self.nombres('lec')
+        response = self.client.post('/api/producto/', {
+            'usuario': self.user.id, 'producto_nombre': 'Lechuga', 'precio': '2.00'
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.nombres('lec'), ['Leche descremada', 'Leche entera', 'Lechuga'])
+        Producto.objects.get(producto_nombre='Lechuga').delete()
+        self.assertEqual(self.nombres('lechu'), [])
+
+    def test_lru_con_presupuesto_de_memoria(self):
+        indice = IndicePrefijos([(1, 'Leche entera', Decimal('1.00'))])
+        cache_indices = CacheIndices(memoria=indice.tamano * 2)
+        for user_id in (1, 2, 3):
+            cache_indices.guardar(user_id, 'v1', IndicePrefijos([(1, 'Leche entera', Decimal('1.00'))]))
+        self.assertIsNone(cache_indices.obtener(1, 'v1'))
+        self.assertIsNotNone(cache_indices.obtener(3, 'v1'))
+        self.assertIsNone(cache_indices.obtener(3, 'v2'))
+        self.assertLessEqual(cache_indices.usada, cache_indices.memoria)
+
+    def test_indice_vence_por_edad(self):
+        cache_indices = CacheIndices(memoria=10 ** 6, edad_maxima=300)
+        with mock.patch('api.autocompletar.time.monotonic', return_value=1000.0):
+            cache_indices.guardar(1, 'v1', IndicePrefijos([(1, 'Leche entera', Decimal('1.00'))]))
+        with mock.patch('api.autocompletar.time.monotonic', return_value=1200.0):
+            self.assertIsNotNone(cache_indices.obtener(1, 'v1'))
+        # Otro proceso cambio el producto sin que la version llegara a este: se reconstruye igual
+        with mock.patch('api.autocompletar.time.monotonic', return_value=1301.0):
+            self.assertIsNone(cache_indices.obtener(1, 'v1'))
+
+
+class ImportarProductosTest(BaseApiTestCase):
+    url = '/api/producto/importar/'
+
+    def setUp(self):
+        super().setUp()
+        Producto.objects.create(usuario=self.user, producto_nombre='Pan', precio=Decimal('1.00'))
+
+    def precios(self):
+        return dict(Producto.objects.filter(usuario=self.user).values_list('producto_nombre', 'precio'))
+
+    def test_csv_con_upsert_y_reporte_por_fila(self):
+        contenido = (
+            'producto_nombre,precio\n'
+            'Pan,2.00\n'
+            'Leche,1.50\n'
+            'Queso,abc\n'
+            ',3.00\n'
+            'Huevos,-1\n'
+            'Leche,1.75\n'
+        ).encode()
+        with mock.patch('api.importar.LOTE', 2):
+            response = self.client.post(self.url, data=contenido, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['filas'], 6)
+        self.assertEqual(data['total_errores'], 3)
+        self.assertEqual([error['fila'] for error in data['errores']], [4, 5, 6])
+        self.assertIn('precio', data['errores'][0]['errores'])
+        self.assertIn('producto_nombre', data['errores'][1]['errores'])
+        self.assertEqual(self.precios(), {'Pan': Decimal('2.00'), 'Leche': Decimal('1.75')})
+
+    def test_jsonl_como_archivo(self):
+        archivo = SimpleUploadedFile('catalogo.jsonl', (
+            '{"producto_nombre": "Café", "precio": "3.10"}\n'
+            '\n'
+            '[1, 2]\n'
+            '{"producto_nombre": "Pan", "precio": 1.25}\n'
+        ).encode())
+        response = self.client.post(self.url, {'archivo': archivo}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['creados'], data['actualizados'], data['total_errores']), (1, 1, 1))
+        self.assertEqual(data['errores'][0]['fila'], 3)
+        self.assertEqual(self.precios(), {'Pan': Decimal('1.25'), 'Café': Decimal('3.10')})
+
+    def test_archivo_ilegible(self):
+        response = self.client.post(self.url, data=b'nombre,precio\nPan,2\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.precios(), {'Pan': Decimal('1.00')})
+
+        # Cada lote se confirma por separado: lo anterior al error queda guardado y se informa
+        contenido = b'producto_nombre,precio\nLeche,1.00\n' + 'Té,2.00\n'.encode('latin-1')
+        with mock.patch('api.importar.LOTE', 1):
+            response = self.client.post(self.url, data=contenido, content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['creados'], 1)
+        self.assertEqual(self.precios(), {'Pan': Decimal('1.00'), 'Leche': Decimal('1.00')})
+
+        response = self.client.post(self.url, data=b'x', content_type='application/xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalida_caches_e_indices(self):
+        self.assertEqual(self.client.get('/api/producto/autocompletar/', {'q': 'lec'}).json(), [])
+        self.assertEqual(self.client.get('/api/producto/').json()['results'][0]['producto_nombre'], 'Pan')
+        self.client.post(self.url, data=b'producto_nombre,precio\nLeche,1.00\n', content_type='text/csv')
+        autocompletado = self.client.get('/api/producto/autocompletar/', {'q': 'lec'}).json()
+        self.assertEqual([p['producto_nombre'] for p in autocompletado], ['Leche'])
+        self.assertEqual(len(self.client.get('/api/producto/').json()['results']), 2)
+        self.assertEqual(len(self.client.get('/api/producto/', {'search': 'leche'}).json()['results']), 1)
+
+
+class AjustePreciosTest(BaseApiTestCase):
+    url = '/api/producto/ajustar-precios/'
+
+    def setUp(self):
+        super().setUp()
+        for nombre, precio in (('Leche entera', '1.00'), ('Leche descremada', '2.25'), ('Pan', '0.05')):
+            Producto.objects.create(usuario=self.user, producto_nombre=nombre, precio=Decimal(precio))
+        self.otro = User.objects.create_user(username='otro', email='otro@example.com', password='x')
+        Producto.objects.create(usuario=self.otro, producto_nombre='Leche entera', precio=Decimal('1.00'))
+
+    def precios(self, usuario=None):
+        productos = Producto.objects.filter(usuario=usuario or self.user)
+        return dict(productos.values_list('producto_nombre', 'precio'))
+
+    def test_porcentaje_en_un_solo_update_con_redondeo(self):
+        self.assertEqual(self.client.get('/api/producto/').json()['results'][0]['precio'], '0.05')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, {'tipo': 'porcentaje', 'valor': '10'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'productos': 3, 'total_antes': '3.30', 'total_despues': '3.64', 'simulado': False,
+        })
+        self.assertEqual(sum(q['sql'].startswith('UPDATE "api_producto"') for q in ctx.captured_queries), 1)
+        # 2.475 -> 2.48 y 0.055 -> 0.06: la mitad se redondea hacia arriba
+        self.assertEqual(self.precios(), {
+            'Leche entera': Decimal('1.10'), 'Leche descremada': Decimal('2.48'), 'Pan': Decimal('0.06'),
+        })
+        self.assertEqual(self.precios(self.otro), {'Leche entera': Decimal('1.00')})
+        # La cache del listado se invalido
+        self.assertEqual(self.client.get('/api/producto/').json()['results'][0]['precio'], '0.06')
+
+    def test_monto_filtrado_por_nombre_e_ids(self):
+        response = self.client.post(self.url, {'tipo': 'monto', 'valor': '0.50', 'nombre': 'leche'}, format='json')
+        self.assertEqual(response.json()['productos'], 2)
+        pan = Producto.objects.get(usuario=self.user, producto_nombre='Pan')
+        entera = Producto.objects.get(usuario=self.user, producto_nombre='Leche entera')
+        response = self.client.post(self.url, {
+            'tipo': 'monto', 'valor': '1', 'nombre': 'leche', 'ids': [pan.id, entera.id],
+        }, format='json')
+        self.assertEqual(response.json()['productos'], 1)
+        self.assertEqual(self.precios(), {
+            'Leche entera': Decimal('2.50'), 'Leche descremada': Decimal('2.75'), 'Pan': Decimal('0.05'),
+        })
+
+    def test_simular_y_rechazar_precios_fuera_de_rango(self):
+        response = self.client.post(self.url, {'tipo': 'porcentaje', 'valor': '-50', 'simular': True}, format='json')
+        self.assertEqual(response.json()['total_despues'], '1.66')
+        self.assertTrue(response.json()['simulado'])
+
+        response = self.client.post(self.url, {'tipo': 'monto', 'valor': '-1.00'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, {'tipo': 'porcentaje', 'valor': '-100'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, {'tipo': 'monto', 'valor': '99999999'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.precios(), {
+            'Leche entera': Decimal('1.00'), 'Leche descremada': Decimal('2.25'), 'Pan': Decimal('0.05'),
+        })
+
+
+class FallaSMTP:
+    """Conexion de correo que siempre falla al enviar"""
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_messages(self, mensajes):
+        raise ConnectionError('smtp no disponible')
+
+
+class SinServidorSMTP(FallaSMTP):
+    """Conexion de correo que no se puede abrir (servidor caido)"""
+
+    def open(self):
+        raise ConnectionRefusedError('conexion rechazada')
+
+
+class OutboxTest(BaseApiTestCase):
+
+    def encolar(self, destinatario='cliente@example.com'):
+        mensaje = EmailMultiAlternatives(
+            subject='Hola', body='texto', from_email='fiador@example.com', to=[destinatario]
+        )
+        mensaje.attach_alternative('<p>html</p>', 'text/html')
+        return encolar_mensaje(mensaje)
+
+    def test_registro_solo_encola_el_correo(self):
+        response = self.crear_cliente_api().post('/api/user/register/', {
+            'username': 'nuevo',
+            'email': 'nuevo@example.com',
+            'recovery_email': 'otro@example.com',
+            'password': 'clave-segura-123',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(CorreoPendiente.objects.get().destinatarios, ['nuevo@example.com'])
+
+    def test_envio_por_lotes(self):
+        for i in range(3):
+            self.encolar(f'cliente{i}@example.com')
+
+        self.assertEqual(enviar_pendientes(tamano_lote=2), (2, 0))
+        self.assertEqual(enviar_pendientes(tamano_lote=2), (1, 0))
+        self.assertEqual(enviar_pendientes(tamano_lote=2), (0, 0))
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].alternatives[0][0], '<p>html</p>')
+        self.assertFalse(CorreoPendiente.objects.exclude(estado=CorreoPendiente.ENVIADO).exists())
+
+    @override_settings(EMAIL_OUTBOX_MAX_INTENTOS=2)
+    def test_reintentos_con_espera_y_fallido(self):
+        correo = self.encolar()
+
+        self.assertEqual(enviar_pendientes(connection=FallaSMTP()), (0, 1))
+        correo.refresh_from_db()
+        self.assertEqual(correo.estado, CorreoPendiente.PENDIENTE)
+        self.assertEqual(correo.intentos, 1)
+        self.assertGreater(correo.proximo_intento, timezone.now())
+
+        # Mientras no venza la espera no se vuelve a intentar
+        self.assertEqual(enviar_pendientes(connection=FallaSMTP()), (0, 0))
+
+        CorreoPendiente.objects.update(proximo_intento=timezone.now())
+        self.assertEqual(enviar_pendientes(connection=FallaSMTP()), (0, 1))
+        correo.refresh_from_db()
+        self.assertEqual(correo.estado, CorreoPendiente.FALLIDO)
+
+    @override_settings(EMAIL_OUTBOX_MAX_INTENTOS=2)
+    def test_servidor_caido_cuenta_el_intento_de_todo_el_lote(self):
+        for i in range(3):
+            self.encolar(f'cliente{i}@example.com')
+
+        self.assertEqual(enviar_pendientes(connection=SinServidorSMTP()), (0, 3))
+        for correo in CorreoPendiente.objects.all():
+            self.assertEqual(correo.estado, CorreoPendiente.PENDIENTE)
+            self.assertEqual(correo.intentos, 1)
+            self.assertEqual(correo.ultimo_error, 'conexion rechazada')
+            self.assertGreater(correo.proximo_intento, timezone.now())
+
+        CorreoPendiente.objects.update(proximo_intento=timezone.now())
+        self.assertEqual(enviar_pendientes(connection=SinServidorSMTP()), (0, 3))
+        self.assertEqual(CorreoPendiente.objects.filter(estado=CorreoPendiente.FALLIDO).count(), 3)
+
+    @skipUnless(Controller, 'aiosmtpd no esta instalado')
+    def test_envio_contra_servidor_smtp_local(self):
+        recibidos = []
+
+        class Handler:
+            async def handle_DATA(self, server, session, envelope):
+                recibidos.append(envelope.rcpt_tos)
+                return '250 OK'
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            puerto = sock.getsockname()[1]
+        controller = Controller(Handler(), hostname='127.0.0.1', port=puerto)
+        controller.start()
+        self.addCleanup(controller.stop)
+
+        self.encolar('uno@example.com')
+        self.encolar('dos@example.com')
+        connection = get_connection(
+            'django.core.mail.backends.smtp.EmailBackend',
+            host='127.0.0.1', port=puerto,
+            username='', password='', use_tls=False,
+        )
+        self.assertEqual(enviar_pendientes(connection=connection), (2, 0))
+        self.assertEqual(recibidos, [['uno@example.com'], ['dos@example.com']])
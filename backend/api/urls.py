@@ -14,6 +14,8 @@ router.register(r'producto', views.ProductoViewSet)   #endpoint
 
 urlpatterns=[
     path('', include(router.urls)),
+    path('saldo/', SaldoView.as_view(), name='saldo'),
+    path('exportar/', ExportarView.as_view(), name='exportar'),
     # Endpoints personalizados de Djoser
     path('auth/activate/', CustomUserViewSet.as_view({'post': 'activation'}), name='user-activation'),
     path('auth/activate/new-email/', ActivarNuevoEmailView.as_view(), name='activation-new-email'),
@@ -13,10 +13,18 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from api.permissions import *
+from api.pagination import FiadoPagination, ClientePagination, ProductoPagination
+from api.saldos import registrar_movimiento, cargos_del_fiado
+from api.cache_usuario import (
+    CacheRespuestaMixin, calcular_etag, coincide_etag, respuesta_condicional, version_usuario
+)
 
 from api.custom_email import *
+from api.asincrono import AsyncAPIView, AsyncGenericAPIView, en_hilo
 
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
+from api.autenticacion import TokenYaUsado, rotar_refresh
 from rest_framework_simplejwt.views import TokenRefreshView as BaseTokenRefreshView
 
 from djoser.views import UserViewSet
@@ -27,15 +35,36 @@ from rest_framework.views import APIView
 from django.core.mail import send_mail
 from drf_spectacular.utils import (
     extend_schema,
+    OpenApiParameter,
     OpenApiResponse,
     inline_serializer
 )
+from drf_spectacular.types import OpenApiTypes
 # En ConfirmarEmail (cuando mandas el correo al nuevo email)
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.views import View
 from django.db import transaction
+from django.db.models import Count, Max, Prefetch
 from django.shortcuts import render
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from api.autocompletar import autocompletar
+from api.importar import FORMATOS, ArchivoInvalido, importar_productos
+from api.precios import AjusteInvalido, ajustar_precios
+from rest_framework.parsers import MultiPartParser
+from api.busqueda import BusquedaMixin
+from api.exportar import ESCRITORES, TABLAS, acepta_gzip, acomprimir, aexportar, comprimir, exportar
+
+# ?search= de ProductoViewSet, ClienteViewSet y FiadoViewSet (api/busqueda.py)
+PARAMETRO_BUSQUEDA = OpenApiParameter(
+    'search', str,
+    description=(
+        'Busca por nombre (prefijos de cada palabra) y ordena por relevancia; pagina con ?page=. '
+        'Devuelve como maximo las 500 coincidencias mas relevantes; "truncado": true indica que habia mas'
+    ),
+)
 
 class OAuthErrorView(View):
     template_name = 'oauth_error.html'
@@ -181,14 +210,14 @@ class ActivarNuevoEmailView(APIView):
         401: OpenApiResponse(description="No autenticado")
     }
 )
-class ChangeEmailView(APIView):
+class ChangeEmailView(AsyncAPIView):
     permission_classes = [IsAuthenticated]
 
-    def post(self, request):
+    async def post(self, request):
         user = request.user  # 🔹 El email ya viene del token JWT
 
         # 🔹 Lógica para bloquear el cambio si el usuario está asociado con una cuenta social
-        if user.social_auth.exists():
+        if await user.social_auth.aexists():
             return Response(
                 {"detail": "No puedes cambiar tu email. Tu cuenta está registrada a través de Google."},
                 status=status.HTTP_400_BAD_REQUEST
@@ -215,7 +244,7 @@ class ChangeEmailView(APIView):
 
         # Enviar email con tu clase custom (respetando la URL de Djoser)
         activation_email = CustomUsernameResetEmail(request, context)
-        activation_email.send(to=[user.email])
+        await en_hilo(activation_email.send, to=[user.email])
 
         return Response(
             {"detail": "Se ha enviado un correo con el enlace de confirmación"},
@@ -226,14 +255,14 @@ class ChangeEmailView(APIView):
     request=ForgotEmailSerializer,
     description='Cambiar email olvidado'
 )
-class ForgotEmailView(APIView):
+class ForgotEmailView(AsyncAPIView):
     permission_classes = []  # acceso público
 
-    def post(self, request):
+    async def post(self, request):
         serializer = ForgotEmailSerializer(data=request.data)
-        if serializer.is_valid():
-            recovery_email = serializer.validated_data["recovery_email"]
-            user = User.objects.get(recovery_email=recovery_email)
+        if await en_hilo(serializer.is_valid):
+            # El serializer ya busco el usuario por su recovery_email
+            user = serializer.user
 
             # Generar UID y token
             uid = urlsafe_base64_encode(force_bytes(user.pk))
@@ -257,7 +286,7 @@ class ForgotEmailView(APIView):
 
             # Usamos la clase custom
             activation_email = CustomForgotEmail(request, email_context)
-            activation_email.send(to=user.recovery_email)
+            await en_hilo(activation_email.send, to=user.recovery_email)
 
             return Response(
                 {"detail": "Se ha enviado un correo con el enlace de confirmación"},
@@ -271,10 +300,10 @@ class ForgotEmailView(APIView):
     description='Confirma el cambio de email usando el UID y token del enlace'
 )
 
-class ConfirmarEmail(APIView):
-    def post(self, request, *args, **kwargs):
+class ConfirmarEmail(AsyncAPIView):
+    async def post(self, request, *args, **kwargs):
         serializer = ConfirmarEmailSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        await en_hilo(serializer.is_valid, raise_exception=True)
 
         user = serializer.user
         token = serializer.validated_data['token']
@@ -286,7 +315,7 @@ class ConfirmarEmail(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if User.objects.filter(email=new_email).exists():
+        if await User.objects.filter(email=new_email).aexists():
             return Response(
                 {"new_email": ["Este correo electrónico ya está en uso."]},
                 status=status.HTTP_400_BAD_REQUEST
@@ -295,7 +324,7 @@ class ConfirmarEmail(APIView):
         # Guardamos directamente en los nuevos campos
         user.pending_email = new_email
         user.email_change_token = default_token_generator.make_token(user)
-        user.save()
+        await user.asave()
 
         email_context = {
             'user': user,
@@ -306,7 +335,7 @@ class ConfirmarEmail(APIView):
         }
 
         activation_email = CustomEmailReset(request, email_context)
-        activation_email.send(to=[new_email])
+        await en_hilo(activation_email.send, to=[new_email])
 
         return Response(
             {"detail": "Se ha enviado un correo de confirmación al nuevo email"},
@@ -404,7 +433,7 @@ class CuentaViewSet(viewsets.ModelViewSet):
 
 
 @extend_schema_view(
-    list=extend_schema(tags=['Producto']),
+    list=extend_schema(tags=['Producto'], parameters=[PARAMETRO_BUSQUEDA]),
     retrieve=extend_schema(tags=['Producto']),
     update=extend_schema(exclude=True), # Oculta el método PUT (update)
     #Este codigo lo qeu dice es que solamente va a tener la propiedades precio y nombre 
@@ -428,10 +457,13 @@ class CuentaViewSet(viewsets.ModelViewSet):
 )
 
 
-class ProductoViewSet(viewsets.ModelViewSet):
+class ProductoViewSet(BusquedaMixin, CacheRespuestaMixin, viewsets.ModelViewSet):
     queryset = Producto.objects.all()
     serializer_class = ProductoSerializer
     permission_classes = [IsAuthenticated, MiProducto] 
+    pagination_class = ProductoPagination
+    modelo_busqueda = Producto
+    desempate_busqueda = ('-id',)
 
     def get_permissions(self):
         """
@@ -457,7 +489,7 @@ class ProductoViewSet(viewsets.ModelViewSet):
         #return queryset
 
         #Produccion
-        return queryset.filter(usuario=self.request.user)
+        return queryset.filter(usuario_id=self.request.user.id)
 
     def update(self, request, *args, **kwargs):
         if not kwargs.get('partial', False):
@@ -471,12 +503,128 @@ class ProductoViewSet(viewsets.ModelViewSet):
         kwargs['partial'] = True
         return self.update(request, *args, **kwargs) 
 
+    @extend_schema(
+        tags=['Producto'],
+        description='Productos del usuario cuyo nombre (o alguna de sus palabras) empieza con q.',
+        parameters=[
+            OpenApiParameter('q', str, required=True, description='Prefijo escrito por el usuario'),
+            OpenApiParameter('limite', int, description='Maximo de resultados (1 a 50, por defecto 10)'),
+        ],
+        responses={200: inline_serializer(
+            name='AutocompletarProducto',
+            fields={
+                'id': serializers.IntegerField(),
+                'producto_nombre': serializers.CharField(),
+                'precio': serializers.DecimalField(max_digits=10, decimal_places=2),
+            },
+            many=True,
+        )},
+    )
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def autocompletar(self, request):
+        # Se responde desde el indice en memoria, sin consultar la base de datos
+        try:
+            limite = min(max(int(request.query_params.get('limite', 10)), 1), 50)
+        except ValueError:
+            return Response({'error': 'limite debe ser un numero'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(autocompletar(request.user.id, request.query_params.get('q', ''), limite))
+
+    @extend_schema(
+        tags=['Producto'],
+        description=(
+            'Importa productos desde CSV (columnas producto_nombre y precio) o JSON Lines, '
+            'en el cuerpo (Content-Type text/csv o application/x-ndjson) o como archivo '
+            'multipart en el campo "archivo". Si el nombre ya existe se actualiza el precio. '
+            'Las filas con errores se omiten y se listan en la respuesta.'
+        ),
+        parameters=[OpenApiParameter('formato', str, enum=['csv', 'jsonl'], description='Si no se deduce del archivo')],
+        request={
+            'text/csv': OpenApiTypes.BINARY,
+            'application/x-ndjson': OpenApiTypes.BINARY,
+            'multipart/form-data': inline_serializer(
+                name='ImportarProductos', fields={'archivo': serializers.FileField()}
+            ),
+        },
+        responses={
+            200: inline_serializer(
+                name='ImportarProductosResultado',
+                fields={
+                    'filas': serializers.IntegerField(),
+                    'creados': serializers.IntegerField(),
+                    'actualizados': serializers.IntegerField(),
+                    'total_errores': serializers.IntegerField(),
+                    'errores': serializers.ListField(child=serializers.DictField()),
+                },
+            ),
+            400: OpenApiResponse(description=(
+                'Archivo ilegible, vacio o de formato desconocido. Si el error aparece a mitad del '
+                'archivo, los lotes anteriores ya se guardaron y la respuesta trae el mismo reporte'
+            )),
+        },
+    )
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser])
+    def importar(self, request):
+        # El cuerpo CSV/JSONL se lee del stream linea por linea, sin pasar por request.data
+        formato = request.query_params.get('formato')
+        tipo = request.content_type.split(';')[0].strip().lower()
+        if tipo.startswith('multipart/'):
+            archivo = request.FILES.get('archivo')
+            if archivo is not None and formato is None:
+                formato = 'jsonl' if archivo.name.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+        else:
+            archivo = request.stream
+            formato = formato or FORMATOS.get(tipo)
+
+        if archivo is None:
+            return Response({'error': 'No se envio ningun archivo'}, status=status.HTTP_400_BAD_REQUEST)
+        if formato not in FORMATOS.values():
+            return Response({'error': 'Formato no soportado'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            resultado = importar_productos(request.user.id, archivo, formato)
+        except ArchivoInvalido as e:
+            # Los lotes anteriores al error ya se guardaron: se informa cuantos
+            datos = e.resultado.como_dict() if e.resultado else {}
+            return Response({'error': str(e), **datos}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(resultado.como_dict(), status=status.HTTP_200_OK)
+
+    @extend_schema(
+        tags=['Producto'],
+        description=(
+            'Ajusta en una sola operacion el precio de los productos del usuario: un porcentaje '
+            '(10 sube 10%, -5 baja 5%) o un monto fijo, redondeado a 2 decimales. nombre filtra '
+            'con el mismo criterio que ?search= e ids limita a esos productos. Con simular solo '
+            'devuelve el resumen.'
+        ),
+        request=AjustePreciosSerializer,
+        responses={
+            200: inline_serializer(
+                name='AjustePreciosResultado',
+                fields={
+                    'productos': serializers.IntegerField(),
+                    'total_antes': serializers.DecimalField(max_digits=14, decimal_places=2),
+                    'total_despues': serializers.DecimalField(max_digits=14, decimal_places=2),
+                    'simulado': serializers.BooleanField(),
+                },
+            ),
+            400: OpenApiResponse(description='Datos invalidos o precios fuera de rango'),
+        },
+    )
+    @action(detail=False, methods=['post'], url_path='ajustar-precios')
+    def ajustar_precios(self, request):
+        serializer = AjustePreciosSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            resumen = ajustar_precios(request.user.id, **serializer.validated_data)
+        except AjusteInvalido as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(resumen, status=status.HTTP_200_OK)
+
 
 
 ###################################CLLIENTE###############################################
 
 @extend_schema_view(
-    list=extend_schema(tags=['Cliente']),
+    list=extend_schema(tags=['Cliente'], parameters=[PARAMETRO_BUSQUEDA]),
     retrieve=extend_schema(tags=['Cliente']),
     update=extend_schema(exclude=True),  # Oculta el método PUT (update)
     partial_update=extend_schema(
@@ -494,10 +642,13 @@ class ProductoViewSet(viewsets.ModelViewSet):
     create=extend_schema(tags=['Cliente']),  
     destroy=extend_schema(tags=['Cliente']),
 )
-class ClienteViewSet(viewsets.ModelViewSet):
+class ClienteViewSet(BusquedaMixin, CacheRespuestaMixin, viewsets.ModelViewSet):
     queryset = Cliente.objects.all()
     serializer_class = ClienteSerializer
     permission_classes = [IsAuthenticated, MiCliente]
+    pagination_class = ClientePagination
+    modelo_busqueda = Cliente
+    desempate_busqueda = ('-id',)
 
     def get_permissions(self):
             """
@@ -523,7 +674,15 @@ class ClienteViewSet(viewsets.ModelViewSet):
         #return queryset
         
         #Produccion
-        return queryset.filter(fiador=self.request.user)
+        return queryset.filter(fiador_id=self.request.user.id)
+
+    def perform_destroy(self, instance):
+        # El SaldoCliente se borra en cascada, pero hay que descontarlo del saldo del fiador
+        with transaction.atomic():
+            saldo = SaldoCliente.objects.filter(cliente=instance).first()
+            if saldo:
+                registrar_movimiento(instance, cargos=-saldo.cargos, abonos=-saldo.abonos)
+            instance.delete()
     
     def update(self, request, *args, **kwargs):
         if not kwargs.get('partial', False):
@@ -543,7 +702,7 @@ class ClienteViewSet(viewsets.ModelViewSet):
 ###################################3333333#FIADO###############################################
 
 @extend_schema_view(
-    list=extend_schema(tags=['Fiado']),
+    list=extend_schema(tags=['Fiado'], parameters=[PARAMETRO_BUSQUEDA]),
     retrieve=extend_schema(tags=['Fiado']),
     update=extend_schema(exclude=True),  # Oculta el método PUT (update)
     partial_update=extend_schema(
@@ -571,23 +730,62 @@ class ClienteViewSet(viewsets.ModelViewSet):
     ),
     destroy=extend_schema(tags=['Fiado']),
 )
-class FiadoViewSet(viewsets.ModelViewSet):
+class FiadoViewSet(BusquedaMixin, viewsets.ModelViewSet):
     queryset = Fiado.objects.all().order_by('-fecha_registro')  # El "-" indica DESC (más nuevo primero)
     serializer_class = FiadoSerializer
     permission_classes = [IsAuthenticated, MiFiado]
+    pagination_class = FiadoPagination
+    # ?search= busca por el nombre del cliente
+    modelo_busqueda = Cliente
+    campo_busqueda = 'cliente_id'
+    desempate_busqueda = ('-fecha_registro',)
 
 
     def get_permissions(self):
+        # MiFiado solo se evalua sobre objetos (retrieve, partial_update, destroy);
+        # el resto de acciones ya esta limitado por get_queryset y validate_cliente
         if self.action in ['retrieve', 'partial_update', 'destroy']:
-            return [IsAuthenticated()]
-        return [IsAuthenticated(), MiFiado()]
+            return [IsAuthenticated(), MiFiado()]
+        return [IsAuthenticated()]
     
     def get_queryset(self):
         """
         Filtra los fiados para que cada usuario solo vea los suyos
         """
         queryset = super().get_queryset()
-        return queryset.filter(cliente__fiador=self.request.user)  # Solo fiados del usuario actual
+        # Se cargan las deudas pendientes y sus productos en consultas fijas,
+        # sin importar cuantos fiados tenga el usuario
+        deudas = DeudaPendiente.objects.select_related('productos').order_by('fecha_registro')
+        return queryset.filter(cliente__fiador_id=self.request.user.id).select_related('cliente').prefetch_related(
+            Prefetch('deudapendiente_set', queryset=deudas)
+        )  # Solo fiados del usuario actual
+
+    # Peticiones condicionales: la app consulta los fiados seguido para refrescar saldos.
+    # El ETag sale de fecha_actualizacion (y de la version de cache del usuario, que cambia
+    # si se renombra un cliente o cambia el precio de un producto) sin serializar nada
+    def list(self, request, *args, **kwargs):
+        resumen = self.filter_queryset(self.get_queryset()).aggregate(
+            ultima=Max('fecha_actualizacion'), total=Count('id')
+        )
+        etag = calcular_etag(
+            request.user.id, version_usuario(request.user.id),
+            resumen['ultima'], resumen['total'], request.build_absolute_uri()
+        )
+        if coincide_etag(request, etag):
+            return respuesta_condicional(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+        return respuesta_condicional(super().list(request, *args, **kwargs), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        actualizado = self.get_queryset().filter(pk=kwargs.get('pk')).values_list(
+            'fecha_actualizacion', flat=True
+        ).first()
+        if actualizado is None:
+            return super().retrieve(request, *args, **kwargs)  # 404 normal
+
+        etag = calcular_etag(request.user.id, version_usuario(request.user.id), kwargs.get('pk'), actualizado)
+        if coincide_etag(request, etag):
+            return respuesta_condicional(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+        return respuesta_condicional(super().retrieve(request, *args, **kwargs), etag)
 
     def update(self, request, *args, **kwargs):
         if not kwargs.get('partial', False):
@@ -601,6 +799,90 @@ class FiadoViewSet(viewsets.ModelViewSet):
         kwargs['partial'] = True
         return self.update(request, *args, **kwargs) 
 
+    def perform_destroy(self, instance):
+        # Descontar del saldo del cliente y del fiador todo lo que aportaba este fiado
+        with transaction.atomic():
+            registrar_movimiento(
+                instance.cliente,
+                cargos=-cargos_del_fiado(instance),
+                abonos=-(instance.abono or Decimal("0.00")),
+            )
+            instance.delete()
+
+
+@extend_schema(
+    tags=['Fiado'],
+    description='Totales de la cartera del usuario autenticado: cargos, abonos y deuda total de todos sus clientes.',
+    responses={
+        200: inline_serializer(
+            name='SaldoResponse',
+            fields={
+                'cargos': serializers.DecimalField(max_digits=14, decimal_places=2),
+                'abonos': serializers.DecimalField(max_digits=14, decimal_places=2),
+                'deuda_total': serializers.DecimalField(max_digits=14, decimal_places=2),
+            }
+        )
+    }
+)
+class SaldoView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # Una sola consulta por el indice unico de SaldoFiador.fiador
+        saldo = SaldoFiador.objects.filter(fiador_id=request.user.id).first() or SaldoFiador()
+        return Response({
+            'cargos': str(saldo.cargos),
+            'abonos': str(saldo.abonos),
+            'deuda_total': str(saldo.deuda_total),
+        }, status=status.HTTP_200_OK)
+
+
+@extend_schema(
+    tags=['Exportar'],
+    description=(
+        'Descarga el historial completo del usuario autenticado. JSONL incluye todas las tablas '
+        '(cada linea lleva su "tabla"); CSV exporta una tabla a la vez. Se comprime con gzip '
+        'si el cliente envia Accept-Encoding: gzip.'
+    ),
+    parameters=[
+        OpenApiParameter('formato', str, enum=list(ESCRITORES), description='jsonl (por defecto) o csv'),
+        OpenApiParameter('tabla', str, enum=list(TABLAS), description='Obligatoria con formato=csv'),
+    ],
+    responses={200: OpenApiTypes.BINARY, 400: OpenApiResponse(description='Formato o tabla invalidos')},
+)
+class ExportarView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        formato = request.query_params.get('formato', 'jsonl')
+        if formato not in ESCRITORES:
+            return Response({'error': 'Formato no soportado'}, status=status.HTTP_400_BAD_REQUEST)
+
+        tabla = request.query_params.get('tabla')
+        if tabla is not None and tabla not in TABLAS:
+            return Response({'error': 'Tabla no soportada'}, status=status.HTTP_400_BAD_REQUEST)
+        if tabla is None and formato == 'csv':
+            return Response({'error': 'El CSV requiere el parametro tabla'}, status=status.HTTP_400_BAD_REQUEST)
+        tablas = [tabla] if tabla else list(TABLAS)
+
+        gzip = acepta_gzip(request.headers.get('Accept-Encoding', ''))
+        # En ASGI el contenido tiene que ser asincrono para no cargarse completo en memoria
+        if settings.SERVIDOR_ASGI:
+            contenido = aexportar(request.user.id, tablas, formato)
+            if gzip:
+                contenido = acomprimir(contenido)
+        else:
+            contenido = exportar(request.user.id, tablas, formato)
+            if gzip:
+                contenido = comprimir(contenido)
+
+        response = StreamingHttpResponse(contenido, content_type=ESCRITORES[formato].content_type)
+        response['Content-Disposition'] = f'attachment; filename="fiador-{tabla or "historial"}.{formato}"'
+        if gzip:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
 
 @extend_schema(tags=['Token'], request=RefreshTokenSerializer)
 class TokenRefreshView(generics.GenericAPIView):
@@ -613,22 +895,27 @@ class TokenRefreshView(generics.GenericAPIView):
         refresh = serializer.validated_data.get('refresh')
 
         if refresh:
+            # Cada refresh token se puede usar una sola vez: se revoca y se entrega uno nuevo
             try:
-                token = RefreshToken(refresh)
-                access_token = token.access_token
-                return Response({'access': str(access_token)}, status=status.HTTP_200_OK)
-            except Exception as e:
+                token = rotar_refresh(refresh)
+            except TokenYaUsado:
+                return Response({'error': 'Token revocado'}, status=status.HTTP_400_BAD_REQUEST)
+            except TokenError:
                 return Response({'error': 'Token inválido'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                {'access': str(token.access_token), 'refresh': str(token)}, status=status.HTTP_200_OK
+            )
         return Response({'error': 'Se requiere el token de refresco'}, status=status.HTTP_400_BAD_REQUEST)
 
 
 
 @extend_schema(tags=['Login'])
-class LoginView(generics.GenericAPIView):
+class LoginView(AsyncGenericAPIView):
     serializer_class = LoginSerializer
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        # Busca el usuario y verifica el hash de la contraseña (lo mas costoso del login)
+        await en_hilo(serializer.is_valid, raise_exception=True)
         user = serializer.validated_data['user']
         
         if not user.is_active:
@@ -0,0 +1,46 @@
+"""
+Sitio de administracion que no guarda historial (django_admin_log).
+
+Antes DisableAdminLogMiddleware reemplazaba LogEntry.save en la clase durante cada
+peticion del admin; con varios hilos o en ASGI eso se mezclaba entre peticiones
+(otras peticiones perdian sus registros o el save original se perdia). Ahora cada
+ModelAdmin registrado en el sitio simplemente no escribe el historial.
+"""
+
+from django.contrib import admin
+
+
+class SinHistorialMixin:
+    """
+    Anula los metodos con los que ModelAdmin escribe en LogEntry
+    """
+
+    def log_addition(self, request, obj, message):
+        return None
+
+    def log_change(self, request, obj, message):
+        return None
+
+    def log_deletion(self, request, obj, object_repr):
+        return None
+
+    def log_deletions(self, request, queryset):
+        return None
+
+
+class SinHistorialAdminSite(admin.AdminSite):
+    """
+    Sitio por defecto del proyecto (ver fiados.apps.FiadosAdminConfig). Agrega
+    SinHistorialMixin a todas las clases que se registran, incluidas las de otras
+    apps como social_django
+    """
+
+    def register(self, model_or_iterable, admin_class=None, **options):
+        admin_class = admin_class or admin.ModelAdmin
+        if not issubclass(admin_class, SinHistorialMixin):
+            admin_class = type(
+                admin_class.__name__,
+                (SinHistorialMixin, admin_class),
+                {'__module__': admin_class.__module__},
+            )
+        super().register(model_or_iterable, admin_class, **options)
@@ -0,0 +1,5 @@
+from django.contrib.admin.apps import AdminConfig
+
+
+class FiadosAdminConfig(AdminConfig):
+    default_site = 'fiados.admin.SinHistorialAdminSite'
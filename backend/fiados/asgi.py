@@ -5,12 +5,37 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+Para produccion: WEB_CONCURRENCY=2 uvicorn fiados.asgi:application, con CACHE_URL
+compartida entre procesos (ver README).
 """
 
 import os
 
+from asgiref.wsgi import WsgiToAsgi
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fiados.settings')
+# Le indica a settings.py que arme la pila de middleware solo con middleware asincrono
+os.environ.setdefault('DJANGO_ASGI', '1')
+
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402 (despues de cargar Django)
+from whitenoise import WhiteNoise  # noqa: E402
+
+
+def _no_encontrado(environ, start_response):
+    start_response('404 Not Found', [('Content-Type', 'text/plain')])
+    return [b'Not Found']
+
+
+# WhiteNoise es WSGI: solo las rutas de STATIC_URL pasan por un hilo, el resto de
+# peticiones llega a Django sin salir del event loop
+estaticos = WsgiToAsgi(WhiteNoise(_no_encontrado, root=settings.STATIC_ROOT, prefix=settings.STATIC_URL))
+
 
-application = get_asgi_application()
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'].startswith(settings.STATIC_URL):
+        return await estaticos(scope, receive, send)
+    return await django_application(scope, receive, send)
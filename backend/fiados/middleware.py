@@ -1,85 +1,72 @@
 from django.http import HttpResponseForbidden
 from django.conf import settings
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+import hmac
+import re
+
+class ApiAccessMiddleware:
+    """
+    Reune lo que antes hacian BlockPostmanMiddleware y CustomHeaderMiddleware:
+    - Bloquea peticiones hechas desde Postman (por el User-Agent)
+    - Exige el header secreto (settings.SECURE_API_HEADER) salvo en las rutas exentas
+
+    Todo lo que no cambia entre peticiones (regex de rutas exentas, nombre del header
+    en request.META, valor secreto) se prepara una sola vez al crear el middleware.
+    Funciona tanto en WSGI como en ASGI
+    """
+    async_capable = True
+    sync_capable = True
 
-class BlockPostmanMiddleware:
+    exempt_paths = [
+        '/admin/',
+        '/static/',
+        '/staticfiles/',
+        '/serviceworker.js',
+        '/manifest.json',
+        '/offline/',
+        '/api/auth/o/',           
+        '/complete/',             
+        '/api/oauth-error/',      
+    ]
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+        # Una sola alternancia precompilada en lugar de un startswith por ruta
+        self.exempt_regex = re.compile('|'.join(re.escape(path) for path in self.exempt_paths))
+        # request.headers arma un diccionario con todos los headers, request.META no
+        self.secret_meta_key = 'HTTP_' + settings.SECURE_API_HEADER.upper().replace('-', '_')
+        self.secret_value = settings.SECURE_API_VALUE.encode()
 
     def __call__(self, request):
-        user_agent = request.META.get('HTTP_USER_AGENT', '').lower()
-        if 'postman' in user_agent:
-            return HttpResponseForbidden("Acceso denegado")
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.check_request(request)
+        if response is not None:
+            return response
         return self.get_response(request)
-    
-import re
 
-class CustomHeaderMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-        self.exempt_paths = [
-            '/admin/',
-            '/static/',
-            '/staticfiles/',
-            '/serviceworker.js',
-            '/manifest.json',
-            '/offline/',
-            '/api/auth/o/',           
-            '/complete/',             
-            '/api/oauth-error/',      
-        ]
-        # Compilar patrones regex para las rutas que los necesiten
-        self.regex_patterns = [
-            re.compile(r'^/api/auth/o/'),
-            re.compile(r'^/complete/'),
-            re.compile(r'^/api/oauth-error/'),  
-        ]
+    async def __acall__(self, request):
+        response = self.check_request(request)
+        if response is not None:
+            return response
+        return await self.get_response(request)
+
+    def check_request(self, request):
+        # str.lower() + `in` resulta mas rapido que una regex con IGNORECASE para un User-Agent
+        if 'postman' in request.META.get('HTTP_USER_AGENT', '').lower():
+            return HttpResponseForbidden("Acceso denegado")
 
-    def __call__(self, request):
         # Verificar si la ruta está exenta
         if self.is_exempt(request.path):
-            return self.get_response(request)
-            
-        # Verificar el header personalizado
-        secret_header = request.headers.get(settings.SECURE_API_HEADER)
-        if secret_header != settings.SECURE_API_VALUE:
-            return HttpResponseForbidden("Acceso no autorizado")
-            
-        return self.get_response(request)
-    
-    def is_exempt(self, path):
-        # Verificar coincidencias exactas
-        if any(path.startswith(exempt_path) for exempt_path in self.exempt_paths):
-            return True
-        
-        # Verificar patrones regex
-        if any(pattern.match(path) for pattern in self.regex_patterns):
-            return True
-            
-        return False
-    
+            return None
 
-#Eliminar registros en la coleccion admin_log_entry que es relativamente el historial de acciones realizadas del admin
-class DisableAdminLogMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-        self.original_save = None  # Inicializa la variable aquí
-    def __call__(self, request):
-        response = self.get_response(request)
-        return response
-    def process_view(self, request, view_func, view_args, view_kwargs):
-        # Si es una acción del admin, deshabilitar logging
-        if hasattr(view_func, 'admin_site'):
-            # Deshabilitar temporalmente el logging
-            from django.contrib.admin.models import LogEntry
-            self.original_save = LogEntry.save  # Guarda el método original
-            def noop_save(self, *args, **kwargs):
-                return
-            LogEntry.save = noop_save
-            request._admin_log_disabled = True
+        # Verificar el header personalizado (comparacion en tiempo constante)
+        secret_header = request.META.get(self.secret_meta_key, '')
+        if not hmac.compare_digest(secret_header.encode(), self.secret_value):
+            return HttpResponseForbidden("Acceso no autorizado")
         return None
-    def process_response(self, request, response):
-        # Restaurar el comportamiento original si fue deshabilitado
-        if hasattr(request, '_admin_log_disabled'):
-            from django.contrib.admin.models import LogEntry
-            LogEntry.save = self.original_save  # Usa el método guardado
-        return response
\ No newline at end of file
+
+    def is_exempt(self, path):
+        return self.exempt_regex.match(path) is not None
@@ -18,6 +18,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 import os 
 from datetime import timedelta
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
@@ -34,7 +36,7 @@ ALLOWED_HOSTS = []
 
 INSTALLED_APPS = [
     'jazzmin',
-    'django.contrib.admin',
+    'fiados.apps.FiadosAdminConfig',  # admin sin historial de acciones (fiados/admin.py)
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -54,9 +56,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # Debe ir antes de cualquier middleware que maneje solicitudes
-    'fiados.middleware.BlockPostmanMiddleware',
-    'fiados.middleware.CustomHeaderMiddleware',
-    'fiados.middleware.DisableAdminLogMiddleware', 
+    'fiados.middleware.ApiAccessMiddleware',  # Bloquea Postman y exige el header secreto
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', 
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -67,6 +67,17 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware', 
 ]
 
+# Modo ASGI (fiados/asgi.py pone DJANGO_ASGI=1 antes de cargar los settings).
+# WhiteNoiseMiddleware es solo sincrono y obligaria a Django a pasar cada peticion
+# por un hilo; en ASGI los estaticos los sirve fiados/asgi.py antes de llegar a Django
+SERVIDOR_ASGI = os.environ.get('DJANGO_ASGI') == '1'
+if SERVIDOR_ASGI:
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
+# Maximo de tareas bloqueantes (ORM, hash de contraseñas, correos) que las vistas
+# asincronas ejecutan a la vez en hilos por proceso (ver api/asincrono.py)
+ASYNC_MAX_BLOQUEANTES = int(os.environ.get('ASYNC_MAX_BLOQUEANTES', os.environ.get('DB_POOL_MAX', 10)))
+
 ROOT_URLCONF = 'fiados.urls'
 
 TEMPLATES = [
@@ -225,18 +236,113 @@ JAZZMIN_UI_TWEAKS = {
 
 
 WSGI_APPLICATION = 'fiados.wsgi.application'
+ASGI_APPLICATION = 'fiados.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-#Base de datos en desarrollo
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# La base de datos se elige con variables de entorno:
+#   DB_ENGINE=sqlite (por defecto, desarrollo) o DB_ENGINE=postgres (produccion)
+#   DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+#   DB_CONN_MAX_AGE: segundos que se reutiliza una conexion (conexiones persistentes)
+#   DB_POOL: vacio (sin pool), 'psycopg' (pool de Django, requiere psycopg[pool])
+#            o 'pgbouncer' (pool externo en modo transaccion)
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite').lower()
+
+if DB_ENGINE in ('postgres', 'postgresql'):
+    DB_POOL = os.environ.get('DB_POOL', '').lower()
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'fiador'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Reutiliza la conexion entre peticiones y verifica que siga viva antes de usarla
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
     }
-}
+    if SERVIDOR_ASGI:
+        # En ASGI cada peticion usa su propio hilo para el ORM y las conexiones
+        # persistentes no se reutilizarian; se usa el pool (DB_POOL) en su lugar
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+    if DB_POOL == 'psycopg':
+        # El pool de Django no admite conexiones persistentes, el pool se encarga de reutilizarlas
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX', 10)),
+            'timeout': 10,
+        }
+    elif DB_POOL == 'pgbouncer':
+        # PgBouncer en modo transaccion no soporta cursores del lado del servidor
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+else:
+    #Base de datos en desarrollo
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Espera hasta 20s por el bloqueo en lugar de fallar con "database is locked"
+                'timeout': 20,
+                # Toma el bloqueo de escritura al iniciar la transaccion, asi dos escrituras
+                # simultaneas esperan en orden en vez de fallar al subir de lectura a escritura
+                'transaction_mode': 'IMMEDIATE',
+                # WAL permite leer mientras otro proceso escribe
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA busy_timeout=20000;'
+                    'PRAGMA cache_size=-20000;'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+            },
+            # Las pruebas usan un archivo y no la base en memoria compartida: esta bloquea
+            # tablas completas entre hilos sin respetar el timeout
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+# Cache: en memoria local por defecto (desarrollo y pruebas). En produccion se usa
+# Redis (o compatible, como Valkey/KeyDB) con CACHE_URL=redis://host:6379/0,
+# requiere `pip install redis`
+if os.environ.get('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CACHE_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'fiador',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+
+# Procesos del servidor: gunicorn y uvicorn toman de WEB_CONCURRENCY la cantidad
+# de workers cuando no se pasa --workers
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# Respuestas de listados/detalles cacheadas por usuario (api/cache_usuario.py).
+# Las versiones que las invalidan viven en esta cache: con varios procesos tiene
+# que ser compartida, con LocMemCache cada proceso solo ve sus propias escrituras
+RESPONSE_CACHE_ALIAS = 'default'
+if WEB_CONCURRENCY > 1 and CACHES[RESPONSE_CACHE_ALIAS]['BACKEND'].endswith('LocMemCache'):
+    raise ImproperlyConfigured(
+        'WEB_CONCURRENCY > 1 requiere una cache compartida: define CACHE_URL (Redis)'
+    )
+RESPONSE_CACHE_TIMEOUT = 300
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -256,6 +362,25 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Hasher de contraseñas (api/hashers.py). PASSWORD_HASHER elige con cual se guardan
+# las contraseñas: argon2 (por defecto), scrypt o pbkdf2. Los demas quedan para
+# verificar los hashes existentes, que se regeneran con el elegido en el siguiente login
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'argon2').lower()
+_PASSWORD_HASHERS = {
+    'argon2': 'api.hashers.Argon2Ajustado',
+    'scrypt': 'api.hashers.ScryptAjustado',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for perfil, hasher in _PASSWORD_HASHERS.items() if perfil != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+# Parametros medidos con `python manage.py bench_login` (logins por segundo por nucleo):
+# argon2id con el minimo recomendado por OWASP (19 MiB, 2 pasadas) ~25/s,
+# PBKDF2 con el 1.000.000 de iteraciones de Django ~2/s
+PASSWORD_ARGON2 = {'time_cost': 2, 'memory_cost': 19456, 'parallelism': 1}
+PASSWORD_SCRYPT = {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
@@ -327,7 +452,8 @@ REST_FRAMEWORK = {
 
     #DRF JWT
        'DEFAULT_AUTHENTICATION_CLASSES': (
-           'rest_framework_simplejwt.authentication.JWTAuthentication',
+           # JWTAuthentication con el usuario en cache unos segundos en las lecturas (api/autenticacion.py)
+           'api.autenticacion.JWTAutenticacionRapida',
        ),
 
     #PERMISOS
@@ -337,6 +463,15 @@ REST_FRAMEWORK = {
   
    }
 
+# Segundos que JWTAutenticacionRapida reutiliza en las lecturas el User cargado de la base de datos
+JWT_USUARIO_CACHE_SEGUNDOS = 30
+# jti revocados que cada proceso recuerda en memoria antes de consultar TokenRevocado
+JWT_REVOCADOS_MEMORIA = 10000
+# Bytes por proceso para los indices de autocompletado de productos (api/autocompletar.py)
+AUTOCOMPLETAR_MEMORIA = int(os.environ.get('AUTOCOMPLETAR_MEMORIA', 32 * 1024 * 1024))
+# Segundos como maximo que se usa un indice antes de reconstruirlo aunque su version no cambie
+AUTOCOMPLETAR_EDAD_MAXIMA = 300
+
 SIMPLE_JWT = {
     'ALGORITHM': 'HS256',
     'AUTH_HEADER_TYPES': ('Bearer',),
@@ -360,15 +495,15 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=365*100),  # 100 años (prácticamente nunca)
 
     #'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
-    'REFRESH_TOKEN_LIFETIME': timedelta(days=365*100),  # 100 años (prácticamente nunca)
-    # Tiempo de vida del token de refresco cuando se usa para renovar (default: None)
-    'ROTATE_REFRESH_TOKENS': True,
-    'BLACKLIST_AFTER_ROTATION': True,
+    # Cada uso del refresh token entrega uno nuevo con otros REFRESH_TOKEN_LIFETIME,
+    # asi que solo vence si no se usa en ese tiempo. Los jti revocados se guardan
+    # hasta entonces (api/autenticacion.py, `python manage.py podar_tokens`)
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=int(os.environ.get('JWT_REFRESH_DIAS', 30))),
 
-    # Permite renovar el refresh token cada vez que se usa
+    # Permite renovar el refresh token cada vez que se usa (TokenRefreshView)
     'ROTATE_REFRESH_TOKENS': True,
     
-    # Invalida los refresh tokens después de usarlos
+    # Invalida los refresh tokens después de usarlos (TokenRevocado)
     'BLACKLIST_AFTER_ROTATION': True,
     
     # Actualiza la última hora de inicio de sesión del usuario
@@ -383,6 +518,14 @@ EMAIL_HOST_PASSWORD = 'tucrendenciales'
 EMAIL_USE_TLS = True
 
 DEFAULT_FROM_EMAIL = 'tucorreo'
+
+# Bandeja de salida (api/outbox.py): las vistas solo encolan y el worker
+# `python manage.py enviar_correos` envia por lotes con una sola conexion SMTP
+EMAIL_OUTBOX_LOTE = 50
+EMAIL_OUTBOX_MAX_INTENTOS = 5
+EMAIL_OUTBOX_BACKOFF_SEGUNDOS = 30
+EMAIL_OUTBOX_BACKOFF_MAXIMO_SEGUNDOS = 3600
+EMAIL_OUTBOX_PLAZO_SEGUNDOS = 300
 DOMAIN = 'localhost:8100'
 SITE_NAME = 'Fiador' 
 PROTOCOL = 'http'
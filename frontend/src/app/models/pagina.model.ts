@@ -0,0 +1,6 @@
+// Respuesta paginada por cursor de los listados de la API
+export interface Pagina<T> {
+  next: string | null;
+  previous: string | null;
+  results: T[];
+}
@@ -2,6 +2,7 @@ import { inject, Injectable } from '@angular/core';
 import { HttpClient, HttpHeaders } from '@angular/common/http';
 import { Router } from '@angular/router';
 import { catchError, map, Observable, of } from 'rxjs';
+import { obtenerTodasLasPaginas } from './paginacion';
 import { api } from '../api/api';
 import { Cliente } from '../models/cliente.model';
 
@@ -31,7 +32,7 @@ export class ClienteService {
     const token = this.getToken();
     const headers = new HttpHeaders().set('Authorization', `Bearer ${token}`);
 
-    return this.http.get<any>(`${this.apiUrl}cliente/`, { headers }).pipe(
+    return obtenerTodasLasPaginas<Cliente>(this.http, `${this.apiUrl}cliente/`, headers).pipe(
       map((response) => {
         const userId = Number(localStorage.getItem('userId'));
         return response.filter((cliente: Cliente) => cliente.fiador === userId);
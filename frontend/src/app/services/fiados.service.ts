@@ -1,5 +1,6 @@
 import { HttpClient, HttpHeaders } from '@angular/common/http';
 import { inject, Injectable } from '@angular/core';
+import { obtenerTodasLasPaginas } from './paginacion';
 import { api } from '../api/api';
 import { Router } from '@angular/router';
 import { catchError, map, Observable, of, throwError } from 'rxjs';
@@ -36,7 +37,7 @@ export class FiadosService {
     const token = this.getToken();
     const headers = new HttpHeaders().set('Authorization', `Bearer ${token}`);
 
-    return this.http.get<Fiado[]>(`${this.apiUrl}fiado/`, { headers }).pipe(
+    return obtenerTodasLasPaginas<Fiado>(this.http, `${this.apiUrl}fiado/`, headers).pipe(
       catchError(error => {
         //console.error('Error obteniendo Fiador:', error);
         return of([]); // Retorna un array vacío en caso de error
@@ -0,0 +1,13 @@
+import { HttpClient, HttpHeaders } from '@angular/common/http';
+import { EMPTY, expand, map, Observable, reduce } from 'rxjs';
+import { Pagina } from '../models/pagina.model';
+
+// Recorre todas las paginas de un listado siguiendo "next" hasta que sea null
+// y devuelve los resultados juntos en un solo array
+export function obtenerTodasLasPaginas<T>(http: HttpClient, url: string, headers: HttpHeaders): Observable<T[]> {
+  return http.get<Pagina<T>>(url, { headers }).pipe(
+    expand(pagina => pagina.next ? http.get<Pagina<T>>(pagina.next, { headers }) : EMPTY),
+    map(pagina => pagina.results),
+    reduce((todos: T[], resultados: T[]) => todos.concat(resultados), [])
+  );
+}
@@ -2,6 +2,7 @@ import { inject, Injectable } from '@angular/core';
 import { HttpClient, HttpHeaders } from '@angular/common/http';
 import { Router } from '@angular/router';
 import { catchError, map, Observable, of } from 'rxjs';
+import { obtenerTodasLasPaginas } from './paginacion';
 import { api } from '../api/api';
 import { Producto } from '../models/producto.model';
 
@@ -32,7 +33,7 @@ export class ProductoService {
     const token = this.getToken();
     const headers = new HttpHeaders().set('Authorization', `Bearer ${token}`);
 
-    return this.http.get<any>(`${this.apiUrl}producto/`, { headers }).pipe(
+    return obtenerTodasLasPaginas<Producto>(this.http, `${this.apiUrl}producto/`, headers).pipe(
       map((response) => {
         const userId = Number(localStorage.getItem('userId'));
         return response.filter((producto: Producto) => producto.usuario === userId);